@@ -20,6 +20,8 @@ authenticate using `automerge login`
 
 *merge*: merge all valid PRs in current account
 
+*daemon*: keep merging valid PRs from a warm, long-running process
+
 ***
 
 **util. functions**
@@ -32,75 +34,477 @@ authenticate using `automerge login`
 
 *_prs*: get prs for a given repo
 
+*_fetch_prs*: fetch all PRs of a given repo
+
+*Hedger*: hedge calls that run past a learned latency percentile
+
 *_stats*: get stats for current account
 
 *_display*: display info abount current account
 
 *_merge*: take the name of a repo + a PR num & merge if stable
 
+*_schedule*: order PRs into waves of non-conflicting merges
+
+*_merge_repo*: merge a repo's stable PRs using the selected backend
+
+*_merge_queue*: check if a repo's default branch has a merge queue
+
+*_queue_status*: get the entries currently in a repo's merge queue
+
+*digest*: summarize a cycle's events in a single message
+
+*from_env*: build the notification hub (Slack / webhook / JSONL file)
+
 ***
 """
 import os
 import time
-import json
+import atexit
+import importlib
+import itertools
 import subprocess
 
 import click
-import requests
-import rich
-from rich.console import Console
-from rich.style import Style
 
 from automerge import _version
-from automerge.utils import _stats, _display, _repos, _merge
+from automerge.notify import digest, from_env
+from automerge.instrument import phase, observe, Profiler
+from automerge.output import Writer
+from automerge.plan import build as build_plan, estimate, report
+from automerge.selector import compile_selector, validate as validate_selector
+from automerge.utils import (
+    Lazy,
+    lazy_import,
+    from_pr_ref,
+    same_author,
+    socket_path,
+    _repos,
+    _stats,
+    _display,
+    _reponames,
+    _merge,
+    _merge_repo,
+    _lookup_prs,
+    _merge_queue,
+    _queue_status,
+    _rate_limit,
+    _retryable,
+)
+
+
+def __getattr__(name):
+    """
+    resolve `__version__` lazily, in editable installs versioneer runs git
+    to compute it & that shouldn't slow down every CLI invocation
+    """
+    if name == "__version__":
+        globals()["__version__"] = _version.get_versions()["version"]
+        return globals()["__version__"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-__version__ = _version.get_versions()["version"]
 
-console = Console()
+# rich is only imported once something is printed
+rich = lazy_import("rich")
+Style = lazy_import("rich.style", "Style")  # pylint: disable=invalid-name
+console = Lazy(lazy_import("rich.console", "Console"))
+# stdout carries the records of `--output json / ndjson`, diagnostics go here
+err_console = Lazy(lambda: importlib.import_module("rich.console").Console(stderr=True))
 
 
-def slack_message(webhook_url, title, value):
+class LazyGroup(click.Group):
     """
-    send message to slack channel (using incoming webhooks)
-    params:
-        - webhook_url
-        - title
-        - value
-    returns
-        - none
+    command group whose heavier subcommands are only imported when invoked
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *lazy_subcommands*: mapping of command name -> `module:command`
+
+    ***
     """
-    hook = webhook_url
-    headers = {"content-type": "application/json"}
-    payload = {
-        "attachments": [
-            {
-                "fallback": "",
-                "pretext": "",
-                "color": "#f4f4f4",
-                "fields": [{"title": title, "value": value, "short": False}],
-            }
-        ]
-    }
 
-    resp = requests.post(hook, data=json.dumps(payload), headers=headers, timeout=30)
+    def __init__(self, *args, lazy_subcommands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(super().list_commands(ctx) + list(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands:
+            module, _, name = self.lazy_subcommands[cmd_name].partition(":")
+            return getattr(importlib.import_module(module), name)
+        return super().get_command(ctx, cmd_name)
+
+
+def _slack_response(resp, out=None):
+    """print the response (or error) of a posted notification (to *out*)"""
+    out = out or console
     slack_style = Style.parse("white on yellow")
-    console.print(
+    if resp is None:
+        return
+    if isinstance(resp, Exception):
+        out.print(
+            f"Response: {resp}", style=slack_style + Style(underline=True, bold=True)
+        )
+        return
+    out.print(
         "Response: " + str(resp.status_code) + "," + str(resp.reason),
         style=slack_style + Style(underline=True, bold=True),
     )
 
 
-@click.group()
-def cli():
+def _stderr_response(resp):
+    """print the response of a posted notification to stderr (machine output)"""
+    _slack_response(resp, err_console)
+
+
+def _unstable_events(stats, reported):
+    """
+    get events for unstable PRs that weren't reported yet
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *stats*: automerge stats
+
+    *reported*: urls of unstable PRs already reported, updated in place
+
+    ***
+    """
+    unstable = {
+        pr["url"]: (repo, pr["number"])
+        for repo in _reponames(stats)
+        for pr in stats[repo]["unstable_prs"]
+    }
+    events = [
+        {"kind": "unstable", "repo": repo, "number": number, "url": url}
+        for url, (repo, number) in unstable.items()
+        if url not in reported
+    ]
+    # forget PRs that became stable / closed so they're reported if they regress
+    reported.intersection_update(unstable)
+    reported.update(unstable)
+    return events
+
+
+def _error(error, writer=None):
+    """
+    print an error (or write it as a record)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *error*: error message / gh stderr
+
+    *writer*: machine-readable output (see `automerge.output`)
+
+    ***
+    """
+    if isinstance(error, bytes):
+        error = error.decode("utf-8", "replace")
+    if writer is not None:
+        writer.write({"type": "error", "message": str(error)})
+        return
+    console.print(
+        f"error: {error}\n",
+        style=Style.parse("magenta on yellow") + Style(underline=True, bold=True),
+    )
+
+
+def _rest(writer=None):
+    """
+    sleep until the next merge cycle
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *writer*: machine-readable output (see `automerge.output`)
+
+    ***
+    """
+    if writer is None:
+        console.print(
+            "automerge: resting\n",
+            style=Style.parse("magenta on yellow") + Style(underline=True, bold=True),
+        )
+    with phase("rest"):
+        time.sleep(60)
+
+
+def _report(repo, pr_num, outcome, writer=None):
+    """
+    print the outcome of merging a PR (or write it as a record)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo
+
+    *pr_num*: PR num
+
+    *outcome*: `merged`, `enqueued` or `failed` (see `_merge_repo`)
+
+    *writer*: machine-readable output (see `automerge.output`)
+
+    ***
+    """
+    if writer is not None:
+        writer.write(
+            {"type": "merge", "repo": repo, "number": pr_num, "outcome": outcome}
+        )
+        return
+    if outcome == "failed":
+        console.print(
+            f"automerge: error merging {pr_num} in {repo}\n",
+            style=Style.parse("yellow on red") + Style(underline=True, bold=True),
+        )
+        return
+    message = "successfully merged" if outcome == "merged" else "enqueued"
+    console.print(
+        f"automerge: {message} {pr_num} in {repo}\n",
+        style=Style.parse("green on yellow") + Style(underline=True, bold=True),
+    )
+
+
+def _report_queue(repo):
+    """
+    print the progress of a repo's merge queue
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo
+
+    ***
+    """
+    entries = _queue_status(repo)
+    if isinstance(entries, (str, bytes)):
+        return
+    for entry in entries:
+        rich.print(
+            f"automerge: {repo}#{entry['number']} is "
+            f"{entry['state'].lower()} at position {entry['position']}"
+        )
+
+
+def _merge_from(
+    lines, author=None, backend="auto", writer=None
+):  # pylint: disable=too-many-locals
+    """
+    merge the PRs listed in *lines* (read as a stream, 100 at a time):
+    every batch is checked in one lookup (see `_lookup_prs`) & its
+    mergeable PRs are merged like discovered ones (see `_merge_repo`)
+
+    returns the merge outcomes
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *lines*: PR urls or `owner/repo#num` (blank lines & `#` comments skipped)
+
+    *author*: only merge PRs of this author (any author by default)
+
+    *backend*: merge backend (see `_merge_repo`)
+
+    *writer*: machine-readable output (see `automerge.output`)
+
+    ***
+    """
+    lines = (line.strip() for line in lines)
+    lines = (line for line in lines if line and not line.startswith("#"))
+    enqueued, seen, outcomes = set(), set(), []
+    while True:
+        # end of input only once no line is left (not when a batch had no refs)
+        batch = list(itertools.islice(lines, 100))
+        if not batch:
+            return outcomes
+        refs = []
+        for line in batch:
+            try:
+                ref = from_pr_ref(line)
+            except ValueError as error:
+                _error(str(error), writer)
+                continue
+            if ref not in seen:
+                seen.add(ref)
+                refs.append(ref)
+        if not refs:
+            continue
+        prs = _lookup_prs(refs)
+        if isinstance(prs, (str, bytes)):
+            _error(prs, writer)
+            return outcomes
+        mergeable = {}
+        for (repo, pr_num), pr in zip(refs, prs):
+            reason = _unmergeable(pr, author)
+            if reason is None:
+                mergeable.setdefault(repo, []).append(pr)
+            else:
+                _skipped(repo, pr_num, reason, writer)
+        for repo, repo_prs in mergeable.items():
+            for pr_num, outcome in _merge_repo(repo, repo_prs, backend, enqueued):
+                _report(repo, pr_num, outcome, writer)
+                outcomes.append(outcome)
+
+
+def _unmergeable(pr, author=None):
+    """why a looked up PR can't be merged (None if it can)"""
+    if pr is None:
+        return "not found"
+    status = (pr["state"], pr["mergeable"], pr["mergeStateStatus"])
+    if status != ("OPEN", "MERGEABLE", "CLEAN"):
+        return ", ".join(status).lower()
+    user = (pr.get("author") or {}).get("login", "")
+    if author and not same_author(user, author):
+        return f"authored by {user}"
+    return None
+
+
+def _skipped(repo, pr_num, reason, writer=None):
+    """print (or write) why a listed PR isn't merged (see `_merge_from`)"""
+    if writer is not None:
+        writer.write(
+            {
+                "type": "merge",
+                "repo": repo,
+                "number": pr_num,
+                "outcome": "skipped",
+                "reason": reason,
+            }
+        )
+        return
+    console.print(
+        f"automerge: skipping {pr_num} in {repo} ({reason})\n",
+        style=Style.parse("black on yellow"),
+    )
+
+
+def _plan(stats, backend, seconds, detailed, writer=None):
+    """
+    print the merge plan of scanned stats & its cost (see `automerge.plan`)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *stats*: automerge stats
+
+    *backend*: merge backend (see `_merge_repo`)
+
+    *seconds*: duration of the scan (used to estimate the latency of a call)
+
+    *detailed*: print every lane, not only the estimate
+
+    *writer*: machine-readable output (see `automerge.output`)
+
+    ***
+    """
+    lanes = build_plan(stats, backend)
+    # the scan lists the repos once & fetches the PRs of every repo
+    seconds_per_call = seconds / (len(_reponames(stats)) + 1)
+    cost = estimate(lanes, seconds_per_call, _rate_limit())
+    if writer is not None:
+        if detailed:
+            for lane in lanes:
+                writer.write({"type": "plan", **lane})
+        writer.write({"type": "estimate", **cost})
+        return
+    click.echo(report(lanes, cost, detailed=detailed))
+
+
+def _daemon_request(command, **params):
+    """
+    send a command to a running daemon (see `automerge.daemon.request`),
+    returns None without importing the daemon (& its lease / metrics /
+    tracing dependencies) if no daemon socket exists
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *command*: `info`, `merge` or `status`
+
+    *params*: command parameters
+
+    ***
+    """
+    if not os.path.exists(socket_path()):
+        return None
+    return importlib.import_module("automerge.daemon").request(command, **params)
+
+
+def _profile():
+    """profile every phase of this run & print the breakdown at exit"""
+    profiler = Profiler()
+    observe(profiler)
+    atexit.register(lambda: click.echo(profiler.report(), err=True))
+    return profiler
+
+
+def _trace(path):
+    """write trace spans of this run to a JSONL file (see `automerge.tracing`)"""
+    return importlib.import_module("automerge.tracing").Tracer(path).start()
+
+
+@click.group(cls=LazyGroup, lazy_subcommands={"daemon": "automerge.daemon:run_daemon"})
+@click.option("--record", help="record gh / HTTP traffic to this cassette file.")
+@click.option("--replay", help="serve gh / HTTP traffic from this cassette file.")
+@click.option(
+    "--replay-speed",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="scale of the recorded durations when replaying (0: instantly).",
+)
+@click.pass_context
+def cli(ctx, record=None, replay=None, replay_speed=1.0):
     """
     automerge is a simple python CLI that automatically
     merges GitHub PRs
     """
+    if record is not None and replay is not None:
+        raise click.UsageError("--record & --replay can't be combined")
+    if record is not None or replay is not None:
+        cassette = importlib.import_module("automerge.cassette")
+        ctx.with_resource(
+            cassette.record(record)
+            if record is not None
+            else cassette.replay(replay, replay_speed)
+        )
+
 
 @cli.command()
 def version():
     """get automerge version"""
-    print(__version__)
+    print(_version.get_versions()["version"])
+
 
 @cli.command()
 def login():
@@ -115,106 +519,328 @@ def logout():
 
 
 @cli.command()
-@click.option("--repos", "-r", multiple=True)
+@click.option(
+    "--repos",
+    "-r",
+    multiple=True,
+    callback=validate_selector,
+    help="repos to handle: names, globs, owner:, topic:, re:, !negation.",
+)
 @click.option(
     "--verbose", "-v", is_flag=True, help="display more detailed information."
 )
-def info(repos, verbose):
+@click.option(
+    "--hedge", is_flag=True, help="hedge PR fetches slower than the p95 latency."
+)
+@click.option(
+    "--profile", is_flag=True, help="print a per-phase timing breakdown at exit."
+)
+@click.option("--trace", help="append trace spans (OTLP JSON) to this JSONL file.")
+@click.option(
+    "--output",
+    "-o",
+    type=click.Choice(["text", "json", "ndjson"]),
+    default="text",
+    help="stream one JSON record per repo / PR instead of rendering tables.",
+)
+@click.option(
+    "--watch", is_flag=True, help="keep a live per-repo dashboard open & refresh it."
+)
+@click.option(
+    "--interval",
+    type=float,
+    default=60.0,
+    show_default=True,
+    help="seconds between --watch refreshes.",
+)
+@click.option(
+    "--limit",
+    type=int,
+    help="max. repos / PRs listed per group (0 lists all, default: 200).",
+)
+def info(
+    repos,
+    verbose,
+    hedge=False,
+    profile=False,
+    trace=None,
+    output="text",
+    watch=False,
+    interval=60.0,
+    limit=None,
+):  # pylint: disable=too-many-arguments
     """get all stable/unstable PRs"""
-    base_style = Style.parse("magenta on yellow")
-    console.print(
-        "automerge: fetching GitHub data using gh\n",
-        style=base_style + Style(underline=True, bold=True),
-    )
-    slack_webhook_url = os.environ.get("SLACK_WEBHOOK_URL", None)
-    stats = _stats(repos)
-    if isinstance(stats, (str, bytes)):
-        console.print(
-            f"error: {stats}\n",
-            style=base_style + Style(underline=True, bold=True),
+    if watch and output != "text":
+        raise click.UsageError("--watch only renders text output")
+    if profile:
+        _profile()
+    if trace is not None:
+        _trace(trace)
+    if watch:
+        importlib.import_module("automerge.watch").watch(
+            repos, hedge=hedge, interval=interval
         )
-        if slack_webhook_url is not None:
-            slack_message(
-                slack_webhook_url,
-                "Automerge",
-                f"error: {stats}\n",
-            )
         return
-    _display(stats, verbose=verbose)
+    writer = None if output == "text" else Writer(output)
+    if writer is None:
+        console.print(
+            "automerge: fetching GitHub data using gh\n",
+            style=Style.parse("magenta on yellow") + Style(underline=True, bold=True),
+        )
+    notifier = from_env(
+        on_response=_slack_response if writer is None else _stderr_response
+    )
+    author = "app/dependabot"
+    # answer from a running daemon's warm snapshot when possible (a daemon
+    # for another author answers with an error & the account is scanned)
+    response = _daemon_request("info", repos=list(repos), author=author)
+    if response is not None and "stats" in response:
+        stats = response["stats"]
+        if writer is not None:
+            for repo in _reponames(stats):
+                writer.repo(repo, stats[repo])
+    else:
+        stats = _stats(
+            repos,
+            author=author,
+            hedge=hedge,
+            on_repo=writer.repo if writer else None,
+        )
+    if isinstance(stats, (str, bytes)):
+        _error(stats, writer)
+        notifier.notify([{"kind": "error", "message": str(stats)}])
+    elif writer is None:
+        _display(stats, verbose=verbose, limit=limit)
+    if writer is not None:
+        writer.close()
 
 
 @cli.command()
-@click.option("--repos", "-r", multiple=True)
+@click.option(
+    "--repos",
+    "-r",
+    multiple=True,
+    callback=validate_selector,
+    help="repos to handle: names, globs, owner:, topic:, re:, !negation.",
+)
 @click.option("--author", "-a")
+@click.option(
+    "--backend",
+    "-b",
+    type=click.Choice(["auto", "direct", "queue"]),
+    default="auto",
+    help="merge directly or through GitHub merge queues (auto: detect per repo).",
+)
+@click.option(
+    "--hedge", is_flag=True, help="hedge PR fetches slower than the p95 latency."
+)
+@click.option(
+    "--lease-store",
+    help="lease store shared by workers, splits the repos between them.",
+)
+@click.option("--worker-id", help="id of this worker (default: hostname-pid).")
 @click.option(
     "--verbose", "-v", is_flag=True, help="display more detailed information."
 )
-def merge(repos, verbose, author=None):
+@click.option(
+    "--profile", is_flag=True, help="print a per-phase timing breakdown at exit."
+)
+@click.option(
+    "--metrics-port",
+    type=int,
+    help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics.",
+)
+@click.option("--trace", help="append trace spans (OTLP JSON) to this JSONL file.")
+@click.option(
+    "--output",
+    "-o",
+    type=click.Choice(["text", "json", "ndjson"]),
+    default="text",
+    help="stream one JSON record per repo / PR / merge instead of rendering.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="scan & estimate the merges without merging."
+)
+@click.option(
+    "--plan",
+    "show_plan",
+    is_flag=True,
+    help="print the merge plan (order & lanes of every PR) & its cost.",
+)
+@click.option(
+    "--from",
+    "source",
+    type=click.File("r"),
+    help="merge the PRs listed in this file (- for stdin): urls or owner/repo#num.",
+)
+def merge(
+    repos,
+    verbose,
+    author=None,
+    backend="auto",
+    hedge=False,
+    lease_store=None,
+    worker_id=None,
+    profile=False,
+    metrics_port=None,
+    trace=None,
+    output="text",
+    dry_run=False,
+    show_plan=False,
+    source=None,
+):  # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements
     """merge all[stable] PRs"""
-    base_style = Style.parse("magenta on yellow")
-    merge_style = Style.parse("green on yellow")
-    error_style = Style.parse("yellow on red")
-    console.print(
-        "automerge: fetching GitHub data using gh\n",
-        style=base_style + Style(underline=True, bold=True),
-    )
+    if source is not None:
+        # listed PRs are merged as they're read, nothing to scan / plan / shard
+        ignored = [
+            flag
+            for flag, value in (
+                ("--dry-run", dry_run),
+                ("--plan", show_plan),
+                ("--repos", repos),
+                ("--lease-store", lease_store),
+            )
+            if value
+        ]
+        if ignored:
+            raise click.UsageError(
+                f"--from can't be combined with {', '.join(ignored)}"
+            )
+    if profile:
+        _profile()
+    if trace is not None:
+        _trace(trace)
+    metrics = None
+    if metrics_port is not None:
+        metrics = importlib.import_module("automerge.metrics")
+        metrics.serve(metrics_port)
+    writer = None if output == "text" else Writer(output)
+    if writer is None:
+        console.print(
+            "automerge: fetching GitHub data using gh\n",
+            style=Style.parse("magenta on yellow") + Style(underline=True, bold=True),
+        )
+    if source is not None:
+        # known PRs: no discovery, only the listed PRs are looked up
+        _merge_from(source, author, backend, writer)
+        if writer is not None:
+            writer.close()
+        return
     # author can be passed to stats -> get prs
     if author is None:
         author = "dependabot"
-    slack_webhook_url = os.environ.get("SLACK_WEBHOOK_URL", None)
-    stats = _stats(repos, author=author)
-    if isinstance(stats, (str, bytes)):
-        console.print(
-            f"error: {stats}\n",
-            style=base_style + Style(underline=True, bold=True),
+    if repos and not dry_run:
+        # let a running daemon merge from its warm snapshot
+        response = _daemon_request(
+            "merge", repos=list(repos), author=author, backend=backend
         )
-        if slack_webhook_url is not None:
-            slack_message(
-                slack_webhook_url,
-                "Automerge",
-                f"error: {stats}\n",
-            )
+        if response is not None and "results" in response:
+            for result in response["results"]:
+                _report(result["repo"], result["number"], result["outcome"], writer)
+            if writer is not None:
+                writer.close()
+            return
+    notifier = from_env(
+        on_response=_slack_response if writer is None else _stderr_response
+    )
+    # explicit repos are looked up once instead of listing the account
+    inventory = _repos(repos) if compile_selector(repos).exact else None
+    if isinstance(inventory, (str, bytes)):
+        _error(inventory, writer)
+        notifier.notify([{"kind": "error", "message": str(inventory)}])
+        if writer is not None:
+            writer.close()
         return
+    shard = None
+    if lease_store is not None:
+        # only scan / merge the repos this worker owns
+        from automerge.lease import (  # pylint: disable=import-outside-toplevel
+            Shard,
+            open_store,
+        )
 
-    _display(stats, verbose=verbose)
-    while len(stats["stable_prs"]) > 0:
-        for repo in _repos():
-            prs = stats[repo]["stable_prs"]
-            if verbose:
-                if not prs:
-                    console.print(
-                        f"automerge: no PRs found in {repo}\n",
-                        style=merge_style + Style(underline=True, bold=True),
-                    )
+        shard = Shard(open_store(lease_store), worker_id)
+        shard.heartbeat()
+    # (repo, PR num) already handed to a merge queue
+    enqueued = set()
+    # unstable PR urls already included in a digest
+    reported = set()
+    first = True
+    while True:
+        # every cycle (scan + merges + notifications) is one trace
+        with phase("cycle"):
+            started = time.monotonic()
+            if not first and shard is not None:
+                shard.heartbeat()
+                shard.rebalance()
+            stats = _stats(
+                repos,
+                author=author,
+                hedge=hedge,
+                inventory=inventory,
+                select=shard.owns if shard else None,
+                on_repo=writer.repo if writer else None,
+            )
+            if isinstance(stats, (str, bytes)):
+                _error(stats, writer)
+                notifier.notify([{"kind": "error", "message": str(stats)}])
+                # a transient failure (rate limit, 5xx, timeout) is retried
+                # next cycle, anything else won't fix itself
+                if dry_run or not _retryable(stats):
+                    break
+                _rest(writer)
+                continue
+            if first and writer is None:
+                _display(stats, verbose=verbose)
+            if first and (dry_run or show_plan):
+                _plan(stats, backend, time.monotonic() - started, show_plan, writer)
+            first = False
+            if dry_run or not stats["stable_prs"]:
+                break
+            events = _unstable_events(stats, reported)
+            outcomes = []
+            for repo in _reponames(stats):
+                prs = stats[repo]["stable_prs"]
+                if prs and shard is not None and shard.lease(repo) is None:
+                    # another worker picked the repo up during a rebalance
                     continue
-            pr_nums = [pr["number"] for pr in prs]
-            if len(pr_nums) > 0:
-                rich.print(f"automerging {len(pr_nums)} PR(s) in {repo}")
-                for pr_num in pr_nums:
-                    merged = _merge(repo, pr_num)
-                    if merged:
+                if verbose and writer is None:
+                    if not prs:
                         console.print(
-                            f"automerge: successfully merged {pr_num} in {repo}\n",
-                            style=merge_style + Style(underline=True, bold=True),
+                            f"automerge: no PRs found in {repo}\n",
+                            style=Style.parse("green on yellow")
+                            + Style(underline=True, bold=True),
                         )
-                    else:
-                        console.print(
-                            f"automerge: error merging {pr_num} in {repo}\n",
-                            style=error_style + Style(underline=True, bold=True),
+                        continue
+                pr_nums = [pr["number"] for pr in prs]
+                if len(pr_nums) > 0:
+                    if writer is None:
+                        rich.print(f"automerging {len(pr_nums)} PR(s) in {repo}")
+                    urls = {pr["number"]: pr["url"] for pr in prs}
+                    for pr_num, outcome in _merge_repo(repo, prs, backend, enqueued):
+                        _report(repo, pr_num, outcome, writer)
+                        outcomes.append(outcome)
+                        events.append(
+                            {
+                                "kind": outcome,
+                                "repo": repo,
+                                "number": pr_num,
+                                "url": urls.get(pr_num),
+                            }
                         )
-            if slack_webhook_url is not None:
-                slack_message(
-                    slack_webhook_url,
-                    "Automerge",
-                    f"Merged {pr_nums} PRs ({len(pr_nums)} total) in {repo}",
-                )
-        console.print(
-            "automerge: resting\n",
-            style=base_style + Style(underline=True, bold=True),
-        )
-        time.sleep(60)
-        stats = _stats(repos, author=author)
+                    if writer is None and backend != "direct" and _merge_queue(repo):
+                        _report_queue(repo)
+            if metrics is not None:
+                metrics.record_cycle(stats, outcomes, time.monotonic() - started)
+                metrics.record_rate_limit(_rate_limit())
+            # one batch per cycle & none at all when nothing happened
+            notifier.notify(events)
+        _rest(writer)
+    if shard is not None:
+        shard.leave()
+    if writer is not None:
+        writer.close()
 
 
 if __name__ == "__main__":
-    cli()
+    cli()  # pylint: disable=no-value-for-parameter
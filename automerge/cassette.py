@@ -0,0 +1,369 @@
+"""
+record & replay automerge's `gh` & HTTP traffic
+
+while recording, every `gh` call made through `_execute` (arguments,
+return code, stdout, stderr, duration, whether it timed out) & every HTTP
+request made through `requests` (notification webhooks: method, url,
+status, body, duration) is appended to a cassette, a JSONL file (gzipped
+if its name ends in `.gz`) with one interaction per line written as soon
+as the call ends. replaying serves the interactions back in the order they
+were recorded (per command / url) without spawning `gh` or touching the
+network, sleeping their recorded duration (scaled by *speed*) so a slow
+production cycle can be reproduced & profiled offline. notifications still
+queued when the cassette is closed are sent (or served) before it is
+
+    $ automerge --record incident.jsonl.gz merge
+    $ automerge --replay incident.jsonl.gz --replay-speed 0 merge --profile
+
+`gh` calls are intercepted like `automerge.sim.in_process` does, by
+standing in for `subprocess.Popen`, so recording works on top of the
+simulator too
+
+***
+
+**classes**
+
+***
+
+*Recorder*: append interactions to a cassette
+
+*Player*: serve the interactions of a cassette back
+
+***
+
+**functions**
+
+***
+
+*record*: record the `gh` & HTTP traffic while the context is open
+
+*replay*: serve a cassette's `gh` & HTTP traffic while the context is open
+
+***
+"""
+import gzip
+import json
+import time
+import threading
+import contextlib
+import subprocess
+from collections import defaultdict, deque
+from typing import Optional, List
+
+from automerge.utils import lazy_import
+from automerge.notify import flush
+
+requests = lazy_import("requests")
+
+# stderr of a call that isn't on the cassette
+UNRECORDED = b"automerge: not on the cassette"
+
+
+def _open(path: str, mode: str):
+    """open a cassette (gzipped if its name ends in `.gz`)"""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")  # pylint: disable=consider-using-with
+
+
+def _text(data: Optional[bytes]):
+    """bytes as JSON-safe text (undecodable bytes survive the round trip)"""
+    return (data or b"").decode("utf-8", "surrogateescape")
+
+
+def _bytes(text: str):
+    """the bytes of `_text`"""
+    return text.encode("utf-8", "surrogateescape")
+
+
+def _key(interaction: dict):
+    """what a call is matched on when replaying"""
+    if interaction["kind"] == "gh":
+        return ("gh", tuple(interaction["args"]))
+    return ("http", interaction["method"], interaction["url"])
+
+
+class Recorder:
+    """
+    append interactions to a cassette (thread-safe, flushed per line)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: cassette file (overwritten)
+
+    ***
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.file = _open(path, "w")
+
+    def add(self, interaction: dict, started: float):
+        """append an interaction that started at *started* (monotonic)"""
+        interaction["at"] = round(started - self.started, 6)
+        interaction["seconds"] = round(time.monotonic() - started, 6)
+        line = json.dumps(interaction, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        """close the cassette"""
+        with self.lock:
+            self.file.close()
+
+
+class Player:
+    """
+    serve the interactions of a cassette back (in recorded order per
+    command / url)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: cassette file
+
+    *speed*: scale of the recorded durations (0 replays instantly)
+
+    ***
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.interactions = defaultdict(deque)
+        with _open(path, "r") as cassette:
+            for line in cassette:
+                interaction = json.loads(line)
+                self.interactions[_key(interaction)].append(interaction)
+
+    def next(self, key: tuple):
+        """pop the next recorded interaction of *key* (None if there's none)"""
+        with self.lock:
+            recorded = self.interactions.get(key)
+            return recorded.popleft() if recorded else None
+
+    def wait(self, seconds: float):
+        """sleep a recorded duration (scaled by *speed*)"""
+        if self.speed > 0:
+            time.sleep(seconds * self.speed)
+
+    def remaining(self):
+        """number of interactions not replayed (yet)"""
+        with self.lock:
+            return sum(len(recorded) for recorded in self.interactions.values())
+
+
+class _RecordedProcess:
+    """`subprocess.Popen` of a gh call whose outcome is recorded"""
+
+    def __init__(self, recorder: Recorder, process, args: List[str]):
+        self.recorder = recorder
+        self.process = process
+        self.args = args
+        self.started = time.monotonic()
+        self.timed_out = False
+
+    def __enter__(self):
+        self.process.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self.process.__exit__(*exc)
+
+    @property
+    def pid(self):
+        """pid of the recorded process"""
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        """return code of the recorded process"""
+        return self.process.returncode
+
+    def kill(self):
+        """kill the recorded process"""
+        self.process.kill()
+
+    def communicate(self, timeout: Optional[float] = None):
+        """run the recorded process & record its output"""
+        try:
+            stdout, stderr = self.process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # `_execute` kills it & reads what's left, recorded then
+            self.timed_out = True
+            raise
+        self.recorder.add(
+            {
+                "kind": "gh",
+                "args": self.args,
+                "returncode": self.process.returncode,
+                "stdout": _text(stdout),
+                "stderr": _text(stderr),
+                "timed_out": self.timed_out,
+            },
+            self.started,
+        )
+        return stdout, stderr
+
+
+class _ReplayedProcess:
+    """stand-in for the `subprocess.Popen` of a replayed gh call"""
+
+    def __init__(self, player: Player, args: List[str]):
+        self.player = player
+        self.args = args
+        self.interaction = player.next(("gh", tuple(args)))
+        self.returncode = None
+        self.killed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def pid(self):
+        """there's no process group to kill, `_execute` falls back to `kill`"""
+        raise AttributeError("pid")
+
+    def kill(self):
+        """the recorded call was killed too"""
+        self.killed = True
+
+    def communicate(self, timeout: Optional[float] = None):
+        """serve the recorded output after its recorded duration"""
+        interaction = self.interaction
+        if interaction is None:
+            self.returncode = 1
+            return b"", UNRECORDED + f": {' '.join(self.args)}".encode("utf-8")
+        if interaction["timed_out"] and not self.killed:
+            self.player.wait(timeout if timeout is not None else 0)
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        if not self.killed:
+            self.player.wait(interaction["seconds"])
+        self.returncode = interaction["returncode"]
+        return _bytes(interaction["stdout"]), _bytes(interaction["stderr"])
+
+
+@contextlib.contextmanager
+def _patched(popen, request):
+    """stand in for `subprocess.Popen` (gh calls) & `requests` while open"""
+    original_popen, original_request = subprocess.Popen, requests.Session.request
+
+    def patched_popen(cmd, *args, **kwargs):
+        if cmd and cmd[0] == "gh":
+            return popen(original_popen, list(cmd), *args, **kwargs)
+        return original_popen(cmd, *args, **kwargs)
+
+    def patched_request(session, method, url, *args, **kwargs):
+        return request(original_request, session, method, url, *args, **kwargs)
+
+    subprocess.Popen = patched_popen
+    requests.Session.request = patched_request
+    try:
+        yield
+    finally:
+        # notifications are sent by worker threads (see `Dispatcher`), send
+        # the queued ones through the cassette before it's closed
+        flush()
+        subprocess.Popen = original_popen
+        requests.Session.request = original_request
+
+
+@contextlib.contextmanager
+def record(path: str):
+    """
+    record the `gh` & HTTP traffic while the context is open (yields the
+    `Recorder`)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: cassette file (overwritten)
+
+    ***
+    """
+    recorder = Recorder(path)
+
+    def popen(original, cmd, *args, **kwargs):
+        return _RecordedProcess(recorder, original(cmd, *args, **kwargs), cmd)
+
+    def request(
+        original, session, method, url, *args, **kwargs
+    ):  # pylint: disable=too-many-arguments
+        started = time.monotonic()
+        interaction = {"kind": "http", "method": method.upper(), "url": url}
+        try:
+            response = original(session, method, url, *args, **kwargs)
+        except requests.RequestException as error:
+            recorder.add(dict(interaction, error=str(error)), started)
+            raise
+        recorder.add(
+            dict(interaction, status=response.status_code, body=response.text),
+            started,
+        )
+        return response
+
+    try:
+        with _patched(popen, request):
+            yield recorder
+    finally:
+        recorder.close()
+
+
+@contextlib.contextmanager
+def replay(path: str, speed: float = 1.0):
+    """
+    serve a cassette's `gh` & HTTP traffic while the context is open (yields
+    the `Player`), calls that aren't on the cassette fail: gh calls with
+    `UNRECORDED` on stderr, HTTP requests with a `requests.ConnectionError`
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: cassette file
+
+    *speed*: scale of the recorded durations (0 replays instantly)
+
+    ***
+    """
+    player = Player(path, speed)
+
+    def popen(_original, cmd, *_args, **_kwargs):
+        return _ReplayedProcess(player, cmd)
+
+    def request(
+        _original, _session, method, url, *_args, **_kwargs
+    ):  # pylint: disable=too-many-arguments
+        interaction = player.next(("http", method.upper(), url))
+        if interaction is None:
+            raise requests.ConnectionError(f"{UNRECORDED.decode()}: {method} {url}")
+        player.wait(interaction["seconds"])
+        if "error" in interaction:
+            raise requests.ConnectionError(interaction["error"])
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.url = url
+        body = interaction["body"].encode("utf-8")
+        response._content = body  # pylint: disable=protected-access
+        return response
+
+    with _patched(popen, request):
+        yield player
@@ -0,0 +1,490 @@
+"""
+long-running automerge daemon
+
+the daemon stays resident & keeps its repo inventory, PR snapshot,
+rate limit state & notification sessions (see `automerge.notify`) in
+memory between merge cycles. other
+CLI invocations (`info`, `merge --repos`) talk to it over a local unix
+socket instead of starting from a cold scan
+
+with a `Leader` only the elected instance merges, standbys keep their
+inventory & snapshot warm (& keep answering `info`, `merge` requests are
+refused so the CLI falls back to merging itself) & are elected within
+seconds of the leader's heartbeat stopping. the first cycle after a
+takeover skips listing the account but still re-fetches the PRs of every
+repo, the standby's snapshot can be minutes old
+
+***
+
+**classes**
+
+***
+
+*Daemon*: warm state + merge loop + control socket server
+
+***
+
+**functions**
+
+***
+
+*run_daemon*: the `automerge daemon` command
+
+*request*: send a command to a running daemon
+
+***
+"""
+import os
+import json
+import time
+import socket
+import pathlib
+import threading
+import socketserver
+from typing import Optional, List
+
+import click
+
+from automerge.lease import Shard, Leader, open_store
+from automerge.utils import (
+    _repos,
+    _stats,
+    _aggregate,
+    _reponames,
+    _merge_repo,
+    _rate_limit,
+    same_author,
+    socket_path,
+)
+from automerge.notify import from_env
+from automerge.selector import compile_selector, validate as validate_selector
+from automerge.instrument import phase
+from automerge.tracing import Tracer
+from automerge.metrics import serve as serve_metrics, record_cycle, record_rate_limit
+
+
+def request(command: str, timeout: float = 300, **params):
+    """
+    send a command to a running daemon
+
+    returns the daemon's response or None if no daemon is running
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *command*: `info`, `merge` or `status`
+
+    *timeout*: seconds to wait for the response
+
+    *params*: command parameters
+
+    ***
+    """
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(path)
+            conn.sendall(json.dumps({"command": command, **params}).encode() + b"\n")
+            with conn.makefile("rb") as response:
+                return json.loads(response.readline())
+    except (OSError, ValueError):
+        # stale socket / daemon went away, fall back to a cold run
+        return None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """handle one JSON line request on the control socket"""
+
+    def handle(self):
+        try:
+            params = json.loads(self.rfile.readline())
+            command = params.pop("command")
+            response = self.server.daemon.handle(command, **params)
+        except Exception as error:  # pylint: disable=broad-except
+            response = {"error": str(error)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """threaded unix socket server with a reference to the daemon"""
+
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        super().__init__(path, _Handler)
+
+
+class Daemon:  # pylint: disable=too-many-instance-attributes
+    """
+    warm state + merge loop + control socket server
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repos*: repos to manage (all repos in the account if empty)
+
+    *author*: author of PRs to merge
+
+    *backend*: merge backend (see `_merge_repo`)
+
+    *interval*: seconds between merge cycles
+
+    *inventory_ttl*: seconds before the repo inventory is listed again
+
+    *shard*: only manage the repos this worker owns (see `Shard`)
+
+    *leader*: only merge while elected (see `Leader`)
+
+    *standby_interval*: seconds between snapshot refreshes on a standby
+
+    ***
+    """
+
+    def __init__(
+        self,
+        repos: Optional[List[str]] = None,
+        author: str = "dependabot",
+        backend: str = "auto",
+        interval: float = 60,
+        inventory_ttl: float = 3600,
+        shard: Optional[Shard] = None,
+        leader: Optional[Leader] = None,
+        standby_interval: float = 300,
+    ):  # pylint: disable=too-many-arguments
+        self.repos = list(repos or [])
+        self.author = author
+        self.backend = backend
+        self.interval = interval
+        self.inventory_ttl = inventory_ttl
+        self.shard = shard
+        self.leader = leader
+        self.standby_interval = standby_interval
+        self._warmed_at = float("-inf")
+        self.cycle_seconds = 0.0
+        self.snapshot = {}
+        self.rate_limit = {}
+        self.enqueued = set()
+        # lock guards the warm state, merging serializes merge passes
+        self.lock, self.merging = threading.RLock(), threading.Lock()
+        self._inventory, self._listed_at = None, 0.0
+        self._stopped = threading.Event()
+
+    def inventory(self):
+        """get the (cached) repo inventory"""
+        with self.lock:
+            stale = time.monotonic() - self._listed_at > self.inventory_ttl
+            if self._inventory is None or stale:
+                repos = _repos()
+                if isinstance(repos, (str, bytes)):
+                    if self._inventory is None:
+                        return repos
+                else:
+                    self._inventory, self._listed_at = repos, time.monotonic()
+            return self._inventory
+
+    def refresh(self, repos: Optional[List[str]] = None):
+        """
+        refresh the PR snapshot (of all managed repos or only *repos*)
+
+        returns the refreshed stats or an error
+        """
+        inventory = self.inventory()
+        if isinstance(inventory, (str, bytes)):
+            return inventory
+        select = None
+        if self.shard is not None:
+            self.shard.heartbeat()
+            self.shard.rebalance()
+            select = self.shard.owns
+        stats = _stats(
+            repos or self.repos,
+            author=self.author,
+            inventory=inventory,
+            select=select,
+        )
+        if isinstance(stats, (str, bytes)):
+            return stats
+        rate_limit = _rate_limit()
+        with self.lock:
+            if not repos:
+                self.snapshot = {}
+            self.snapshot.update({repo: stats[repo] for repo in _reponames(stats)})
+            if not isinstance(rate_limit, (str, bytes)):
+                self.rate_limit = rate_limit
+        return stats
+
+    def merge(self, repos: Optional[List[str]] = None):
+        """
+        refresh the snapshot (of all repos or only *repos*) & merge its
+        stable PRs
+
+        returns a list of {repo, number, outcome} dicts or an error
+        """
+        with self.merging:
+            stats = self.refresh(repos)
+            if isinstance(stats, (str, bytes)):
+                return stats
+            return [
+                {"repo": repo, "number": pr_num, "outcome": outcome}
+                for repo in _reponames(stats)
+                if stats[repo]["stable_prs"]
+                and (self.shard is None or self.shard.lease(repo) is not None)
+                # fencing: a deposed leader must not merge anything
+                and (self.leader is None or self.leader.valid())
+                for pr_num, outcome in _merge_repo(
+                    repo, stats[repo]["stable_prs"], self.backend, self.enqueued
+                )
+            ]
+
+    def handle(self, command: str, **params):
+        """answer a control socket command"""
+        handlers = {"info": self._info, "merge": self._merge, "status": self._status}
+        if command not in handlers:
+            return {"error": f"unknown command: {command}"}
+        return handlers[command](**params)
+
+    def _info(
+        self, repos: Optional[List[str]] = None, author: Optional[str] = None, **_
+    ):
+        """answer `info` from the snapshot (fetching repos it doesn't hold)"""
+        # the snapshot only holds this daemon's author's PRs
+        if author is not None and not same_author(author, self.author):
+            return {"error": "author differs from the daemon's"}
+        selector = compile_selector(repos)
+        exact = selector.exact
+        if exact is None:
+            # globs, owners, topics...: refresh whatever the selector matches
+            stats = self.refresh(repos)
+            if isinstance(stats, (str, bytes)):
+                return {"error": _decode(stats)}
+            repos = _reponames(stats)
+        else:
+            # exact names are case-insensitive, the snapshot holds GitHub's
+            with self.lock:
+                held = {repo.lower() for repo in self.snapshot}
+            missing = sorted(repo for repo in exact if repo not in held)
+            if missing:
+                stats = self.refresh(missing)
+                if isinstance(stats, (str, bytes)):
+                    return {"error": _decode(stats)}
+        with self.lock:
+            snapshot = dict(self.snapshot)
+        if exact is None:
+            snapshot = {repo: snapshot[repo] for repo in repos if repo in snapshot}
+        elif exact:
+            snapshot = {
+                repo: repo_stats
+                for repo, repo_stats in snapshot.items()
+                if selector.match(repo)
+            }
+        return {"stats": _aggregate(snapshot)}
+
+    def _merge(self, repos: Optional[List[str]] = None, **params):
+        """answer `merge` for *repos* (refreshing them first)"""
+        # the snapshot only holds this daemon's author / backend
+        if (
+            not same_author(params.get("author", self.author), self.author)
+            or params.get("backend", self.backend) != self.backend
+        ):
+            return {"error": "author / backend differ from the daemon's"}
+        if self.leader is not None and not self.leader.valid():
+            # only the leader merges, let the CLI fall back / report it
+            return {"error": "standby"}
+        results = self.merge(repos)
+        if isinstance(results, (str, bytes)):
+            return {"error": _decode(results)}
+        return {"results": results}
+
+    def _status(self, **_):
+        """answer `status`"""
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "repos": len(self._inventory or []),
+                "snapshot": len(self.snapshot),
+                "rate_limit": self.rate_limit,
+            }
+
+    def cycle(self):
+        """run one merge cycle, returns merge results or an error"""
+        started = time.monotonic()
+        results = self.merge()
+        self.cycle_seconds = time.monotonic() - started
+        return results
+
+    def standby(self):
+        """keep the inventory & snapshot warm without merging"""
+        if time.monotonic() - self._warmed_at > self.standby_interval:
+            self._warmed_at = time.monotonic()
+            self.refresh()
+
+    def serve(self, on_cycle=None):
+        """
+        run merge cycles forever while answering the control socket
+
+        ***
+
+        **parameters**
+
+        ***
+
+        *on_cycle*: called with the results of every cycle
+
+        ***
+        """
+        path = socket_path()
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        if os.path.exists(path):
+            if request("status", timeout=5) is not None:
+                raise RuntimeError(f"a daemon is already listening on {path}")
+            os.unlink(path)
+        server = _Server(path, self)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            while not self._stopped.is_set():
+                if self.leader is not None and not self.leader.elect():
+                    # poll often enough to take over within seconds
+                    self.standby()
+                    self._stopped.wait(min(self.interval, self.leader.ttl / 3))
+                    continue
+                # every cycle (incl. its notifications) is one trace
+                with phase("cycle"):
+                    results = self.cycle()
+                    if on_cycle is not None:
+                        on_cycle(results)
+                self._stopped.wait(self.interval)
+        finally:
+            if self.leader is not None:
+                self.leader.resign()
+            if self.shard is not None:
+                self.shard.leave()
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def stop(self):
+        """stop serving after the current cycle"""
+        self._stopped.set()
+
+
+def _decode(error):
+    """decode a gh error for JSON responses"""
+    return error.decode("utf-8", "replace") if isinstance(error, bytes) else error
+
+
+@click.command("daemon")
+@click.option(
+    "--repos",
+    "-r",
+    multiple=True,
+    callback=validate_selector,
+    help="repos to handle: names, globs, owner:, topic:, re:, !negation.",
+)
+@click.option("--author", "-a", default="dependabot")
+@click.option(
+    "--backend",
+    "-b",
+    type=click.Choice(["auto", "direct", "queue"]),
+    default="auto",
+    help="merge directly or through GitHub merge queues (auto: detect per repo).",
+)
+@click.option(
+    "--interval", "-i", type=float, default=60, help="seconds between merge cycles."
+)
+@click.option(
+    "--lease-store",
+    help="lease store shared by workers, splits the repos between them.",
+)
+@click.option("--worker-id", help="id of this worker (default: hostname-pid).")
+@click.option(
+    "--leader-store",
+    help="lease store for active / standby daemons, only the leader merges.",
+)
+@click.option(
+    "--metrics-port",
+    type=int,
+    help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics.",
+)
+@click.option("--trace", help="append trace spans (OTLP JSON) to this JSONL file.")
+def run_daemon(
+    repos,
+    author,
+    backend,
+    interval,
+    lease_store=None,
+    worker_id=None,
+    leader_store=None,
+    metrics_port=None,
+    trace=None,
+):  # pylint: disable=too-many-arguments,too-many-locals
+    """keep merging stable PRs from a warm, long-running process"""
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from automerge import (
+        console,
+        Style,
+        _report,
+        _unstable_events,
+        _slack_response,
+    )
+
+    base_style = Style.parse("magenta on yellow")
+    notifier = from_env(on_response=_slack_response)
+    resident = Daemon(
+        repos,
+        author=author,
+        backend=backend,
+        interval=interval,
+        shard=Shard(open_store(lease_store), worker_id) if lease_store else None,
+        leader=Leader(open_store(leader_store), worker_id) if leader_store else None,
+    )
+
+    if metrics_port is not None:
+        serve_metrics(metrics_port)
+    if trace is not None:
+        Tracer(trace).start()
+    reported = set()
+
+    def on_cycle(results):
+        if isinstance(results, (str, bytes)):
+            console.print(
+                f"error: {results}\n",
+                style=base_style + Style(underline=True, bold=True),
+            )
+            return
+        for result in results:
+            _report(result["repo"], result["number"], result["outcome"])
+        with resident.lock:
+            snapshot = _aggregate(resident.snapshot)
+            rate_limit = resident.rate_limit
+        if metrics_port is not None:
+            record_cycle(
+                snapshot,
+                [result["outcome"] for result in results],
+                resident.cycle_seconds,
+            )
+            record_rate_limit(rate_limit)
+        notifier.notify(
+            _unstable_events(snapshot, reported)
+            + [{"kind": result["outcome"], **result} for result in results]
+        )
+        console.print(
+            "automerge: resting\n",
+            style=base_style + Style(underline=True, bold=True),
+        )
+
+    console.print(
+        "automerge: starting daemon\n",
+        style=base_style + Style(underline=True, bold=True),
+    )
+    resident.serve(on_cycle=on_cycle)
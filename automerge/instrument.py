@@ -0,0 +1,215 @@
+"""
+per-phase instrumentation for automerge
+
+the scan / merge paths wrap their phases (`gh` calls, listing repos,
+fetching PRs, merging, retry sleeps, notifications, ...) in `phase`.
+while no observer is registered a phase costs a single list check,
+observers (e.g. a `Profiler`) get the name, repo, duration & bytes of
+every finished phase
+
+***
+
+**classes**
+
+***
+
+*Profiler*: per-phase call counts, latency percentiles & slowest repos
+
+***
+
+**functions**
+
+***
+
+*phase*: time a phase of work & report it to the observers
+
+*observe*: register an observer of finished phases
+
+*unobserve*: unregister an observer
+
+*active*: number of phases of a kind currently running
+
+*current*: the innermost phase running in this context
+
+***
+"""
+import time
+import itertools
+import threading
+import contextlib
+import contextvars
+from collections import defaultdict
+from typing import Callable, Optional
+
+# called with (name, repo, seconds, nbytes) for every finished phase
+_OBSERVERS = []
+# phases currently running by name (only tracked while observed)
+_ACTIVE = defaultdict(int)
+_LOCK = threading.Lock()
+# innermost running phase (only tracked while observed), threads running
+# work for a phase should be started with `contextvars.copy_context().run`
+_CURRENT = contextvars.ContextVar("phase", default=None)
+_IDS = itertools.count(1)
+
+
+def observe(observer: Callable):
+    """register an observer of finished phases"""
+    _OBSERVERS.append(observer)
+
+
+def unobserve(observer: Callable):
+    """unregister an observer"""
+    if observer in _OBSERVERS:
+        _OBSERVERS.remove(observer)
+
+
+def active(name: str):
+    """number of phases called *name* currently running (while observed)"""
+    return _ACTIVE[name]
+
+
+def current():
+    """the innermost phase running in this context (None if unobserved)"""
+    return _CURRENT.get()
+
+
+class _Phase:  # pylint: disable=too-few-public-methods
+    """a running phase, set `nbytes` to account for the data it parsed"""
+
+    __slots__ = ("name", "repo", "nbytes", "parent", "ident", "started")
+
+    def __init__(self, name=None, repo=None, parent=None):
+        self.name, self.repo, self.parent = name, repo, parent
+        self.nbytes = 0
+        self.ident, self.started = 0, 0
+
+
+@contextlib.contextmanager
+def phase(name: str, repo: Optional[str] = None):
+    """
+    time a phase of work & report it to the observers
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *name*: phase name (e.g. `gh`, `prs`, `merge`)
+
+    *repo*: repo the work was done for (if any)
+
+    ***
+    """
+    if not _OBSERVERS:
+        yield _Phase()
+        return
+    running = _Phase(name, repo, _CURRENT.get())
+    running.ident, running.started = next(_IDS), time.time_ns()
+    token = _CURRENT.set(running)
+    start = time.perf_counter()
+    with _LOCK:
+        _ACTIVE[name] += 1
+    try:
+        yield running
+    finally:
+        elapsed = time.perf_counter() - start
+        with _LOCK:
+            _ACTIVE[name] -= 1
+        # observers can still look the finished phase up with `current`
+        for observer in list(_OBSERVERS):
+            observer(name, repo, elapsed, running.nbytes)
+        _CURRENT.reset(token)
+
+
+def _percentile(latencies, percentile):
+    """nearest-rank percentile of sorted latencies"""
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+
+class Profiler:
+    """
+    per-phase call counts, latency percentiles & slowest repos
+
+    phases nest (e.g. a `prs` phase contains its `gh` call) so their
+    totals overlap, each row is the wall time spent inside that phase
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *top*: number of slowest repos to report
+
+    ***
+    """
+
+    def __init__(self, top: int = 5):
+        self.top = top
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.nbytes = defaultdict(int)
+        self.repos = defaultdict(float)
+        self.started = time.perf_counter()
+
+    def __call__(self, name, repo, seconds, nbytes):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            self.nbytes[name] += nbytes
+            if repo is not None:
+                self.repos[repo] += seconds
+
+    def __enter__(self):
+        observe(self)
+        return self
+
+    def __exit__(self, *exc):
+        unobserve(self)
+        return False
+
+    def rows(self):
+        """get [phase, calls, total, p50, p95, max, bytes] rows"""
+        with self.lock:
+            phases = {name: sorted(values) for name, values in self.latencies.items()}
+            nbytes = dict(self.nbytes)
+        return [
+            [
+                name,
+                len(latencies),
+                round(sum(latencies), 3),
+                round(_percentile(latencies, 0.5), 3),
+                round(_percentile(latencies, 0.95), 3),
+                round(latencies[-1], 3),
+                nbytes.get(name, 0),
+            ]
+            for name, latencies in sorted(
+                phases.items(), key=lambda item: -sum(item[1])
+            )
+        ]
+
+    def slowest(self):
+        """get the repos the most time was spent on (slowest first)"""
+        with self.lock:
+            repos = sorted(self.repos.items(), key=lambda item: -item[1])
+        return [[repo, round(seconds, 3)] for repo, seconds in repos[: self.top]]
+
+    def report(self):
+        """render the per-phase breakdown & the slowest repos"""
+        import tabulate  # pylint: disable=import-outside-toplevel
+
+        elapsed = time.perf_counter() - self.started
+        lines = [
+            f"profile: {elapsed:.3f}s wall",
+            tabulate.tabulate(
+                self.rows(),
+                headers=["phase", "calls", "total (s)", "p50", "p95", "max", "bytes"],
+            ),
+        ]
+        slowest = self.slowest()
+        if slowest:
+            lines += [
+                "",
+                tabulate.tabulate(slowest, headers=["slowest repos", "total (s)"]),
+            ]
+        return "\n".join(lines)
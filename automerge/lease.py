@@ -0,0 +1,491 @@
+"""
+leases for running several automerge workers side by side
+
+workers heartbeat a `worker/<id>` lease, split the repo inventory
+between the live workers using consistent hashing & hold a
+`repo/<owner/repo>` lease while scanning / merging a repo so that every
+repo is handled by exactly one worker (ownership moves when workers
+join or leave)
+
+for active / standby deployments a single `leader` lease (renewed by a
+heartbeat & fenced by its token) decides which instance merges
+
+***
+
+**classes**
+
+***
+
+*LeaseStore*: lease store interface (subclass it to add a backend)
+
+*SQLiteLeaseStore*: lease store backed by a SQLite file (e.g. on a shared volume)
+
+*FileLeaseStore*: lease store backed by a JSON file guarded by a file lock
+
+*HashRing*: consistent hash ring of worker ids
+
+*Shard*: the part of the repo inventory owned by a worker
+
+*Leader*: leader election over a lease with a heartbeat & fencing token
+
+***
+
+**functions**
+
+***
+
+*open_store*: open a lease store from a spec
+
+***
+"""
+import os
+import json
+import time
+import fcntl
+import socket
+import bisect
+import hashlib
+import contextlib
+import sqlite3
+import importlib
+import threading
+from typing import Optional, List, Dict
+
+
+class LeaseStore:
+    """
+    lease store interface (subclass it to add a backend)
+
+    a lease is held by a single holder until it expires (or is released)
+    & carries a fencing token that increases every time the lease changes
+    holder
+    """
+
+    def acquire(self, key: str, holder: str, ttl: float) -> Optional[int]:
+        """
+        acquire / renew a lease
+
+        returns the lease's fencing token or None if someone else holds it
+
+        ***
+
+        **parameters**
+
+        ***
+
+        *key*: lease name
+
+        *holder*: id of the holder
+
+        *ttl*: seconds until the lease expires unless renewed
+
+        ***
+        """
+        raise NotImplementedError
+
+    def release(self, key: str, holder: str):
+        """release a lease (if *holder* holds it)"""
+        raise NotImplementedError
+
+    def holders(self, prefix: str = "") -> Dict[str, str]:
+        """get the holders of all live leases whose key starts with *prefix*"""
+        raise NotImplementedError
+
+    def token(self, key: str) -> Optional[int]:
+        """get the fencing token of a live lease (None if nobody holds it)"""
+        raise NotImplementedError
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """
+    lease store backed by a SQLite file (e.g. on a shared volume)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: SQLite database file
+
+    ***
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, holder TEXT, token INTEGER, expires REAL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """open a connection (one per call, the store is shared by threads)"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def acquire(self, key: str, holder: str, ttl: float) -> Optional[int]:
+        with self.lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute(
+                    "SELECT holder, token, expires FROM leases WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[0] != holder and row[2] > now:
+                    return None
+                if row is None:
+                    token = 1
+                else:
+                    token = row[1] if row[0] == holder and row[2] > now else row[1] + 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+                    (key, holder, token, now + ttl),
+                )
+                return token
+            finally:
+                conn.execute("COMMIT")
+
+    def release(self, key: str, holder: str):
+        with self.lock, self._connect() as conn:
+            # keep the row (& its token) so the next holder gets token + 1
+            conn.execute(
+                "UPDATE leases SET expires = 0 WHERE key = ? AND holder = ?",
+                (key, holder),
+            )
+
+    def holders(self, prefix: str = "") -> Dict[str, str]:
+        with self.lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, holder FROM leases "
+                "WHERE substr(key, 1, ?) = ? AND expires > ?",
+                (len(prefix), prefix, time.time()),
+            ).fetchall()
+        return dict(rows)
+
+    def token(self, key: str) -> Optional[int]:
+        with self.lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT token FROM leases WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            ).fetchone()
+        return None if row is None else row[0]
+
+
+class FileLeaseStore(LeaseStore):
+    """
+    lease store backed by a JSON file guarded by a file lock (local only)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: lease file
+
+    ***
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _leases(self):
+        """lock the lease file & yield its (mutable) leases"""
+        with self.lock, open(self.path, "a+", encoding="utf-8") as lease_file:
+            fcntl.flock(lease_file, fcntl.LOCK_EX)
+            try:
+                lease_file.seek(0)
+                leases = json.loads(lease_file.read() or "{}")
+                before = dict(leases)
+                yield leases
+                if leases != before:
+                    lease_file.seek(0)
+                    lease_file.truncate()
+                    lease_file.write(json.dumps(leases))
+                    lease_file.flush()
+            finally:
+                fcntl.flock(lease_file, fcntl.LOCK_UN)
+
+    def acquire(self, key: str, holder: str, ttl: float) -> Optional[int]:
+        with self._leases() as leases:
+            now, lease = time.time(), leases.get(key)
+            if lease is not None and lease["holder"] != holder:
+                if lease["expires"] > now:
+                    return None
+            if lease is None:
+                token = 1
+            elif lease["holder"] == holder and lease["expires"] > now:
+                token = lease["token"]
+            else:
+                token = lease["token"] + 1
+            leases[key] = {"holder": holder, "token": token, "expires": now + ttl}
+            return token
+
+    def release(self, key: str, holder: str):
+        with self._leases() as leases:
+            if key in leases and leases[key]["holder"] == holder:
+                leases[key] = {**leases[key], "expires": 0}
+
+    def holders(self, prefix: str = "") -> Dict[str, str]:
+        with self._leases() as leases:
+            now = time.time()
+            return {
+                key: lease["holder"]
+                for key, lease in leases.items()
+                if key.startswith(prefix) and lease["expires"] > now
+            }
+
+    def token(self, key: str) -> Optional[int]:
+        with self._leases() as leases:
+            lease = leases.get(key)
+            if lease is None or lease["expires"] <= time.time():
+                return None
+            return lease["token"]
+
+
+def open_store(spec: str) -> LeaseStore:
+    """
+    open a lease store from a spec
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *spec*: `sqlite:///path/to/leases.db` (or a plain path),
+            `file:///path/to/leases.json` or a custom backend as
+            `package.module:Class` / `package.module:Class=arg`
+
+    ***
+    """
+    if spec.startswith("sqlite://"):
+        return SQLiteLeaseStore(spec[len("sqlite://") :])
+    if spec.startswith("file://"):
+        return FileLeaseStore(spec[len("file://") :])
+    if ":" in spec and "/" not in spec.split(":", 1)[0]:
+        target, _, arg = spec.partition("=")
+        module, _, name = target.partition(":")
+        backend = getattr(importlib.import_module(module), name)
+        return backend(arg) if arg else backend()
+    return SQLiteLeaseStore(spec)
+
+
+def worker_id():
+    """default worker id (hostname + pid)"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class HashRing:  # pylint: disable=too-few-public-methods
+    """
+    consistent hash ring of worker ids
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *workers*: worker ids
+
+    *vnodes*: virtual nodes per worker (smooths the split)
+
+    ***
+    """
+
+    def __init__(self, workers: List[str], vnodes: int = 64):
+        self.ring = sorted(
+            (_hash(f"{worker}#{vnode}"), worker)
+            for worker in workers
+            for vnode in range(vnodes)
+        )
+        self.keys = [key for key, _ in self.ring]
+
+    def owner(self, item: str) -> Optional[str]:
+        """get the worker that owns *item*"""
+        if not self.ring:
+            return None
+        index = bisect.bisect(self.keys, _hash(item)) % len(self.ring)
+        return self.ring[index][1]
+
+
+def _hash(value: str):
+    """stable (across processes / hosts) hash of a string"""
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+
+class Shard:
+    """
+    the part of the repo inventory owned by a worker
+
+    once it joined (`heartbeat`), the worker's membership & the leases of
+    the repos it holds are renewed from a background thread every `ttl / 3`
+    seconds, so a scan / merge pass longer than *ttl* (or a merge that keeps
+    retrying) doesn't let other workers take its repos over mid-pass
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *store*: lease store shared by all workers
+
+    *worker*: id of this worker
+
+    *ttl*: seconds leases live without being renewed
+
+    ***
+    """
+
+    def __init__(self, store: LeaseStore, worker: Optional[str] = None, ttl=300):
+        self.store = store
+        self.worker = worker or worker_id()
+        self.ttl = ttl
+        self.ring = HashRing([self.worker])
+        # repos leased by this worker (renewed in the background)
+        self.held = set()
+        self.lock = threading.Lock()
+        self._stopped = None
+
+    def heartbeat(self):
+        """renew this worker's membership & rebuild the ring of live workers"""
+        self.store.acquire(f"worker/{self.worker}", self.worker, self.ttl)
+        workers = sorted(set(self.store.holders("worker/").values()) | {self.worker})
+        self.ring = HashRing(workers)
+        with self.lock:
+            if self._stopped is None:
+                self._stopped = threading.Event()
+                threading.Thread(
+                    target=self._renew, args=(self._stopped,), daemon=True
+                ).start()
+        return workers
+
+    def _renew(self, stopped: threading.Event):
+        """keep renewing the membership & the held repo leases until `leave`"""
+        while not stopped.wait(self.ttl / 3):
+            with self.lock:
+                if stopped.is_set():
+                    break
+                self.store.acquire(f"worker/{self.worker}", self.worker, self.ttl)
+                for repo in list(self.held):
+                    if (
+                        self.store.acquire(f"repo/{repo}", self.worker, self.ttl)
+                        is None
+                    ):
+                        # lost it (e.g. this worker stalled past the ttl)
+                        self.held.discard(repo)
+
+    def owns(self, repo: str):
+        """check if this worker owns *repo*"""
+        return self.ring.owner(repo) == self.worker
+
+    def lease(self, repo: str) -> Optional[int]:
+        """lease *repo* before scanning / merging it (None if it's taken)"""
+        if not self.owns(repo):
+            return None
+        token = self.store.acquire(f"repo/{repo}", self.worker, self.ttl)
+        if token is not None:
+            with self.lock:
+                self.held.add(repo)
+        return token
+
+    def rebalance(self):
+        """release the leases of repos this worker no longer owns"""
+        for key, holder in self.store.holders("repo/").items():
+            if holder == self.worker and not self.owns(key[len("repo/") :]):
+                with self.lock:
+                    self.held.discard(key[len("repo/") :])
+                self.store.release(key, self.worker)
+
+    def leave(self):
+        """stop renewing & release every lease held by this worker"""
+        with self.lock:
+            if self._stopped is not None:
+                self._stopped.set()
+                self._stopped = None
+            self.held.clear()
+        for key, holder in self.store.holders("").items():
+            if holder == self.worker:
+                self.store.release(key, self.worker)
+
+
+class Leader:
+    """
+    leader election over a lease with a heartbeat & fencing token
+
+    the leader renews its lease from a background thread every `ttl / 3`
+    seconds; if the lease can't be renewed (or another instance took it
+    over) leadership is dropped. before a mutation the leader checks its
+    token is still the store's current one (`valid`) so a stalled, former
+    leader can't merge after a standby took over
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *store*: lease store shared by all instances
+
+    *holder*: id of this instance
+
+    *ttl*: seconds before a dead leader's lease can be taken over
+
+    *key*: name of the leader lease
+
+    ***
+    """
+
+    def __init__(
+        self,
+        store: LeaseStore,
+        holder: Optional[str] = None,
+        ttl: float = 15,
+        key: str = "leader",
+    ):
+        self.store = store
+        self.holder = holder or worker_id()
+        self.ttl = ttl
+        self.key = key
+        self.token = None
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def elect(self):
+        """try to become (or stay) the leader, returns True if leading"""
+        self.token = self.store.acquire(self.key, self.holder, self.ttl)
+        if self.token is not None and self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+            self._heartbeat.start()
+        return self.token is not None
+
+    def _renew(self):
+        """keep renewing the lease while leading"""
+        while not self._stopped.wait(self.ttl / 3):
+            token = self.token
+            if token is None:
+                break
+            if self.store.acquire(self.key, self.holder, self.ttl) != token:
+                self.token = None
+                break
+        self._heartbeat = None
+
+    def valid(self):
+        """check this instance still holds the lease it was elected with"""
+        return self.token is not None and self.store.token(self.key) == self.token
+
+    def resign(self):
+        """stop leading & release the lease so a standby takes over at once"""
+        self._stopped.set()
+        if self.token is not None:
+            self.store.release(self.key, self.holder)
+        self.token = None
@@ -0,0 +1,385 @@
+"""
+Prometheus metrics for long-running automerge processes
+
+metrics are kept in memory & served in the Prometheus text format from a
+local `/metrics` endpoint (stdlib HTTP server on a background thread).
+`gh` latencies & the retry queue come from the phase instrumentation
+(see `automerge.instrument`), the rest is recorded once per merge cycle
+
+***
+
+**classes**
+
+***
+
+*Counter*: monotonically increasing value (per label)
+
+*Gauge*: value that goes up & down (per label)
+
+*Histogram*: bucketed observations (per label)
+
+*Registry*: set of metrics rendered together
+
+***
+
+**functions**
+
+***
+
+*record_cycle*: record the stats & merge outcomes of a merge cycle
+
+*record_rate_limit*: record the remaining API rate limit
+
+*serve*: serve the registry on `/metrics` & start collecting
+
+***
+"""
+import bisect
+import threading
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Optional, List, Tuple
+
+from automerge.instrument import observe, active
+
+
+def _labels(names, values):
+    """render a label set (`{a="x",b="y"}`)"""
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    )
+    return (
+        "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+    )
+
+
+class _Metric:
+    """a named metric with optional labels"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """get (suffix, label names, label values, value) samples"""
+        raise NotImplementedError
+
+    def render(self):
+        """render the metric in the Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(names, values)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    monotonically increasing value (per label)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *name*: metric name
+
+    *documentation*: help text
+
+    *labels*: label names
+
+    ***
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1):
+        """add *amount* to the counter of *labels*"""
+        with self.lock:
+            self.values[labels] += amount
+
+    def samples(self):
+        with self.lock:
+            return [("", self.labels, key, value) for key, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """
+    value that goes up & down (per label), or read from *callback* when
+    it's scraped
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *name*: metric name
+
+    *documentation*: help text
+
+    *labels*: label names
+
+    *callback*: returns the (unlabeled) value at scrape time
+
+    ***
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        callback: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+        self.callback = callback
+
+    def set(self, value: float, *labels):
+        """set the gauge of *labels*"""
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self):
+        if self.callback is not None:
+            return [("", (), (), self.callback())]
+        with self.lock:
+            return [("", self.labels, key, value) for key, value in self.values.items()]
+
+
+class Histogram(_Metric):
+    """
+    bucketed observations (per label)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *name*: metric name
+
+    *documentation*: help text
+
+    *buckets*: upper bounds of the buckets (`+Inf` is added)
+
+    *labels*: label names
+
+    ***
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: List[float],
+        labels: Tuple[str, ...] = (),
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, value: float, *labels):
+        """add an observation for *labels*"""
+        with self.lock:
+            counts = self.values.setdefault(labels, [0] * (len(self.buckets) + 2))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], counts[:-1]):
+                cumulative += count
+                samples.append(
+                    ("_bucket", self.labels + ("le",), key + (bound,), cumulative)
+                )
+            samples.append(("_count", self.labels, key, cumulative))
+            samples.append(("_sum", self.labels, key, counts[-1]))
+        return samples
+
+
+class Registry:
+    """set of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """add a metric, returns it"""
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """render every metric in the Prometheus text format"""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+CYCLE_DURATION = REGISTRY.register(
+    Histogram(
+        "automerge_cycle_duration_seconds",
+        "duration of a merge cycle (scan + merges)",
+        [1, 5, 15, 30, 60, 120, 300, 600, 1800],
+    )
+)
+REPOS_SCANNED = REGISTRY.register(
+    Gauge("automerge_repos_scanned", "repos scanned in the last cycle")
+)
+PRS = REGISTRY.register(
+    Gauge("automerge_prs", "PRs found in the last cycle by state", ("state",))
+)
+MERGES = REGISTRY.register(
+    Counter("automerge_merges_total", "merge attempts by outcome", ("outcome",))
+)
+RETRY_QUEUE = REGISTRY.register(
+    Gauge(
+        "automerge_retry_queue_depth",
+        "merges waiting to be retried",
+        callback=lambda: active("retry_sleep"),
+    )
+)
+GH_LATENCY = REGISTRY.register(
+    Histogram(
+        "automerge_gh_duration_seconds",
+        "latency of gh subprocesses",
+        [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],
+    )
+)
+RATE_LIMIT = REGISTRY.register(
+    Gauge(
+        "automerge_rate_limit_remaining",
+        "remaining GitHub API rate limit",
+        ("resource",),
+    )
+)
+
+
+def _collect(name, _repo, seconds, _nbytes):
+    """phase observer feeding the `gh` latency histogram"""
+    if name == "gh":
+        GH_LATENCY.observe(seconds)
+
+
+def record_cycle(stats: dict, outcomes: List[str], seconds: float):
+    """
+    record the stats & merge outcomes of a merge cycle
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *stats*: automerge stats of the cycle
+
+    *outcomes*: merge outcomes (`merged`, `enqueued`, `failed`)
+
+    *seconds*: duration of the cycle
+
+    ***
+    """
+    CYCLE_DURATION.observe(seconds)
+    REPOS_SCANNED.set(
+        len(stats["stable_repos"])
+        + len(stats["unstable_repos"])
+        + len(stats["neutral_repos"])
+    )
+    PRS.set(len(stats["stable_prs"]), "stable")
+    PRS.set(len(stats["unstable_prs"]), "unstable")
+    for outcome in outcomes:
+        MERGES.inc(outcome)
+
+
+def record_rate_limit(rate_limit):
+    """
+    record the remaining API rate limit (ignores errors)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *rate_limit*: result of `_rate_limit`
+
+    ***
+    """
+    if isinstance(rate_limit, (str, bytes)):
+        return
+    for resource, limits in rate_limit.items():
+        RATE_LIMIT.set(limits["remaining"], resource)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """serve the registry on /metrics"""
+
+    registry = REGISTRY
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """don't log scrapes to the console"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """render the metrics"""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("content-type", "text/plain; version=0.0.4")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+_SERVING = []
+
+
+def serve(port: int, host: str = "127.0.0.1"):
+    """
+    serve the registry on `http://host:port/metrics` & start collecting
+    phase metrics (returns the server)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *port*: port to listen on (0 picks a free one)
+
+    *host*: interface to listen on (local only by default)
+
+    ***
+    """
+    if not _SERVING:
+        observe(_collect)
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _SERVING.append(server)
+    return server
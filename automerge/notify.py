@@ -0,0 +1,467 @@
+"""
+background notification dispatch for automerge
+
+notifications are put on a bounded queue & posted by a worker thread over
+a keep-alive `requests.Session`, so a slow webhook never slows merging.
+queues are flushed when the process exits
+
+a cycle's events fan out to every configured sink (Slack, a generic
+webhook, a local JSONL file) concurrently, duplicate events within the
+coalescing window are dropped first so sink traffic follows state
+changes rather than the poll rate
+
+***
+
+**classes**
+
+***
+
+*Dispatcher*: bounded queue drained by a worker thread
+
+*Notifier*: notification sink interface (subclass it to add a sink)
+
+*SlackNotifier*: post a digest of the events to a Slack incoming webhook
+
+*WebhookNotifier*: post the events as JSON to a generic HTTP webhook
+
+*FileNotifier*: append the events to a local JSONL file
+
+*Coalescer*: drop events already seen within a time window
+
+*Hub*: coalesce events & fan them out to every sink
+
+***
+
+**functions**
+
+***
+
+*slack_payload*: build the incoming webhook payload of a message
+
+*flush*: wait for every dispatcher to drain its queue
+
+*digest*: summarize a cycle's events in a single message
+
+*from_env*: build the notification hub configured in the environment
+
+***
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import contextvars
+from typing import Callable, Optional, List
+
+from automerge.utils import lazy_import, _env_number
+from automerge.instrument import phase
+
+# only imported once a webhook sink is configured
+requests = lazy_import("requests")
+
+
+class Dispatcher:  # pylint: disable=too-many-instance-attributes
+    """
+    bounded queue drained by a worker thread
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *send*: posts one message, returns a `requests.Response`
+
+    *maxsize*: max queued messages (the oldest is dropped when full)
+
+    *min_interval*: min seconds between two sends (Slack allows ~1/s)
+
+    *retries*: max retries of a message on 429 / 5xx / connection errors
+
+    *on_response*: called with every final response (or exception)
+
+    ***
+    """
+
+    def __init__(
+        self,
+        send: Callable,
+        maxsize: int = 1000,
+        min_interval: float = 1.0,
+        retries: int = 5,
+        on_response: Optional[Callable] = None,
+    ):  # pylint: disable=too-many-arguments
+        self.send = send
+        self.min_interval = min_interval
+        self.retries = retries
+        self.on_response = on_response
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self._sent_at = float("-inf")
+        self._worker = threading.Thread(target=self._drain, daemon=True)
+        self._worker.start()
+        _ALL.append(self)
+
+    def submit(self, message):
+        """queue a message without ever blocking the caller"""
+        # delivered in the caller's context so its phases nest under the caller
+        item = (contextvars.copy_context(), message)
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _drain(self):
+        """post queued messages one at a time"""
+        while True:
+            context, message = self.queue.get()
+            try:
+                try:
+                    response = context.run(self._deliver, message)
+                except Exception as error:  # pylint: disable=broad-except
+                    response = error
+                if self.on_response is not None:
+                    self.on_response(response)
+            finally:
+                # only done once the response is handled, so `flush` (& the
+                # exit hook) doesn't return before it's printed
+                self.queue.task_done()
+
+    def _deliver(self, message):
+        """send a message, retrying (& honoring Retry-After) on failures"""
+        delay = self.min_interval
+        for attempt in range(self.retries + 1):
+            time.sleep(max(0.0, self._sent_at + self.min_interval - time.monotonic()))
+            self._sent_at = time.monotonic()
+            try:
+                with phase("notify"):
+                    response = self.send(message)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+            else:
+                status_code = getattr(response, "status_code", None)
+                if status_code is None or (status_code != 429 and status_code < 500):
+                    return response
+                if attempt == self.retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                if retry_after is not None and retry_after.isdigit():
+                    delay = float(retry_after)
+            time.sleep(delay)
+            delay *= 2
+        return None
+
+    def flush(self, timeout: float = 30):
+        """wait (up to *timeout* seconds) for the queue to drain"""
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+
+def slack_payload(title: str, value: str):
+    """
+    build the incoming webhook payload of a message
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *title*: message title
+
+    *value*: message body
+
+    ***
+    """
+    return {
+        "attachments": [
+            {
+                "fallback": "",
+                "pretext": "",
+                "color": "#f4f4f4",
+                "fields": [{"title": title, "value": value, "short": False}],
+            }
+        ]
+    }
+
+
+# every dispatcher (flushed at exit)
+_ALL = []
+
+
+@atexit.register
+def flush(timeout: float = 30):
+    """wait for every dispatcher to drain its queue (runs at exit)"""
+    deadline = time.monotonic() + timeout
+    dispatchers = list(_ALL)
+    return all(
+        queued.flush(max(0.0, deadline - time.monotonic())) for queued in dispatchers
+    )
+
+
+def digest(events: List[dict]):
+    """
+    summarize a cycle's events in a single message (None if there's nothing
+    to report)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *events*: list of {kind, repo, number, url} dicts where kind is one of
+              `merged`, `enqueued`, `failed` or `unstable` (or {kind:
+              `error`, message} dicts)
+
+    ***
+    """
+    sections = (
+        ("merged", "Merged"),
+        ("enqueued", "Enqueued"),
+        ("failed", "Failed to merge"),
+        ("unstable", "Newly unstable"),
+    )
+    lines = [
+        f"error: {event['message']}" for event in events if event["kind"] == "error"
+    ]
+    for kind, title in sections:
+        prs = [event for event in events if event["kind"] == kind]
+        if prs:
+            lines.append(
+                f"{title} {len(prs)} PR(s): "
+                + ", ".join(
+                    event.get("url") or f"{event['repo']}#{event['number']}"
+                    for event in prs
+                )
+            )
+    return "\n".join(lines) or None
+
+
+class Notifier:  # pylint: disable=too-few-public-methods
+    """
+    notification sink interface (subclass it to add a sink)
+
+    `send` gets all (coalesced) events of a cycle at once from the sink's
+    own dispatcher thread
+    """
+
+    # min seconds between two sends
+    min_interval = 0.0
+
+    def send(self, events: List[dict]):
+        """deliver a batch of events (may return a `requests.Response`)"""
+        raise NotImplementedError
+
+
+class SlackNotifier(Notifier):  # pylint: disable=too-few-public-methods
+    """
+    post a digest of the events to a Slack incoming webhook
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *webhook_url*: Slack incoming webhook url
+
+    *title*: title of the messages
+
+    ***
+    """
+
+    min_interval = 1.0
+
+    def __init__(self, webhook_url: str, title: str = "Automerge"):
+        self.webhook_url = webhook_url
+        self.title = title
+        self.session = requests.Session()
+        self.session.headers["content-type"] = "application/json"
+
+    def send(self, events: List[dict]):
+        message = digest(events)
+        if message is None:
+            return None
+        return self.session.post(
+            self.webhook_url,
+            data=json.dumps(slack_payload(self.title, message)),
+            timeout=30,
+        )
+
+
+class WebhookNotifier(Notifier):  # pylint: disable=too-few-public-methods
+    """
+    post the events as JSON (`{"events": [...]}`) to a generic HTTP webhook
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *url*: webhook url
+
+    ***
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.session = requests.Session()
+
+    def send(self, events: List[dict]):
+        return self.session.post(self.url, json={"events": events}, timeout=30)
+
+
+class FileNotifier(Notifier):  # pylint: disable=too-few-public-methods
+    """
+    append the events to a local JSONL file (one event per line)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: JSONL file
+
+    ***
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, events: List[dict]):
+        with open(self.path, "a", encoding="utf-8") as events_file:
+            for event in events:
+                events_file.write(json.dumps({"time": time.time(), **event}) + "\n")
+
+
+class Coalescer:  # pylint: disable=too-few-public-methods
+    """
+    drop events already seen within a time window
+
+    events are identified by their kind, repo, PR number & message
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *window*: seconds an event is suppressed for after it was seen
+
+    ***
+    """
+
+    def __init__(self, window: float = 3600):
+        self.window = window
+        self.seen = {}
+
+    def __call__(self, events: List[dict]):
+        now, fresh = time.monotonic(), []
+        for event in events:
+            key = (
+                event.get("kind"),
+                event.get("repo"),
+                event.get("number"),
+                event.get("message"),
+            )
+            if now - self.seen.get(key, float("-inf")) >= self.window:
+                fresh.append(event)
+                self.seen[key] = now
+        # forget events outside the window so the map doesn't grow forever
+        self.seen = {
+            key: seen for key, seen in self.seen.items() if now - seen < self.window
+        }
+        return fresh
+
+
+class Hub:  # pylint: disable=too-few-public-methods
+    """
+    coalesce events & fan them out to every sink (each sink gets its own
+    dispatcher so a slow sink doesn't hold up the others)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *notifiers*: sinks to deliver events to
+
+    *window*: coalescing window in seconds (see `Coalescer`)
+
+    *on_response*: called with every final response (or exception)
+
+    ***
+    """
+
+    def __init__(
+        self,
+        notifiers: List[Notifier],
+        window: float = 3600,
+        on_response: Optional[Callable] = None,
+    ):
+        self.notifiers = notifiers
+        self.coalesce = Coalescer(window)
+        self.dispatchers = [
+            Dispatcher(
+                notifier.send,
+                min_interval=notifier.min_interval,
+                on_response=on_response,
+            )
+            for notifier in notifiers
+        ]
+
+    def notify(self, events: List[dict]):
+        """queue a cycle's events for every sink (never blocks)"""
+        events = self.coalesce(events)
+        if not events:
+            return
+        for queued in self.dispatchers:
+            queued.submit(events)
+
+
+def from_env(on_response: Optional[Callable] = None):
+    """
+    build the notification hub configured in the environment
+
+    `SLACK_WEBHOOK_URL` (Slack), `AUTOMERGE_WEBHOOK_URL` (generic webhook),
+    `AUTOMERGE_EVENTS_FILE` (JSONL file) & `AUTOMERGE_COALESCE_WINDOW`
+    (seconds, default 3600)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *on_response*: called with every final response (or exception)
+
+    ***
+    """
+    sinks = (
+        ("SLACK_WEBHOOK_URL", SlackNotifier),
+        ("AUTOMERGE_WEBHOOK_URL", WebhookNotifier),
+        ("AUTOMERGE_EVENTS_FILE", FileNotifier),
+    )
+    notifiers = [sink(os.environ[var]) for var, sink in sinks if os.environ.get(var)]
+    window = _env_number("AUTOMERGE_COALESCE_WINDOW", 3600.0)
+    return Hub(notifiers, window=window, on_response=on_response)
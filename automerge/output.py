@@ -0,0 +1,137 @@
+"""
+machine-readable output for automerge
+
+instead of rendering tables, `--output json|ndjson` streams one record
+per repo / PR as soon as it's classified (& one per merge outcome) to
+stdout:
+
+*repo*: `{"type": "repo", "repo", "stable", "unstable"[, "error"]}`
+
+*pr*: `{"type": "pr", "repo", "number", "url", "status"}` where status is
+`stable` or `unstable`
+
+*merge*: `{"type": "merge", "repo", "number", "outcome"}`
+
+*error*: `{"type": "error", "message"}`
+
+*plan*: `{"type": "plan", "repo", "backend", "waves"}` (`merge --plan`)
+
+*estimate*: `{"type": "estimate", "repos", "merges", "api_calls", ...}`
+(`merge --dry-run` / `--plan`, see `automerge.plan.estimate`)
+
+`ndjson` writes one record per line, `json` writes a single array that is
+closed when the command ends (records are still written as they come)
+
+***
+
+**classes**
+
+***
+
+*Writer*: stream records as JSON / NDJSON
+
+***
+
+**functions**
+
+***
+
+*repo_records*: get the records of a classified repo
+
+***
+"""
+import sys
+import json
+import threading
+from typing import Optional, TextIO
+
+
+def repo_records(repo: str, repo_stats: dict):
+    """
+    get the records of a classified repo (the repo & its PRs)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo
+
+    *repo_stats*: stats of the repo (see `_repo_stats`)
+
+    ***
+    """
+    record = {
+        "type": "repo",
+        "repo": repo,
+        "stable": repo_stats["num_stable"],
+        "unstable": repo_stats["num_unstable"],
+    }
+    if "error" in repo_stats:
+        record["error"] = repo_stats["error"]
+    records = [record]
+    for status in ("stable", "unstable"):
+        records.extend(
+            {
+                "type": "pr",
+                "repo": repo,
+                "number": pr["number"],
+                "url": pr["url"],
+                "status": status,
+            }
+            for pr in repo_stats[f"{status}_prs"]
+        )
+    return records
+
+
+class Writer:
+    """
+    stream records as JSON / NDJSON
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *fmt*: `json` or `ndjson`
+
+    *stream*: where to write (stdout by default)
+
+    ***
+    """
+
+    def __init__(self, fmt: str, stream: Optional[TextIO] = None):
+        self.fmt = fmt
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.written = 0
+        self.closed = False
+
+    def write(self, record: dict):
+        """write (& flush) one record"""
+        line = json.dumps(record)
+        with self.lock:
+            if self.fmt == "json":
+                line = ("[" if self.written == 0 else ",") + "\n" + line
+            else:
+                line += "\n"
+            self.stream.write(line)
+            self.stream.flush()
+            self.written += 1
+
+    def repo(self, repo: str, repo_stats: dict):
+        """write the records of a classified repo (a `_stats` `on_repo`)"""
+        for record in repo_records(repo, repo_stats):
+            self.write(record)
+
+    def close(self):
+        """end the output (closes the JSON array)"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.fmt == "json":
+                self.stream.write("[]\n" if self.written == 0 else "\n]\n")
+                self.stream.flush()
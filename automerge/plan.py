@@ -0,0 +1,191 @@
+"""
+merge plans & what they cost
+
+`merge --dry-run --plan` turns the scanned stats into the plan of a merge
+cycle without merging anything: every repo with stable PRs is a lane,
+merged through its merge queue (one `enqueuePullRequest` mutation for all
+of its PRs, see `_enqueue`) or directly in waves of non-conflicting PRs
+(see `_schedule`). the plan's cost (API calls, `gh` subprocesses, merges &
+duration) is estimated from the backend of every lane, the latency
+measured while scanning & the remaining rate limit
+
+only read-only queries run while planning (the merge queue detection of
+`auto`, cached for the merges that follow, & the rate limit), the
+detection queries are part of the estimate
+
+***
+
+**functions**
+
+***
+
+*build*: build the merge plan of scanned stats
+
+*estimate*: estimate the cost of a merge plan
+
+*report*: render a merge plan & its estimate
+
+***
+"""
+import math
+from typing import List, Optional
+
+from automerge.utils import (
+    MAX_RETRY,
+    MERGE_WORKERS,
+    _MERGE_QUEUES,
+    _reponames,
+    _schedule,
+    _merge_queue,
+)
+
+# API calls of one `gh pr merge --auto --delete-branch`: the PR is looked
+# up, merged (or queued for auto-merge) & its branch deleted
+MERGE_API_CALLS = 3
+
+
+def build(stats: dict, backend: str = "auto"):
+    """
+    build the merge plan of scanned stats
+
+    returns a list of lanes, {repo, backend, waves, lookups} where waves
+    are lists of PR numbers merged concurrently (waves are merged in order)
+    & lookups the queries run to detect the repo's merge queue (0 if it's
+    cached or not needed)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *stats*: automerge stats
+
+    *backend*: `direct`, `queue` or `auto` (see `_merge_repo`)
+
+    ***
+    """
+    lanes = []
+    for repo in _reponames(stats):
+        prs = stats[repo]["stable_prs"]
+        if not prs:
+            continue
+        lookups = int(backend == "auto" and repo not in _MERGE_QUEUES)
+        if backend == "queue" or (backend == "auto" and _merge_queue(repo)):
+            # PRs without a node id can't be enqueued (see `_enqueue`)
+            lane = {
+                "backend": "queue",
+                "waves": [[pr["number"] for pr in prs if pr.get("id")]],
+            }
+        else:
+            lane = {
+                "backend": "direct",
+                "waves": [[pr["number"] for pr in wave] for wave in _schedule(prs)],
+            }
+        lanes.append({"repo": repo, **lane, "lookups": lookups})
+    return lanes
+
+
+def estimate(
+    lanes: List[dict], seconds_per_call: float, rate_limit: Optional[dict] = None
+):
+    """
+    estimate the cost of a merge plan
+
+    every direct merge is one `gh pr merge` (`MERGE_API_CALLS` API calls),
+    every queue lane a single mutation & every merge queue detection one
+    query. lanes are merged one after the other & the merges of a wave
+    `MERGE_WORKERS` at a time. the worst case retries every direct merge
+    `MAX_RETRY` times
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *lanes*: merge plan (see `build`)
+
+    *seconds_per_call*: latency of a `gh` call (e.g. measured while scanning)
+
+    *rate_limit*: remaining rate limit (see `_rate_limit`), errors are ignored
+
+    ***
+    """
+    direct = [lane for lane in lanes if lane["backend"] == "direct"]
+    queued = [lane for lane in lanes if lane["backend"] == "queue"]
+    merges = sum(len(wave) for lane in direct for wave in lane["waves"])
+    lookups = sum(lane.get("lookups", 0) for lane in lanes)
+    rounds = sum(
+        math.ceil(len(wave) / MERGE_WORKERS)
+        for lane in direct
+        for wave in lane["waves"]
+    )
+    cost = {
+        "repos": len(lanes),
+        "merges": merges,
+        "enqueues": sum(len(lane["waves"][0]) for lane in queued),
+        "lookups": lookups,
+        "subprocesses": merges + len(queued) + lookups,
+        "api_calls": merges * MERGE_API_CALLS + len(queued) + lookups,
+        "worst_api_calls": merges * MERGE_API_CALLS * (MAX_RETRY + 1)
+        + len(queued)
+        + lookups,
+        "seconds": round((rounds + len(queued) + lookups) * seconds_per_call, 3),
+        "remaining": None,
+    }
+    if isinstance(rate_limit, dict):
+        # gh pr merge & the merge queue mutations both go through GraphQL
+        limits = rate_limit.get("graphql") or rate_limit.get("core") or {}
+        cost["remaining"] = limits.get("remaining")
+    return cost
+
+
+def report(lanes: List[dict], cost: dict, detailed: bool = True):
+    """
+    render a merge plan (one line per lane) & its estimate
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *lanes*: merge plan (see `build`)
+
+    *cost*: estimate of the plan (see `estimate`)
+
+    *detailed*: list every lane, not only the estimate
+
+    ***
+    """
+    import tabulate  # pylint: disable=import-outside-toplevel
+
+    lines = []
+    if detailed:
+        for lane in lanes:
+            waves = " -> ".join(
+                " ".join(f"#{number}" for number in wave) for wave in lane["waves"]
+            )
+            lines.append(f"{lane['repo']} ({lane['backend']}): {waves}")
+        lines.append("")
+    rows = [
+        ["repos", cost["repos"]],
+        ["direct merges", cost["merges"]],
+        ["enqueued PRs", cost["enqueues"]],
+        ["merge queue lookups", cost["lookups"]],
+        ["gh subprocesses", cost["subprocesses"]],
+        ["API calls", cost["api_calls"]],
+        ["API calls (worst case, retries)", cost["worst_api_calls"]],
+        ["duration (s, no retries)", cost["seconds"]],
+    ]
+    if cost["remaining"] is not None:
+        rows.append(["rate limit remaining", cost["remaining"]])
+    lines.append(tabulate.tabulate(rows, headers=["plan", "estimate"]))
+    if cost["remaining"] is not None and cost["worst_api_calls"] > cost["remaining"]:
+        lines.append(
+            "warning: the plan can exhaust the rate limit if merges are retried"
+            if cost["api_calls"] <= cost["remaining"]
+            else "warning: the plan exceeds the remaining rate limit"
+        )
+    return "\n".join(lines)
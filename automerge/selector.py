@@ -0,0 +1,263 @@
+"""
+repo selectors (what `--repos` / `-r` accepts)
+
+every `-r` value holds one or more terms (separated by commas or spaces),
+a repo is selected if it matches any term & none of the negated ones:
+
+*owner/name*: exact repo name
+
+*owner:NAME*: every repo of an owner (as are `NAME/` & `NAME/*`)
+
+*glob*: shell-style pattern on owner/name, e.g. `abmamo/*-infra`
+
+*re:REGEX*: regex searched in owner/name, e.g. `re:^abmamo/(mok|relok)$`
+
+*topic:NAME*: repos tagged with a topic
+
+*is:archived*: only archived repos (`!is:archived` skips them), applies
+on top of every other term
+
+*!TERM*: negation, e.g. `-r 'abmamo/* !abmamo/thesis'`
+
+terms are compiled once: exact names, owners & topics into hash sets, globs
+into one combined regex & every regex on its own (so its inline flags &
+backreferences keep their meaning). the predicates the API can filter on
+(owner, topic, archived) are pushed down into `gh repo list` so a run
+narrowed to a few owners / topics only lists those repos. like on GitHub,
+exact names & owners are case-insensitive
+
+***
+
+**classes**
+
+***
+
+*Selector*: compiled repo selector
+
+***
+
+**functions**
+
+***
+
+*compile_selector*: compile (& cache) the selector of `--repos` values
+
+*validate*: click callback rejecting invalid selectors
+
+***
+"""
+import re
+import fnmatch
+import functools
+from typing import Iterable, Optional
+
+import click
+
+# characters making a term a glob
+GLOB = re.compile(r"[*?\[]")
+
+
+class _Terms:
+    """the compiled (positive or negated) terms of a selector"""
+
+    def __init__(self):
+        self.names, self.owners, self.topics = set(), set(), set()
+        self.patterns, self.searches = [], []
+        self.regex = None
+
+    def __bool__(self):
+        return bool(
+            self.names or self.owners or self.topics or self.patterns or self.searches
+        )
+
+    def compile(self):
+        """combine the globs into a single regex"""
+        # GitHub names are case-insensitive (kept lowercase)
+        self.names = frozenset(name.lower() for name in self.names)
+        self.owners = frozenset(owner.lower() for owner in self.owners)
+        self.topics = frozenset(self.topics)
+        if self.patterns:
+            self.regex = re.compile("|".join(f"(?:{p})" for p in self.patterns))
+
+    def hit(self, repo: str, topics: Iterable[str] = ()):
+        """check if a repo matches any of the terms"""
+        return (
+            repo.lower() in self.names
+            or repo.split("/", 1)[0].lower() in self.owners
+            or (self.regex is not None and self.regex.match(repo) is not None)
+            or any(regex.search(repo) is not None for regex in self.searches)
+            or not self.topics.isdisjoint(topics)
+        )
+
+
+class Selector:
+    """
+    compiled repo selector (see the module docs for the syntax)
+
+    raises `ValueError` for invalid terms
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *values*: `--repos` values
+
+    ***
+    """
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.included, self.excluded = _Terms(), _Terms()
+        self.archived = None
+        # (owner, topic) listings covering the positive terms (None: all)
+        self.scopes = set()
+        for value in values:
+            for term in re.split(r"[,\s]+", value):
+                if term:
+                    self._add(term)
+        self.included.compile()
+        self.excluded.compile()
+
+    def _add(self, term: str):
+        """compile one term"""
+        negated = term.startswith("!")
+        body = term[1:] if negated else term
+        terms = self.excluded if negated else self.included
+        scope = None
+        if body == "is:archived":
+            self.archived = not negated
+            return
+        if body.startswith("re:"):
+            try:
+                # searched, not anchored
+                terms.searches.append(re.compile(body[3:]))
+            except re.error as error:
+                raise ValueError(f"invalid regex in {term!r}: {error}") from error
+        elif body.startswith("topic:") and body[6:]:
+            terms.topics.add(body[6:])
+            scope = (None, body[6:])
+        elif body.startswith("owner:") and body[6:]:
+            terms.owners.add(body[6:])
+            scope = (body[6:], None)
+        elif "/" not in body:
+            raise ValueError(f"invalid repo selector {term!r}, expected owner/name")
+        else:
+            owner, name = body.split("/", 1)
+            if not GLOB.search(owner) and name in ("", "*"):
+                terms.owners.add(owner)
+            elif GLOB.search(body):
+                terms.patterns.append(fnmatch.translate(body))
+            else:
+                terms.names.add(body)
+            scope = None if GLOB.search(owner) else (owner, None)
+        if not negated:
+            self.scopes.add(scope)
+
+    def __bool__(self):
+        return bool(self.included or self.excluded or self.archived is not None)
+
+    @property
+    def exact(self):
+        """the selected names (lowercase) if the selector only holds exact names"""
+        if self.excluded or self.archived is not None:
+            return None
+        included = self.included
+        if included.owners or included.topics or included.patterns or included.searches:
+            return None
+        return included.names
+
+    @property
+    def attributes(self):
+        """check if matching needs more than repo names (topics / archived)"""
+        return bool(
+            self.included.topics or self.excluded.topics or self.archived is not None
+        )
+
+    @property
+    def fields(self):
+        """`gh repo list --json` fields `match` needs"""
+        fields = ["url"]
+        if self.included.topics or self.excluded.topics:
+            fields.append("repositoryTopics")
+        if self.archived is not None:
+            fields.append("isArchived")
+        return ",".join(fields)
+
+    def listings(self):
+        """`gh repo list` arguments of the listings covering the selector"""
+        scopes = self.scopes if self.included else {None}
+        if None in scopes:
+            scopes = {(None, None)}
+        listings = []
+        for owner, topic in sorted(scopes, key=str):
+            args = [owner] if owner else []
+            if topic:
+                args += ["--topic", topic]
+            if self.archived is not None:
+                args.append("--archived" if self.archived else "--no-archived")
+            listings.append(args)
+        return listings
+
+    def match(
+        self,
+        repo: str,
+        topics: Iterable[str] = (),
+        archived: Optional[bool] = None,
+    ):
+        """
+        check if a repo is selected
+
+        ***
+
+        **parameters**
+
+        ***
+
+        *repo*: GitHub repo (owner/repo)
+
+        *topics*: topics of the repo
+
+        *archived*: if the repo is archived (None: unknown)
+
+        ***
+        """
+        if self.archived is not None and archived is not None:
+            if archived != self.archived:
+                return False
+        topics = frozenset(topics)
+        if self.excluded and self.excluded.hit(repo, topics):
+            return False
+        return not self.included or self.included.hit(repo, topics)
+
+
+@functools.lru_cache(maxsize=64)
+def _compiled(values: tuple):
+    """compile the selector of *values* (cached)"""
+    return Selector(values)
+
+
+def compile_selector(values: Optional[Iterable[str]] = None):
+    """
+    compile (& cache) the selector of `--repos` values
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *values*: `--repos` values (None / empty selects every repo)
+
+    ***
+    """
+    return _compiled(tuple(values or ()))
+
+
+def validate(_ctx, param, value):
+    """click callback rejecting invalid selectors (returns them unchanged)"""
+    try:
+        compile_selector(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param=param) from error
+    return value
@@ -0,0 +1,685 @@
+"""
+hermetic GitHub simulator for offline testing & benchmarking
+
+a synthetic account (repos, PRs, merge queues, rate limit, latency
+distribution) lives in a JSON state file. a fake `gh` executable (see
+`automerge.sim.gh`) put first on PATH & a local HTTP stand-in for the API
+(see `automerge.sim.server`) both serve it, so `_stats`, `merge` & every
+backend run without network access
+
+***
+
+**classes**
+
+***
+
+*Simulator*: synthetic GitHub account backed by a state file
+
+*MemorySimulator*: synthetic GitHub account held in memory
+
+***
+
+**functions**
+
+***
+
+*generate*: build the state of a synthetic account
+
+*install*: write a fake `gh` executable into a directory
+
+*fake_gh*: put a fake `gh` serving a state file first on PATH
+
+*in_process*: answer automerge's `gh` calls in-process (no subprocesses)
+
+***
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import fcntl
+import random
+import pathlib
+import threading
+import contextlib
+import subprocess
+from typing import Optional, List
+
+PR_FIELDS = (
+    "number",
+    "author",
+    "state",
+    "mergeable",
+    "mergeStateStatus",
+    "url",
+    "files",
+    "additions",
+    "deletions",
+    "id",
+)
+
+LOCKFILES = ("package-lock.json", "poetry.lock", "requirements.txt", "go.sum")
+
+
+def generate(
+    repos: int = 10,
+    prs_per_repo: int = 3,
+    owner: str = "mergy",
+    unstable: float = 0.2,
+    pending: float = 0.1,
+    queues: float = 0.0,
+    latency: Optional[dict] = None,
+    rate_limit: int = 5000,
+    seed: int = 0,
+):  # pylint: disable=too-many-arguments,too-many-locals
+    """
+    build the state of a synthetic account
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repos*: number of repos
+
+    *prs_per_repo*: number of open dependabot PRs per repo
+
+    *owner*: account / org owning the repos
+
+    *unstable*: fraction of PRs with failing checks
+
+    *pending*: fraction of PRs whose checks are still running (they turn
+               CLEAN after a couple of polls)
+
+    *queues*: fraction of repos with a merge queue
+
+    *latency*: latency distribution of every call, {median, sigma,
+               slow, slow_rate} (lognormal + rare slow outliers)
+
+    *rate_limit*: API calls allowed per hour
+
+    *seed*: random seed (the same seed builds the same account)
+
+    ***
+    """
+    rng = random.Random(seed)
+    state = {
+        "owner": owner,
+        "repos": {},
+        "latency": latency or {"median": 0.0, "sigma": 0.0},
+        "rate_limit": {"limit": rate_limit, "remaining": rate_limit},
+        "counters": {"subprocesses": 0, "api_calls": 0},
+        "webhooks": [],
+    }
+    for num in range(repos):
+        name = f"{owner}/repo{num}"
+        prs = []
+        for pr_num in range(1, prs_per_repo + 1):
+            roll = rng.random()
+            status = "CLEAN"
+            if roll < unstable:
+                status = "UNSTABLE"
+            elif roll < unstable + pending:
+                status = "BLOCKED"
+            lockfile = rng.choice(LOCKFILES)
+            prs.append(
+                {
+                    "number": pr_num,
+                    "author": {"login": "app/dependabot", "is_bot": True},
+                    "state": "OPEN",
+                    "mergeable": "MERGEABLE",
+                    "mergeStateStatus": status,
+                    "url": f"https://github.com/{name}/pull/{pr_num}",
+                    "files": [{"path": lockfile}]
+                    + [{"path": "package.json"}] * (lockfile == "package-lock.json"),
+                    "additions": rng.randint(1, 200),
+                    "deletions": rng.randint(1, 200),
+                    "id": f"PR_{num}_{pr_num}",
+                    # polls until a BLOCKED PR's checks finish
+                    "polls": rng.randint(1, 3) if status == "BLOCKED" else 0,
+                }
+            )
+        state["repos"][name] = {
+            "prs": prs,
+            "merge_queue": rng.random() < queues,
+            "queue": [],
+            "topics": [],
+            "archived": False,
+        }
+    return state
+
+
+class Simulator:
+    """
+    synthetic GitHub account backed by a state file
+
+    every call is applied in a transaction (the file is locked) so any
+    number of fake `gh` processes can share the account
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: state file (see `generate`)
+
+    ***
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def create(cls, path: str, **options):
+        """write a freshly generated account (see `generate`) to *path*"""
+        pathlib.Path(path).write_text(json.dumps(generate(**options)), "utf-8")
+        return cls(path)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """lock the state file & yield its (mutable) state"""
+        with open(self.path, "r+", encoding="utf-8") as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                state = json.load(state_file)
+                yield state
+                state_file.seek(0)
+                state_file.truncate()
+                json.dump(state, state_file)
+                # write before unlocking (closing the file would be too late)
+                state_file.flush()
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def state(self):
+        """get a copy of the current state"""
+        with open(self.path, encoding="utf-8") as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_SH)
+            try:
+                return json.load(state_file)
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def counters(self):
+        """get the subprocess / API call counters"""
+        return self.state()["counters"]
+
+    def latency(self, state: Optional[dict] = None):
+        """sample the latency of one call (seconds)"""
+        latency = (state or self.state())["latency"]
+        delay = 0.0
+        if latency.get("median"):
+            delay = random.lognormvariate(
+                math.log(latency["median"]), latency.get("sigma", 0.0)
+            )
+        if latency.get("slow_rate") and random.random() < latency["slow_rate"]:
+            delay += latency.get("slow", 10.0)
+        return delay
+
+    def execute(self, args: List[str]):
+        """
+        run a `gh` command against the account
+
+        returns (returncode, stdout, stderr)
+
+        ***
+
+        **parameters**
+
+        ***
+
+        *args*: gh arguments (without `gh`)
+
+        ***
+        """
+        with self.transaction() as state:
+            state["counters"]["subprocesses"] += 1
+            try:
+                return _dispatch(state, list(args))
+            except _Error as error:
+                return 1, "", f"{error}\n"
+
+
+class MemorySimulator(Simulator):
+    """
+    synthetic GitHub account held in memory (see `in_process`), large
+    accounts are served without re-reading a state file on every call
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *state*: account state (see `generate`)
+
+    ***
+    """
+
+    def __init__(self, state: dict):  # pylint: disable=super-init-not-called
+        self.path = None
+        self._state = state
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self._state
+
+    def state(self):
+        with self._lock:
+            return json.loads(json.dumps(self._state))
+
+    def counters(self):
+        with self._lock:
+            return dict(self._state["counters"])
+
+    def latency(self, state: Optional[dict] = None):
+        return super().latency(state or self._state)
+
+
+class _Error(Exception):
+    """a failed gh call (goes to stderr)"""
+
+
+def _option(args: List[str], *names, default=None):
+    """get the value of a `--name value` option"""
+    for name in names:
+        if name in args:
+            return args[args.index(name) + 1]
+    return default
+
+
+def _spend(state: dict, cost: int = 1):
+    """count API calls against the rate limit"""
+    rate_limit = state["rate_limit"]
+    if rate_limit["remaining"] < cost:
+        raise _Error("API rate limit exceeded")
+    rate_limit["remaining"] -= cost
+    state["counters"]["api_calls"] += cost
+
+
+def _repo(state: dict, name: str):
+    """get a repo of the account"""
+    if name not in state["repos"]:
+        raise _Error(
+            f"GraphQL: Could not resolve to a Repository with the name '{name}'."
+        )
+    return state["repos"][name]
+
+
+def _dispatch(state: dict, args: List[str]):
+    """route a gh command"""
+    if args[:1] == ["auth"]:
+        return 0, "", ""
+    if args[:2] == ["repo", "list"]:
+        return 0, json.dumps(_repo_list(state, args)), ""
+    if args[:1] == ["pr"]:
+        repo = _option(args, "-R", "--repo")
+        rest = [arg for arg in args[1:] if arg not in ("-R", "--repo", repo)]
+        if rest[:1] == ["list"]:
+            return 0, json.dumps(_pr_list(state, repo, args)), ""
+        if rest[:1] == ["merge"]:
+            return _pr_merge(state, repo, int(rest[1]), "--auto" in rest)
+    if args[:2] == ["api", "rate_limit"]:
+        rate_limit = dict(state["rate_limit"], reset=int(time.time()) + 3600)
+        return 0, json.dumps({"resources": {"core": rate_limit}}), ""
+    if args[:2] == ["api", "graphql"]:
+        fields = dict(
+            arg.split("=", 1) for arg in args[2:] if "=" in arg and arg[0] != "-"
+        )
+        query = fields.pop("query", "")
+        return 0, json.dumps({"data": graphql(state, query, fields)}), ""
+    raise _Error(f"unknown command: gh {' '.join(args)}")
+
+
+def _repo_list(state: dict, args: List[str]):
+    """`gh repo list [owner] --json ... --limit N`"""
+    limit = int(_option(args, "-L", "--limit", default=30))
+    fields = _option(args, "--json", default="url").split(",")
+    owner = args[2] if len(args) > 2 and not args[2].startswith("-") else None
+    topic = _option(args, "--topic")
+    repos = [
+        (name, repo)
+        for name, repo in state["repos"].items()
+        if (owner is None or name.split("/")[0] == owner)
+        and (topic is None or topic in repo["topics"])
+        and not ("--no-archived" in args and repo["archived"])
+        and not ("--archived" in args and not repo["archived"])
+    ][:limit]
+    # the API pages through repos 100 at a time
+    _spend(state, max(1, math.ceil(len(repos) / 100)))
+    values = {
+        "url": lambda name, repo: f"https://github.com/{name}",
+        "nameWithOwner": lambda name, repo: name,
+        "isArchived": lambda name, repo: repo["archived"],
+        "repositoryTopics": lambda name, repo: [
+            {"name": topic} for topic in repo["topics"]
+        ],
+    }
+    return [
+        {field: values[field](name, repo) for field in fields if field in values}
+        for name, repo in repos
+    ]
+
+
+def _pr_list(state: dict, name: str, args: List[str]):
+    """
+    `gh pr -R owner/repo list --json ...`
+
+    every poll advances pending checks, PRs with auto-merge enabled merge
+    once theirs finish
+    """
+    repo = _repo(state, name)
+    _spend(state)
+    fields = _option(args, "--json", default="number,url").split(",")
+    return [
+        {field: pr[field] for field in fields if field in PR_FIELDS}
+        for pr in _poll(repo)
+    ]
+
+
+def _poll(repo: dict):
+    """
+    the open PRs of a repo, every poll advances pending checks & PRs with
+    auto-merge enabled merge once theirs finish
+    """
+    prs = []
+    for pr in repo["prs"]:
+        if pr["state"] != "OPEN":
+            continue
+        if pr["mergeStateStatus"] == "BLOCKED":
+            pr["polls"] -= 1
+            if pr["polls"] <= 0:
+                pr["mergeStateStatus"] = "CLEAN"
+                if pr.get("auto_merge"):
+                    _merged(repo, pr)
+                    continue
+        prs.append(pr)
+    return prs
+
+
+def _pr_merge(state: dict, name: str, number: int, auto: bool = True):
+    """`gh pr -R owner/repo merge N --auto --delete-branch --merge`"""
+    repo = _repo(state, name)
+    _spend(state)
+    for pr in repo["prs"]:
+        if pr["number"] == number and pr["state"] == "OPEN":
+            if pr["mergeStateStatus"] == "UNSTABLE":
+                return 1, "", f"Pull request #{number} is not mergeable\n"
+            if pr["mergeStateStatus"] != "CLEAN":
+                if not auto:
+                    return (
+                        1,
+                        "",
+                        "Pull request is not in the correct state to enable auto-merge\n",
+                    )
+                # merged once its checks finish (see `_pr_list`)
+                pr["auto_merge"] = True
+                return 0, "", ""
+            _merged(repo, pr)
+            return 0, "", ""
+    raise _Error(f"no pull requests found for {number}")
+
+
+def _merged(repo: dict, pr: dict):
+    """merge a PR, the other PRs touching the same files now need a rebase"""
+    pr["state"] = "MERGED"
+    files = {file["path"] for file in pr["files"]}
+    for other in repo["prs"]:
+        if other["state"] == "OPEN" and files & {
+            file["path"] for file in other["files"]
+        }:
+            other["mergeStateStatus"], other["polls"] = "BLOCKED", 2
+
+
+def _pr_node(repo: dict, number: int):
+    """the GraphQL node of a PR (None if there's no such PR)"""
+    for pr in repo["prs"]:
+        if pr["number"] == number:
+            return {
+                **{
+                    key: pr[key]
+                    for key in (
+                        "id",
+                        "number",
+                        "url",
+                        "state",
+                        "mergeable",
+                        "mergeStateStatus",
+                        "additions",
+                        "deletions",
+                    )
+                },
+                # GraphQL drops the app/ prefix of bot logins
+                "author": {"login": pr["author"]["login"].split("/")[-1]},
+                "files": {"nodes": pr["files"]},
+            }
+    return None
+
+
+def graphql(
+    state: dict, query: str, variables: dict
+):  # pylint: disable=too-many-locals
+    """
+    answer the GraphQL queries automerge sends (merge queues & repo lookups)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *state*: account state (see `generate`)
+
+    *query*: GraphQL query / mutation
+
+    *variables*: GraphQL variables
+
+    ***
+    """
+    _spend(state)
+    if "enqueuePullRequest" in query:
+        data = {}
+        for alias, pr_id in re.findall(
+            r'(\w+): enqueuePullRequest\(input: \{pullRequestId: "([^"]+)"\}\)', query
+        ):
+            data[alias] = None
+            for repo in state["repos"].values():
+                for pr in repo["prs"]:
+                    if pr["id"] == pr_id and pr["state"] == "OPEN":
+                        repo["queue"].append(pr["number"])
+                        data[alias] = {
+                            "mergeQueueEntry": {"position": len(repo["queue"])}
+                        }
+        return data
+    lookups = re.findall(
+        r'(\w+): repository\(owner: "([^"]+)", name: "([^"]+)"\)(.*)', query
+    )
+    if lookups:
+        return _lookups(state, lookups)
+    name = f"{variables.get('owner')}/{variables.get('name')}"
+    repo = _repo(state, name)
+    if "entries" in query:
+        # the queue merges its head every time it's looked at
+        if repo["queue"]:
+            head = repo["queue"].pop(0)
+            for pr in repo["prs"]:
+                if pr["number"] == head:
+                    pr["state"] = "MERGED"
+        nodes = [
+            {"position": position, "state": "QUEUED", "pullRequest": {"number": num}}
+            for position, num in enumerate(repo["queue"], start=1)
+        ]
+        return {"repository": {"mergeQueue": {"entries": {"nodes": nodes}}}}
+    merge_queue = {"url": f"https://github.com/{name}/queue"}
+    return {"repository": {"mergeQueue": merge_queue if repo["merge_queue"] else None}}
+
+
+def _lookups(state: dict, lookups: List[tuple]):
+    """answer batched repository lookups, repos / PRs that don't exist are null"""
+    data = {}
+    # names are case-insensitive, GitHub answers with the canonical one
+    canonical = {key.lower(): key for key in state["repos"]}
+    for alias, owner, name, fields in lookups:
+        key = canonical.get(f"{owner}/{name}".lower())
+        repo = state["repos"].get(key)
+        data[alias] = repo and {
+            "nameWithOwner": key,
+            "isArchived": repo["archived"],
+            "mergeQueue": (
+                {"url": f"https://github.com/{key}/queue"}
+                if repo["merge_queue"]
+                else None
+            ),
+        }
+        if repo and "pullRequests(" in fields:
+            # what `_fingerprints` compares between refreshes
+            prs = _poll(repo)
+            data[alias]["pushedAt"] = repo.get("pushedAt")
+            data[alias]["pullRequests"] = {
+                "totalCount": len(prs),
+                "nodes": [
+                    {
+                        "number": pr["number"],
+                        "updatedAt": pr.get("updatedAt"),
+                        "mergeStateStatus": pr["mergeStateStatus"],
+                    }
+                    for pr in prs[:100]
+                ],
+            }
+        number = re.search(r"pullRequest\(number: (\d+)\)", fields)
+        if repo and number:
+            data[alias]["pullRequest"] = _pr_node(repo, int(number.group(1)))
+    return data
+
+
+def install(directory: str):
+    """
+    write a fake `gh` executable into a directory (put it first on PATH)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *directory*: where to write `gh`
+
+    ***
+    """
+    path = pathlib.Path(directory) / "gh"
+    # the package may not be installed (e.g. running from a checkout)
+    root = pathlib.Path(__file__).resolve().parents[2]
+    path.write_text(
+        "#!/bin/sh\n"
+        f'PYTHONPATH="{root}${{PYTHONPATH:+:$PYTHONPATH}}" '
+        f'exec "{sys.executable}" -m automerge.sim.gh "$@"\n',
+        "utf-8",
+    )
+    path.chmod(0o755)
+    return str(path)
+
+
+@contextlib.contextmanager
+def fake_gh(state_path: str, directory: Optional[str] = None):
+    """
+    put a fake `gh` serving *state_path* first on PATH (restored on exit)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *state_path*: state file (see `generate`)
+
+    *directory*: where to write `gh` (defaults to next to the state file)
+
+    ***
+    """
+    directory = directory or str(pathlib.Path(state_path).parent)
+    install(directory)
+    saved = {var: os.environ.get(var) for var in ("PATH", "AUTOMERGE_SIM_STATE")}
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+    os.environ["AUTOMERGE_SIM_STATE"] = str(state_path)
+    try:
+        yield Simulator(state_path)
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+class _Process:
+    """stand-in for the `subprocess.Popen` of a gh call (see `in_process`)"""
+
+    def __init__(self, simulator: Simulator, args: List[str]):
+        self.simulator = simulator
+        self.args = args
+        self.returncode = None
+        self._output = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def pid(self):
+        """there's no process group to kill, `_execute` falls back to `kill`"""
+        raise AttributeError("pid")
+
+    def kill(self):
+        """a timed out call returns nothing"""
+        self.returncode, self._output = -9, (b"", b"")
+
+    def communicate(self, timeout: Optional[float] = None):
+        """run the call (sleeping its sampled latency up to *timeout*)"""
+        if self._output is None:
+            delay = self.simulator.latency()
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(delay)
+            returncode, stdout, stderr = self.simulator.execute(self.args[1:])
+            self.returncode = returncode
+            self._output = (stdout.encode("utf-8"), stderr.encode("utf-8"))
+        return self._output
+
+
+@contextlib.contextmanager
+def in_process(simulator: Simulator):
+    """
+    answer automerge's `gh` calls in-process (no subprocesses are spawned,
+    the calls are still counted as subprocesses) while the context is open
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *simulator*: account to serve (e.g. a `MemorySimulator`)
+
+    ***
+    """
+    popen = subprocess.Popen
+
+    def fake_popen(cmd, *args, **kwargs):
+        if cmd and cmd[0] == "gh":
+            return _Process(simulator, list(cmd))
+        return popen(cmd, *args, **kwargs)
+
+    subprocess.Popen = fake_popen
+    try:
+        yield simulator
+    finally:
+        subprocess.Popen = popen
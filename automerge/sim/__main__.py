@@ -0,0 +1,73 @@
+"""
+simulator CLI
+
+*generate*: write a synthetic account to a state file
+
+*serve*: serve a state file over HTTP (see `automerge.sim.server`)
+
+*gh*: print the PATH entry of a fake `gh` serving a state file
+"""
+import time
+import tempfile
+
+import click
+
+from automerge.sim import Simulator, install
+from automerge.sim.server import serve as serve_state
+
+
+@click.group()
+def cli():
+    """hermetic GitHub simulator"""
+
+
+@cli.command()
+@click.argument("state")
+@click.option("--repos", type=int, default=10)
+@click.option("--prs", "prs_per_repo", type=int, default=3)
+@click.option("--owner", default="mergy")
+@click.option("--unstable", type=float, default=0.2)
+@click.option("--pending", type=float, default=0.1)
+@click.option("--queues", type=float, default=0.0)
+@click.option("--median", type=float, default=0.0, help="median latency (s).")
+@click.option("--sigma", type=float, default=0.0, help="lognormal latency sigma.")
+@click.option("--slow", type=float, default=10.0, help="latency of outliers (s).")
+@click.option("--slow-rate", type=float, default=0.0, help="fraction of outliers.")
+@click.option("--rate-limit", type=int, default=5000)
+@click.option("--seed", type=int, default=0)
+def generate(
+    state, median, sigma, slow, slow_rate, **options
+):  # pylint: disable=too-many-arguments
+    """write a synthetic account to STATE"""
+    latency = {"median": median, "sigma": sigma, "slow": slow, "slow_rate": slow_rate}
+    Simulator.create(state, latency=latency, **options)
+    click.echo(state)
+
+
+@cli.command()
+@click.argument("state")
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", type=int, default=8765)
+@click.option("--webhook-interval", type=float, default=1.0)
+def serve(state, host, port, webhook_interval):
+    """serve STATE over HTTP until interrupted"""
+    server, url = serve_state(state, host, port, webhook_interval)
+    click.echo(url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+@cli.command()
+@click.argument("state")
+def gh(state):  # pylint: disable=invalid-name
+    """print `export` lines putting a fake gh serving STATE on PATH"""
+    directory = tempfile.mkdtemp(prefix="automerge-sim-")
+    install(directory)
+    click.echo(f'export PATH="{directory}:$PATH" AUTOMERGE_SIM_STATE="{state}"')
+
+
+if __name__ == "__main__":
+    cli()  # pylint: disable=no-value-for-parameter
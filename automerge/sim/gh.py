@@ -0,0 +1,27 @@
+"""
+fake `gh` executable serving the simulated account in `AUTOMERGE_SIM_STATE`
+
+installed on PATH by `automerge.sim.install` / `automerge.sim.fake_gh`
+"""
+import os
+import sys
+import time
+
+from automerge.sim import Simulator
+
+
+def main(argv=None):
+    """run one gh command against the simulated account"""
+    simulator = Simulator(os.environ["AUTOMERGE_SIM_STATE"])
+    # sleep outside the state lock so slow calls overlap like real ones
+    time.sleep(simulator.latency())
+    returncode, stdout, stderr = simulator.execute(
+        sys.argv[1:] if argv is None else argv
+    )
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
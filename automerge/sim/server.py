@@ -0,0 +1,140 @@
+"""
+local HTTP stand-in for the GitHub API & webhook sinks
+
+serves the simulated account of a state file (see `automerge.sim`):
+
+*POST /graphql*: GraphQL queries (see `automerge.sim.graphql`)
+
+*GET /rate_limit*: remaining rate limit
+
+*GET /repos/{owner}/{repo}/pulls*: open PRs of a repo
+
+*POST /hooks/{name}*: webhook sink (Slack / generic webhooks), payloads are
+recorded in the state's `webhooks` & posting faster than
+`webhook_interval` seconds is answered with a 429
+
+***
+
+**functions**
+
+***
+
+*serve*: start the stand-in on a background thread
+
+***
+"""
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from automerge.sim import Simulator, graphql, _pr_list, _Error
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """route requests to the simulator"""
+
+    simulator: Simulator = None
+    webhook_interval = 0.0
+    _posted_at = float("-inf")
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """keep test / benchmark output quiet"""
+
+    def _reply(self, status, body=None, headers=None):
+        payload = json.dumps(body if body is not None else {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get("content-length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """rate limit & PR lists"""
+        time.sleep(self.simulator.latency())
+        parts = self.path.strip("/").split("/")
+        try:
+            with self.simulator.transaction() as state:
+                if parts == ["rate_limit"]:
+                    body = {"resources": {"core": state["rate_limit"]}}
+                elif len(parts) == 4 and parts[0] == "repos" and parts[3] == "pulls":
+                    body = _pr_list(state, f"{parts[1]}/{parts[2]}", [])
+                else:
+                    self._reply(404, {"message": "Not Found"})
+                    return
+        except _Error as error:
+            self._reply(403, {"message": str(error)})
+            return
+        self._reply(200, body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """GraphQL & webhook sinks"""
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "hooks":
+            self._hook("/".join(parts[1:]))
+            return
+        if parts != ["graphql"]:
+            self._reply(404, {"message": "Not Found"})
+            return
+        time.sleep(self.simulator.latency())
+        body = self._body()
+        try:
+            with self.simulator.transaction() as state:
+                data = graphql(state, body.get("query", ""), body.get("variables", {}))
+        except _Error as error:
+            self._reply(200, {"data": None, "errors": [{"message": str(error)}]})
+            return
+        self._reply(200, {"data": data})
+
+    def _hook(self, name):
+        """record a webhook payload (429 when posting too fast)"""
+        with self._lock:
+            now = time.monotonic()
+            if now - type(self)._posted_at < self.webhook_interval:
+                self._reply(429, {"ok": False}, {"Retry-After": "1"})
+                return
+            type(self)._posted_at = now
+        payload = self._body()
+        with self.simulator.transaction() as state:
+            state["webhooks"].append({"hook": name, "payload": payload})
+        self._reply(200, {"ok": True})
+
+
+def serve(path: str, host: str = "127.0.0.1", port: int = 0, webhook_interval=0.0):
+    """
+    start the stand-in on a background thread
+
+    returns (server, base url), stop it with `server.shutdown()`
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: state file (see `automerge.sim.generate`)
+
+    *host*: interface to listen on
+
+    *port*: port to listen on (0 picks a free one)
+
+    *webhook_interval*: min seconds between webhook posts (Slack ~1)
+
+    ***
+    """
+    handler = type(
+        "Handler",
+        (_Handler,),
+        {"simulator": Simulator(path), "webhook_interval": webhook_interval},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,159 @@
+"""
+trace spans for automerge runs
+
+every instrumented phase (see `automerge.instrument`) becomes a span: a
+merge cycle is the root span with child spans for the scan, every repo
+fetch & classification, merge attempt, retry sleep, `gh` call &
+notification. spans are appended to a local JSONL file in the OTLP JSON
+shape (one `resourceSpans` export per line, written when a trace's root
+span ends) so a slow cycle can be loaded into a trace viewer
+
+***
+
+**classes**
+
+***
+
+*Tracer*: phase observer writing spans to a JSONL file
+
+***
+
+**functions**
+
+***
+
+*span*: build the OTLP JSON of a finished phase
+
+***
+"""
+import os
+import json
+import atexit
+import threading
+from collections import defaultdict
+
+from automerge.instrument import observe, unobserve, current
+
+# trace ids are unique per process (phase idents only per process)
+_SALT = os.urandom(8).hex()
+
+
+def _root(running):
+    """the outermost phase a phase runs under"""
+    while running.parent is not None:
+        running = running.parent
+    return running
+
+
+def _attribute(key, value):
+    """an OTLP attribute"""
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def span(running, seconds: float):
+    """
+    build the OTLP JSON of a finished phase
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *running*: the finished phase (see `automerge.instrument.current`)
+
+    *seconds*: duration of the phase
+
+    ***
+    """
+    attributes = []
+    if running.repo is not None:
+        attributes.append(_attribute("automerge.repo", running.repo))
+    if running.nbytes:
+        attributes.append(_attribute("automerge.bytes", running.nbytes))
+    return {
+        "traceId": f"{_SALT}{_root(running).ident:016x}",
+        "spanId": f"{running.ident:016x}",
+        "parentSpanId": (
+            f"{running.parent.ident:016x}" if running.parent is not None else ""
+        ),
+        "name": running.name,
+        # SPAN_KIND_INTERNAL
+        "kind": 1,
+        "startTimeUnixNano": str(running.started),
+        "endTimeUnixNano": str(running.started + int(seconds * 1e9)),
+        "attributes": attributes,
+        "status": {},
+    }
+
+
+class Tracer:
+    """
+    phase observer writing spans to a JSONL file
+
+    the spans of a trace are buffered until its root span ends, spans that
+    end later (e.g. notifications posted after the cycle) are written on
+    their own
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *path*: JSONL file spans are appended to
+
+    *service*: `service.name` of the exported resource
+
+    ***
+    """
+
+    def __init__(self, path: str, service: str = "automerge"):
+        self.path = path
+        self.service = service
+        self.lock = threading.Lock()
+        self.pending = defaultdict(list)
+        self.ended = set()
+
+    def __call__(self, _name, _repo, seconds, _nbytes):
+        running = current()
+        if running is None:
+            return
+        root = _root(running)
+        with self.lock:
+            self.pending[root.ident].append(span(running, seconds))
+            if running is root or root.ident in self.ended:
+                if running is root:
+                    self.ended.add(root.ident)
+                self._write(self.pending.pop(root.ident))
+
+    def _write(self, spans):
+        """append one OTLP export of *spans* (lock held)"""
+        export = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_attribute("service.name", self.service)]
+                    },
+                    "scopeSpans": [{"scope": {"name": "automerge"}, "spans": spans}],
+                }
+            ]
+        }
+        with open(self.path, "a", encoding="utf-8") as trace_file:
+            trace_file.write(json.dumps(export) + "\n")
+
+    def start(self):
+        """start tracing (flushes unfinished traces at exit), returns self"""
+        observe(self)
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """stop tracing & write the spans of unfinished traces"""
+        unobserve(self)
+        with self.lock:
+            for spans in self.pending.values():
+                self._write(spans)
+            self.pending.clear()
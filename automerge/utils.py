@@ -1,3 +1,4 @@
+# pylint: disable=too-many-lines
 """
 util functions for the automerge CLI
 
@@ -9,16 +10,126 @@ util functions for the automerge CLI
 
 *from_url*: get owner/repo from git url
 
+*socket_path*: get the path of the daemon's control socket
+
 *col_print*: pretty print list using columns
+
+*_schedule*: order PRs into waves of non-conflicting merges
+
+*_merge_wave*: merge a wave of non-conflicting PRs concurrently
+
+*_graphql*: run a GitHub GraphQL query using gh
+
+*_merge_queue*: check if a repo's default branch has a merge queue
+
+*_enqueue*: add PRs to a repo's merge queue in a single mutation
+
+*_queue_status*: get the entries currently in a repo's merge queue
+
+*_timeout*: get the deadline of a gh operation (from the environment)
+
+*_retryable*: check if a failed gh call is worth retrying
+
+*_lookup_repos*: check explicitly named repos exist in batched lookups
+
+*_fingerprints*: get what repos' PRs were classified from in batched lookups
+
+*from_pr_ref*: get owner/repo & PR num from a PR url or owner/repo#num
+
+*_lookup_prs*: look up known PRs in batched queries
+
+*_fetch_prs*: fetch all PRs of a given repo
+
+*Hedger*: hedge calls that run past a learned latency percentile
+
+*same_author*: check if a PR's author is the wanted one (bot prefix aside)
+
+*_repo_stats*: fetch & classify the PRs of a single repo
+
+*_aggregate*: add account totals to per-repo stats
+
+*_merge_repo*: merge a repo's stable PRs using the selected backend
+
+*_rate_limit*: get the remaining GitHub API rate limit
+
+*Lazy*: stand-in that imports (& builds) an object on first use
+
+*lazy_import*: import a module (or one of its attributes) on first use
 """
+import os
+import re
+import sys
 import json
 import time
+import signal
 import pathlib
+import importlib
+import threading
 import subprocess
-from typing import Optional, List
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, List, Callable
+
+from automerge.instrument import phase
+from automerge.selector import compile_selector
+
+
+class Lazy:
+    """
+    stand-in that imports (& builds) an object on first use, keeps heavy
+    dependencies out of CLI startup
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *load*: returns the real object
+
+    ***
+    """
+
+    def __init__(self, load: Callable):
+        self._load = load
+        self._target = None
+
+    def _resolve(self):
+        """load the real object (once)"""
+        if self._target is None:
+            self._target = self._load()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+
+def lazy_import(module: str, attr: Optional[str] = None):
+    """
+    import a module (or one of its attributes) on first use
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *module*: module to import
+
+    *attr*: attribute of the module to stand in for
+
+    ***
+    """
+    if attr is None:
+        return Lazy(lambda: importlib.import_module(module))
+    return Lazy(lambda: getattr(importlib.import_module(module), attr))
+
 
-import rich
-import tabulate
+rich = lazy_import("rich")
 
 
 def from_url(url: str):
@@ -37,6 +148,41 @@ def from_url(url: str):
     return f"{pathlib.Path(url).parent.name}/{pathlib.Path(url).name}"
 
 
+# a PR url (github.com or an enterprise host) or owner/repo#num
+PR_REF = re.compile(
+    r"(?:https?://[^/\s]+/)?(?P<repo>[\w.-]+/[\w.-]+)(?:/pull/|#)(?P<number>\d+)"
+    r"(?:[/?#]\S*)?"
+)
+
+
+def from_pr_ref(ref: str):
+    """get (owner/repo, PR num) from a PR url or `owner/repo#num`
+
+    raises `ValueError` if *ref* is neither
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *ref*: PR url or `owner/repo#num`
+
+    ***
+    """
+    match = PR_REF.fullmatch(ref.strip())
+    if match is None:
+        raise ValueError(f"invalid PR reference: {ref.strip()!r}")
+    return match["repo"], int(match["number"])
+
+
+def socket_path():
+    """get the path of the daemon's control socket (`AUTOMERGE_SOCKET`)"""
+    return os.environ.get(
+        "AUTOMERGE_SOCKET", str(pathlib.Path.home() / ".automerge" / "daemon.sock")
+    )
+
+
 def chunks(lst, num_chunks):
     """split list into n-sized chunks
 
@@ -58,9 +204,17 @@ def chunks(lst, num_chunks):
     return split
 
 
-def col_print(data, cols=2):
+# items `col_print` shows before truncating by default, override using
+# AUTOMERGE_DISPLAY_LIMIT (0 shows everything)
+DISPLAY_LIMIT = 200
+
+
+def col_print(data, cols=2, limit: Optional[int] = None, stream=None):
     """print list of items as columns
 
+    the column widths are computed in a single pass & rows are written as
+    they're laid out, past *limit* items the rest is only counted
+
     ***
 
     **parameters**
@@ -69,14 +223,131 @@ def col_print(data, cols=2):
 
     *data*: list to pretty print
 
+    *cols*: number of columns
+
+    *limit*: max. number of items to print (`AUTOMERGE_DISPLAY_LIMIT` or
+             `DISPLAY_LIMIT` by default)
+
+    *stream*: where to print (stdout by default)
+
     ***
     """
-    rich.print(tabulate.tabulate(chunks(data, cols)))
+    stream = stream or sys.stdout
+    if limit is None:
+        limit = _env_number("AUTOMERGE_DISPLAY_LIMIT", DISPLAY_LIMIT, int)
+    shown = len(data) if not limit else min(limit, len(data))
+    if shown == 0:
+        return
+    widths = [0] * cols
+    for index in range(shown):
+        widths[index % cols] = max(widths[index % cols], len(str(data[index])))
+    widths = [width for width in widths if width]
+    rule = "  ".join("-" * width for width in widths) + "\n"
+    stream.write(rule)
+    for start in range(0, shown, cols):
+        row = data[start : min(start + cols, shown)]
+        stream.write(
+            "  ".join(
+                str(item).ljust(width) for item, width in zip(row, widths)
+            ).rstrip()
+            + "\n"
+        )
+    stream.write(rule)
+    if shown < len(data):
+        stream.write(
+            f"... {len(data) - shown} more ({len(data)} total, "
+            "raise --limit / AUTOMERGE_DISPLAY_LIMIT to show them)\n"
+        )
+
+
+# repos a single `gh repo list` returns at most (gh pages through them 100
+# at a time), override using AUTOMERGE_REPO_LIMIT
+REPO_LIMIT = 100000
+
+
+# default per-operation deadlines (seconds) for gh calls, override using
+# AUTOMERGE_TIMEOUT_LIST / _PRS / _MERGE / _API (see `_timeout`)
+TIMEOUTS = {"list": 120.0, "prs": 60.0, "merge": 60.0, "api": 60.0}
+
+# invalid environment values already warned about
+_INVALID = set()
+
+
+def _env_number(name: str, default, cast: Callable = float):
+    """
+    read a number from the environment when it's needed (not at import, so
+    a malformed value can't break every command), invalid values fall back
+    to *default* with a warning on stderr
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *name*: environment variable
+
+    *default*: value if it's unset or invalid
+
+    *cast*: `float` or `int`
+
+    ***
+    """
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        if (name, value) not in _INVALID:
+            _INVALID.add((name, value))
+            sys.stderr.write(
+                f"automerge: ignoring invalid {name}={value!r}, using {default}\n"
+            )
+        return default
+
+
+def _timeout(operation: str):
+    """get the deadline (seconds) of a gh operation (`list`, `prs`, ...)"""
+    return _env_number(
+        f"AUTOMERGE_TIMEOUT_{operation.upper()}", TIMEOUTS[operation], float
+    )
+
+
+TIMED_OUT = b"automerge: timed out"
+
+# retries of a merge failing with a retryable error (see `_merge`)
+MAX_RETRY = 5
+
+# merges of a wave running at once (see `_merge_wave`)
+MERGE_WORKERS = 4
+
+# stderr fragments of failures that usually go away on their own
+RETRYABLE = (
+    TIMED_OUT,
+    b"not in the correct state to enable auto-merge",
+)
+
+
+# keys of `_stats` output that hold account totals rather than a repo
+TOTALS = (
+    "total_stable",
+    "total_unstable",
+    "stable_repos",
+    "unstable_repos",
+    "stable_prs",
+    "unstable_prs",
+    "neutral_repos",
+)
 
 
-def _execute(cmd):
+def _execute(cmd, timeout: Optional[float] = None):
     """execute shell command
 
+    the command runs in its own process group so that, if it is still
+    running after *timeout* seconds, it is killed together with anything
+    it spawned & stderr is set to `TIMED_OUT`
+
     ***
 
     **parameters**
@@ -84,34 +355,366 @@ def _execute(cmd):
     ***
 
     *cmd*: shell command to execute
+
+    *timeout*: seconds to wait for the command (None waits forever)
     """
-    with subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    with phase("gh") as current, subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True
     ) as cmd_process:
-        stdout, stderr = cmd_process.communicate()
+        try:
+            stdout, stderr = cmd_process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(cmd_process.pid, signal.SIGKILL)
+            except (AttributeError, ProcessLookupError, PermissionError):
+                cmd_process.kill()
+            stdout, _ = cmd_process.communicate()
+            stderr = TIMED_OUT + f" after {timeout}s: {' '.join(cmd)}".encode("utf-8")
+        current.nbytes = len(stdout or b"")
         return cmd_process, stdout, stderr
 
 
+def _retryable(stderr):
+    """check if a failed gh call is worth retrying
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *stderr*: stderr of the failed call
+
+    ***
+    """
+    if isinstance(stderr, str):
+        stderr = stderr.encode("utf-8")
+    return any(fragment in stderr for fragment in RETRYABLE)
+
+
 def _repos(frepos: Optional[List[str]] = None):
     """
-    get all repos in current account
+    get all repos in current account (matching a selector)
 
 
     workflow:
-        i) fetch GitHub repo urls using subprocess + gh
+        i) fetch GitHub repo urls using subprocess + gh (the owners / topics
+           / archived state the selector asks for are filtered server-side,
+           explicit names skip the listing, see `_lookup_repos`)
         ii) extract each url from result & store in a python list
         iii) get the owner/repo from each url (needed by `gh` for merging)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *frepos*: repo selector terms (see `automerge.selector`)
+
+    ***
     """
-    cmd = ["gh", "repo", "list", "--json", "url", "--limit", "1000"]
-    cmd_process, stdout, stderr = _execute(cmd)
+    selector = compile_selector(frepos)
+    if selector.exact:
+        # explicit repos: look them up instead of listing the account
+        return _lookup_repos(sorted(selector.exact))
+    repos, seen = [], set()
+    limit = _env_number("AUTOMERGE_REPO_LIMIT", REPO_LIMIT, int)
+    for args in selector.listings():
+        cmd = ["gh", "repo", "list", *args, "--json", selector.fields]
+        cmd += ["--limit", str(limit)]
+        with phase("list") as current:
+            cmd_process, stdout, stderr = _execute(cmd, timeout=_timeout("list"))
+            current.nbytes = len(stdout or b"")
+        if cmd_process.returncode != 0 or stderr:
+            return stderr
+        listing = json.loads(stdout.decode("utf-8"))
+        if len(listing) >= limit:
+            # stderr: stdout may carry `--output` records
+            sys.stderr.write(
+                f"automerge: listed the first {limit} repos only, "
+                "raise AUTOMERGE_REPO_LIMIT to handle the rest\n"
+            )
+        for listed in listing:
+            repo = from_url(listed["url"])
+            if repo in seen:
+                continue
+            seen.add(repo)
+            topics = [topic["name"] for topic in listed.get("repositoryTopics") or []]
+            if selector.match(repo, topics, listed.get("isArchived")):
+                repos.append(repo)
+    return repos
+
+
+def _lookup_repos(repos: List[str]):
+    """
+    check explicitly named repos exist using batched GraphQL lookups (100
+    repos per query), their merge queues are cached on the way (see
+    `_merge_queue`)
+
+    returns the repos (as GitHub spells them) or an error naming the repos
+    that don't exist
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repos*: GitHub repos (owner/repo)
+
+    ***
+    """
+    found, missing = [], []
+    for batch in chunks(repos, 100):
+        query = "query {\n"
+        for index, repo in enumerate(batch):
+            owner, name = repo.split("/", 1)
+            query += (
+                f"  r{index}: repository(owner: {json.dumps(owner)}, "
+                f"name: {json.dumps(name)}) "
+                "{ nameWithOwner mergeQueue { url } }\n"
+            )
+        query += "}"
+        with phase("lookup"):
+            data = _graphql(query)
+        if isinstance(data, (str, bytes)):
+            return data
+        for index, repo in enumerate(batch):
+            # repos that don't exist (or aren't visible) are null
+            node = data.get(f"r{index}")
+            if node:
+                found.append(node["nameWithOwner"])
+                _MERGE_QUEUES[node["nameWithOwner"]] = bool(node.get("mergeQueue"))
+            else:
+                missing.append(repo)
+    if missing:
+        # a typo fails the run instead of quietly merging nothing
+        return f"repo(s) not found: {', '.join(missing)}"
+    return found
+
+
+CHANGE_FIELDS = (
+    "pushedAt pullRequests(states: OPEN, first: 100) "
+    "{ totalCount nodes { number updatedAt mergeStateStatus } }"
+)
+
+
+def _fingerprints(repos: List[str]):
+    """
+    get what a repo's PRs were classified from (last push, open PRs, their
+    last update & merge state) using batched GraphQL lookups (100 repos per
+    query), a repo whose fingerprint didn't change doesn't need its PRs
+    fetched again
+
+    returns a fingerprint per repo (None if it doesn't exist) or stderr
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repos*: GitHub repos (owner/repo)
+
+    ***
+    """
+    fingerprints = {}
+    for batch in chunks(repos, 100):
+        query = "query {\n"
+        for index, repo in enumerate(batch):
+            owner, name = repo.split("/", 1)
+            query += (
+                f"  r{index}: repository(owner: {json.dumps(owner)}, "
+                f"name: {json.dumps(name)}) {{ {CHANGE_FIELDS} }}\n"
+            )
+        query += "}"
+        with phase("lookup"):
+            data = _graphql(query)
+        if isinstance(data, (str, bytes)):
+            return data
+        for index, repo in enumerate(batch):
+            node = data.get(f"r{index}")
+            fingerprints[repo] = node and json.dumps(node, sort_keys=True)
+    return fingerprints
+
+
+PR_FIELDS = (
+    "id number url state mergeable mergeStateStatus additions deletions "
+    "author { login } files(first: 100) { nodes { path } }"
+)
+
+
+def _lookup_prs(refs: List[tuple]):
+    """
+    look up known PRs using batched GraphQL queries (100 PRs per query),
+    the merge queues of their repos are cached on the way (see
+    `_merge_queue`)
+
+    returns a PR dict (None if it doesn't exist) per ref or stderr
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *refs*: (owner/repo, PR num) tuples (see `from_pr_ref`)
+
+    ***
+    """
+    prs = []
+    for batch in chunks(refs, 100):
+        query = "query {\n"
+        for index, (repo, number) in enumerate(batch):
+            owner, name = repo.split("/", 1)
+            query += (
+                f"  p{index}: repository(owner: {json.dumps(owner)}, "
+                f"name: {json.dumps(name)}) {{ mergeQueue {{ url }} "
+                f"pullRequest(number: {number}) {{ {PR_FIELDS} }} }}\n"
+            )
+        query += "}"
+        with phase("lookup"):
+            data = _graphql(query)
+        if isinstance(data, (str, bytes)):
+            return data
+        for index, (repo, _) in enumerate(batch):
+            node = data.get(f"p{index}") or {}
+            if node:
+                _MERGE_QUEUES[repo] = bool(node.get("mergeQueue"))
+            pr = node.get("pullRequest")
+            if pr:
+                files = (pr.get("files") or {}).get("nodes") or []
+                pr = dict(pr, files=[file["path"] for file in files])
+            prs.append(pr)
+    return prs
+
+
+def _fetch_prs(repo: str):
+    """fetch all PRs of a given repo using subprocess + gh
+
+    returns the decoded PR list or stderr
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo (owner/repo)
+
+    ***
+    """
+    cmd = [
+        "gh",
+        "pr",
+        "-R",
+        repo,
+        "list",
+        "--json",
+        "number,author,state,mergeable,mergeStateStatus,url,files,additions,deletions,id",
+    ]
+    with phase("prs", repo) as current:
+        cmd_process, stdout, stderr = _execute(cmd, timeout=_timeout("prs"))
+        current.nbytes = len(stdout or b"")
     if cmd_process.returncode != 0 or stderr:
         return stderr
-    gh_urls = json.loads(stdout.decode("ascii"))
-    urls = [gh_url["url"] for gh_url in gh_urls]
-    repos = [from_url(url) for url in urls]
-    if frepos:
-        repos = [repo for repo in repos if repo in frepos]
-    return repos
+    return json.loads(stdout.decode("ascii"))
+
+
+class Hedger:  # pylint: disable=too-many-instance-attributes
+    """
+    hedge slow calls: once a call runs past a learned latency percentile
+    a duplicate is launched & whichever finishes first wins
+
+    hedges are capped at *budget* (a fraction of all calls) so the extra
+    API cost stays bounded
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *percentile*: latency percentile after which a call is hedged
+
+    *budget*: max fraction of calls that can be hedged
+
+    *min_samples*: latencies to learn before hedging anything
+
+    *window*: number of recent latencies the percentile is computed over
+
+    ***
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        budget: float = 0.05,
+        min_samples: int = 20,
+        window: int = 500,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.calls, self.hedges = 0, 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=8)
+
+    def delay(self):
+        """seconds to wait before hedging (None until enough samples)"""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile))]
+
+    def __call__(self, func, *args):
+        """call func(*args), hedging it if it's slow"""
+        delay = self.delay()
+        with self.lock:
+            self.calls += 1
+        start = time.monotonic()
+        # run in a copy of the caller's context so phases nest under its own
+        futures = [self.executor.submit(contextvars.copy_context().run, func, *args)]
+        if delay is not None:
+            done, _ = wait(futures, timeout=delay)
+            with self.lock:
+                hedge = not done and self.hedges < self.budget * self.calls
+                if hedge:
+                    self.hedges += 1
+            if hedge:
+                futures.append(
+                    self.executor.submit(contextvars.copy_context().run, func, *args)
+                )
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        with self.lock:
+            self.latencies.append(time.monotonic() - start)
+        return done.pop().result()
+
+
+HEDGER = Hedger()
+
+
+def same_author(login: str, author: str):
+    """
+    check if a PR's author login is *author*, bot logins are `app/name` in
+    gh's JSON & `name` in GraphQL (or when typed), so the prefix is ignored
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *login*: login of the PR's author
+
+    *author*: wanted author (e.g. `dependabot` or `app/dependabot`)
+
+    ***
+    """
+    return login.split("/")[-1] == author.split("/")[-1]
 
 
 def _prs(
@@ -120,7 +723,8 @@ def _prs(
     mergeable: str = "MERGEABLE",
     state: str = "OPEN",
     stability: str = "CLEAN",
-):
+    gh_prs: Optional[List[dict]] = None,
+):  # pylint: disable=too-many-arguments
     """get prs for a given repo
 
     workflow:
@@ -141,26 +745,19 @@ def _prs(
 
     *stability*: roudabout way of checking if builds are stable
 
+    *gh_prs*: already fetched PRs (skips fetching them again)
+
     ***
     """
-    cmd = [
-        "gh",
-        "pr",
-        "-R",
-        repo,
-        "list",
-        "--json",
-        "number,author,state,mergeable,mergeStateStatus,url",
-    ]
-    cmd_process, stdout, stderr = _execute(cmd)
-    if cmd_process.returncode != 0 or stderr:
-        return stderr
+    if gh_prs is None:
+        gh_prs = _fetch_prs(repo)
+        if isinstance(gh_prs, (str, bytes)):
+            return gh_prs
 
-    gh_prs = json.loads(stdout.decode("ascii"))
     prs = [
         pr
         for pr in gh_prs
-        if pr["author"]["login"] == author
+        if same_author(pr["author"]["login"], author)
         and pr["mergeable"] == mergeable
         and pr["state"] == state
         and pr["mergeStateStatus"] == stability
@@ -168,9 +765,9 @@ def _prs(
     return prs
 
 
-def _stats(frepos: Optional[List[str]] = None, author: str = "app/dependabot"):
+def _repo_stats(repo: str, author: str = "app/dependabot", hedge: bool = False):
     """
-    fetch stats for the current GitHub account
+    fetch & classify the PRs of a single repo
 
     ***
 
@@ -178,48 +775,72 @@ def _stats(frepos: Optional[List[str]] = None, author: str = "app/dependabot"):
 
     ***
 
-    *repos*: list of repos to get data for
+    *repo*: GitHub repo (owner/repo)
+
+    *author*: author of PRs
+
+    *hedge*: hedge a slow PR fetch (see `Hedger`)
 
     ***
     """
-    data = {}
-    repos = _repos()
+    repo_stats = {}
+    # fetch once per repo, stable & unstable PRs are filtered locally
+    gh_prs = HEDGER(_fetch_prs, repo) if hedge else _fetch_prs(repo)
+    if isinstance(gh_prs, (str, bytes)):
+        # a failed / timed out fetch skips the repo for this cycle only
+        repo_stats["error"] = (
+            gh_prs.decode("utf-8", "replace") if isinstance(gh_prs, bytes) else gh_prs
+        )
+        gh_prs = []
+    with phase("classify", repo):
+        stable, unstable = (
+            _prs(repo, author=author, gh_prs=gh_prs),
+            _prs(repo, author=author, stability="UNSTABLE", gh_prs=gh_prs),
+        )
+    stable_prs = [
+        {
+            "url": pr["url"],
+            "number": pr["number"],
+            "author": pr["author"],
+            "id": pr.get("id"),
+            "files": [file["path"] for file in pr.get("files") or []],
+            "additions": pr.get("additions", 0),
+            "deletions": pr.get("deletions", 0),
+        }
+        for pr in stable
+    ]
+    unstable_prs = [
+        {"url": pr["url"], "number": pr["number"], "author": pr["author"]}
+        for pr in unstable
+    ]
+    repo_stats["stable_prs"] = stable_prs
+    repo_stats["unstable_prs"] = unstable_prs
+    repo_stats["num_stable"] = len(stable_prs)
+    repo_stats["num_unstable"] = len(unstable_prs)
+    return repo_stats
 
-    if isinstance(repos, (str, bytes)):
-        return repos
 
-    if frepos:
-        repos = [repo for repo in repos if repo in frepos]
-    (
-        total_stable,
-        total_unstable,
-        total_unstable_prs,
-        total_stable_prs,
-    ) = (0, 0, [], [])
-    for repo in repos:
-        repo_stats = {}
-        stable_prs = [
-            {"url": pr["url"], "number": pr["number"], "author": pr["author"]}
-            for pr in _prs(repo, author=author)
-        ]
-        unstable_prs = [
-            {"url": pr["url"], "number": pr["number"], "author": pr["author"]}
-            for pr in _prs(repo, author=author, stability="UNSTABLE")
-        ]
-        total_unstable_prs.extend(unstable_prs)
-        total_stable_prs.extend(stable_prs)
+def _aggregate(data: dict):
+    """
+    add account totals to per-repo stats
 
-        total_stable, total_unstable = (
-            total_stable + len(stable_prs),
-            total_unstable + len(unstable_prs),
-        )
-        repo_stats["stable_prs"] = stable_prs
-        repo_stats["unstable_prs"] = unstable_prs
-        repo_stats["num_stable"] = len(stable_prs)
-        repo_stats["num_unstable"] = len(unstable_prs)
+    ***
+
+    **parameters**
+
+    ***
 
-        data[repo] = repo_stats
+    *data*: mapping of repo -> repo stats (see `_repo_stats`)
 
+    ***
+    """
+    data = {repo: data[repo] for repo in _reponames(data)}
+    total_stable_prs = [
+        pr for repo_stats in data.values() for pr in repo_stats["stable_prs"]
+    ]
+    total_unstable_prs = [
+        pr for repo_stats in data.values() for pr in repo_stats["unstable_prs"]
+    ]
     stable_repos = [
         repo
         for repo, repo_stats in data.items()
@@ -233,8 +854,8 @@ def _stats(frepos: Optional[List[str]] = None, author: str = "app/dependabot"):
         for repo, repo_stats in data.items()
         if (repo_stats["num_stable"] == 0 and repo_stats["num_unstable"] == 0)
     ]
-    data["total_stable"] = total_stable
-    data["total_unstable"] = total_unstable
+    data["total_stable"] = len(total_stable_prs)
+    data["total_unstable"] = len(total_unstable_prs)
     data["stable_repos"] = stable_repos
     data["unstable_repos"] = unstable_repos
     data["neutral_repos"] = neutral_repos
@@ -243,8 +864,9 @@ def _stats(frepos: Optional[List[str]] = None, author: str = "app/dependabot"):
     return data
 
 
-def _display(stats, verbose=True):  # pylint: disable=too-many-branches
-    """display general stats in terminal about GitHub PRs
+def _reponames(stats: dict):
+    """
+    get the repo names in stats (i.e. skip the account totals)
 
     ***
 
@@ -256,64 +878,123 @@ def _display(stats, verbose=True):  # pylint: disable=too-many-branches
 
     ***
     """
-    reponames = [
-        key
-        for key in list(stats.keys())
-        if key
-        not in [
-            "total_stable",
-            "total_unstable",
-            "stable_repos",
-            "unstable_repos",
-            "stable_prs",
-            "unstable_prs",
-            "neutral_repos",
-        ]
-    ]
-    rich.print(f"[bold green on yellow]TOTAL: {len(reponames)} repo(s)")
-    if verbose:
-        col_print(reponames)
-    rich.print(f'[bold black on yellow]NEUTRAL: {len(stats["neutral_repos"])} repo(s)')
-    if verbose:
-        col_print(stats["neutral_repos"])
-    rich.print()
-    if stats["total_stable"] == 0:
-        rich.print(
-            f"[bold red on yellow]UNSTABLE REPO(s): {len(stats['unstable_repos'])}"  # pylint: disable=line-too-long
-        )
-        if verbose:
-            if stats["unstable_repos"]:
-                col_print(stats["unstable_repos"])
-        rich.print(f"[bold red on yellow]UNSTABLE PR(s): {len(stats['unstable_prs'])}")
-        if verbose:
-            if stats["unstable_prs"]:
-                col_print([pr["url"] for pr in stats["unstable_prs"]])
-        rich.print()
-        rich.print("[bold magenta on yellow]OUTCOME: no PRs found for automerging!\n")
+    return [key for key in stats if key not in TOTALS]
+
+
+def _stats(
+    frepos: Optional[List[str]] = None,
+    author: str = "app/dependabot",
+    hedge: bool = False,
+    inventory: Optional[List[str]] = None,
+    select: Optional[Callable[[str], bool]] = None,
+    on_repo: Optional[Callable[[str, dict], None]] = None,
+):  # pylint: disable=too-many-arguments
+    """
+    fetch stats for the current GitHub account
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *frepos*: repo selector terms (see `automerge.selector`)
+
+    *hedge*: hedge slow PR fetches (see `Hedger`)
+
+    *inventory*: already listed repos (skips listing them again)
+
+    *select*: only fetch repos matching this predicate (e.g. `Shard.owns`)
+
+    *on_repo*: called with (repo, repo stats) as soon as a repo is classified
+
+    ***
+    """
+    with phase("stats"):
+        selector = compile_selector(frepos)
+        if inventory is None:
+            repos = _repos(frepos)
+        elif selector.attributes:
+            # topics / archived can't be told from the names, list them
+            repos = _repos(frepos)
+            if not isinstance(repos, (str, bytes)):
+                listed = set(repos)
+                repos = [repo for repo in inventory if repo in listed]
+        else:
+            repos = [repo for repo in inventory if selector.match(repo)]
+
+        if isinstance(repos, (str, bytes)):
+            return repos
+
+        if select is not None:
+            repos = [repo for repo in repos if select(repo)]
+        data = {}
+        for repo in repos:
+            data[repo] = _repo_stats(repo, author=author, hedge=hedge)
+            if on_repo is not None:
+                on_repo(repo, data[repo])
+        return _aggregate(data)
+
+
+def _heading(text: str, style: str):
+    """print a `_display` heading (styled using rich only on a terminal)"""
+    if sys.stdout.isatty():
+        rich.print(f"[{style}]{text}")
     else:
-        rich.print(
-            f"[bold green on yellow]STABLE REPO(s): {len(stats['stable_repos'])}"
+        sys.stdout.write(f"{text}\n")
+
+
+def _display(stats, verbose=True, limit: Optional[int] = None):
+    """display general stats in terminal about GitHub PRs
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *stats*: automerge stats
+
+    *verbose*: list the repos & PRs of every group
+
+    *limit*: max. number of repos / PRs listed per group (see `col_print`)
+
+    ***
+    """
+
+    def group(heading, style, items, urls=False):
+        _heading(heading.format(len(items)), style)
+        if verbose and items:
+            col_print([pr["url"] for pr in items] if urls else items, limit=limit)
+
+    reponames = _reponames(stats)
+    group("TOTAL: {} repo(s)", "bold green on yellow", reponames)
+    group("NEUTRAL: {} repo(s)", "bold black on yellow", stats["neutral_repos"])
+    sys.stdout.write("\n")
+    if stats["total_stable"] > 0:
+        group("STABLE REPO(s): {}", "bold green on yellow", stats["stable_repos"])
+        group(
+            "STABLE PR(s): {}", "bold green on yellow", stats["stable_prs"], urls=True
         )
-        if verbose:
-            col_print(stats["stable_repos"])
-        rich.print(f"[bold green on yellow]STABLE PR(s): {len(stats['stable_prs'])}")
-        if verbose:
-            if stats["stable_prs"]:
-                col_print([pr["url"] for pr in stats["stable_prs"]])
-        rich.print(
-            f"[bold red on yellow]UNSTABLE REPO(s): {len(stats['unstable_repos'])}"  # pylint: disable=line-too-long
+    group("UNSTABLE REPO(s): {}", "bold red on yellow", stats["unstable_repos"])
+    group("UNSTABLE PR(s): {}", "bold red on yellow", stats["unstable_prs"], urls=True)
+    # repos whose PR fetch failed are skipped this cycle, always say why
+    failed = [repo for repo in reponames if stats[repo].get("error")]
+    if failed:
+        _heading(f"FAILED REPO(s): {len(failed)}", "bold red on yellow")
+        col_print(
+            [f"{repo}: {stats[repo]['error'].strip()}" for repo in failed],
+            cols=1,
+            limit=limit,
         )
-        if verbose:
-            col_print(stats["unstable_repos"])
-        rich.print(f"[bold red on yellow]UNSTABLE PR(s): {len(stats['unstable_prs'])}")
-        if verbose:
-            if stats["unstable_prs"]:
-                col_print([pr["url"] for pr in stats["unstable_prs"]])
-        rich.print()
-        rich.print("[bold green on yellow]OUTCOME: PRs found for automerging!\n")
+    sys.stdout.write("\n")
+    if stats["total_stable"] == 0:
+        _heading("OUTCOME: no PRs found for automerging!\n", "bold magenta on yellow")
+    else:
+        _heading("OUTCOME: PRs found for automerging!\n", "bold green on yellow")
 
 
-def _merge(repo: str, pr_num: int, retries: int = 0, max_retry: int = 5):
+def _merge(repo: str, pr_num: int, retries: int = 0, max_retry: int = MAX_RETRY):
     """
     merge a GitHub PR using repo name + PR num
 
@@ -332,30 +1013,302 @@ def _merge(repo: str, pr_num: int, retries: int = 0, max_retry: int = 5):
     ***
     """
     if retries > max_retry:
-        rich.print(f"Couldn't merge {pr_num} tried {max_retry} times :(")
+        # stderr: stdout may carry `--output` records
+        rich.print(
+            f"Couldn't merge {pr_num} tried {max_retry} times :(", file=sys.stderr
+        )
         return None
-    try:
-        cmd = [
-            "gh",
-            "pr",
-            "-R",
-            str(repo),
-            "merge",
-            str(pr_num),
-            "--auto",
-            "--delete-branch",
-            "--merge",
+    cmd = [
+        "gh",
+        "pr",
+        "-R",
+        str(repo),
+        "merge",
+        str(pr_num),
+        "--auto",
+        "--delete-branch",
+        "--merge",
+    ]
+    with phase("merge", repo):
+        cmd_process, _, stderr = _execute(cmd, timeout=_timeout("merge"))
+    if _retryable(stderr):
+        with phase("retry_sleep", repo):
+            time.sleep(30)
+        return _merge(repo, pr_num, retries + 1, max_retry)
+    if cmd_process.returncode != 0 or stderr:
+        return stderr
+    return True
+
+
+def _schedule(prs: List[dict]):
+    """
+    order PRs into waves of non-conflicting merges
+
+    PRs are visited smallest diff first; each wave greedily takes every
+    PR whose changed files don't overlap with the PRs already in it, so
+    PRs touching disjoint files land in the first wave & PRs sharing a
+    file (usually a lockfile) are serialized across later waves
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *prs*: stable PRs (as returned by `_stats`) for a single repo
+
+    ***
+    """
+    pending = sorted(
+        prs, key=lambda pr: (pr.get("additions", 0) + pr.get("deletions", 0))
+    )
+    waves = []
+    while pending:
+        wave, touched, conflicting = [], set(), []
+        for pr in pending:
+            # a PR without a file list can't be checked, so it's merged alone
+            files = set(pr.get("files") or []) or {None}
+            if touched and (None in touched or None in files or files & touched):
+                conflicting.append(pr)
+                continue
+            wave.append(pr)
+            touched |= files
+        waves.append(wave)
+        pending = conflicting
+    return waves
+
+
+def _merge_wave(repo: str, prs: List[dict], max_workers: int = MERGE_WORKERS):
+    """
+    merge a wave of non-conflicting PRs concurrently
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo the PRs belong to
+
+    *prs*: PRs in the wave (see `_schedule`)
+
+    *max_workers*: max number of merges running at once
+
+    ***
+    """
+    pr_nums = [pr["number"] for pr in prs]
+    if len(pr_nums) <= 1:
+        return [(pr_num, _merge(repo, pr_num)) for pr_num in pr_nums]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # each merge runs in a copy of this context (see `automerge.instrument`)
+        futures = [
+            executor.submit(contextvars.copy_context().run, _merge, repo, pr_num)
+            for pr_num in pr_nums
         ]
-        cmd_process, _, stderr = _execute(cmd)
-        if cmd_process.returncode != 0 or stderr:
-            return stderr
+        return [(pr_num, future.result()) for pr_num, future in zip(pr_nums, futures)]
 
-        if "not in the correct state to enable auto-merge" in stderr.decode("ascii"):
-            time.sleep(30)
-            _merge(repo, pr_num, retries + 1)
-        if not stderr:
-            return True
-    except subprocess.CalledProcessError:
-        time.sleep(30)
-        _merge(repo, pr_num, retries + 1)
-    return None
+
+def _graphql(query: str, **variables):
+    """
+    run a GitHub GraphQL query using gh
+
+    returns the `data` of the response or stderr if the query failed
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *query*: GraphQL query / mutation
+
+    *variables*: GraphQL variables (strings only)
+
+    ***
+    """
+    cmd = ["gh", "api", "graphql", "-f", f"query={query}"]
+    for name, value in variables.items():
+        cmd.extend(["-f", f"{name}={value}"])
+    with phase("graphql"):
+        cmd_process, stdout, stderr = _execute(cmd, timeout=_timeout("api"))
+    try:
+        # partial failures exit non-zero but still carry data
+        data = json.loads(stdout.decode("utf-8")).get("data")
+    except ValueError:
+        data = None
+    if data is None:
+        return stderr if cmd_process.returncode != 0 or stderr else b"no data"
+    return data
+
+
+_MERGE_QUEUES = {}
+
+MERGE_QUEUE_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    mergeQueue { url }
+  }
+}
+"""
+
+QUEUE_STATUS_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    mergeQueue {
+      entries(first: 100) {
+        nodes { position state pullRequest { number } }
+      }
+    }
+  }
+}
+"""
+
+
+def _merge_queue(repo: str):
+    """
+    check if a repo's default branch has a merge queue (cached per repo)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo (owner/repo)
+
+    ***
+    """
+    if repo not in _MERGE_QUEUES:
+        owner, name = repo.split("/", 1)
+        data = _graphql(MERGE_QUEUE_QUERY, owner=owner, name=name)
+        if isinstance(data, (str, bytes)):
+            # don't cache failures, fall back to merging directly this time
+            return False
+        _MERGE_QUEUES[repo] = bool((data.get("repository") or {}).get("mergeQueue"))
+    return _MERGE_QUEUES[repo]
+
+
+def _enqueue(prs: List[dict]):
+    """
+    add PRs to a repo's merge queue in a single mutation
+
+    returns a list of (PR num, enqueued) tuples
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *prs*: stable PRs (as returned by `_stats`), they need an `id`
+
+    ***
+    """
+    prs = [pr for pr in prs if pr.get("id")]
+    if not prs:
+        return []
+    mutation = "mutation {\n"
+    for pr in prs:
+        mutation += (
+            f'  pr{pr["number"]}: enqueuePullRequest('
+            f'input: {{pullRequestId: "{pr["id"]}"}}) '
+            "{ mergeQueueEntry { position } }\n"
+        )
+    mutation += "}"
+    data = _graphql(mutation)
+    if isinstance(data, (str, bytes)):
+        return [(pr["number"], False) for pr in prs]
+    return [(pr["number"], bool(data.get(f'pr{pr["number"]}'))) for pr in prs]
+
+
+def _queue_status(repo: str):
+    """
+    get the entries currently in a repo's merge queue
+
+    returns a list of {number, position, state} dicts or stderr
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo (owner/repo)
+
+    ***
+    """
+    owner, name = repo.split("/", 1)
+    data = _graphql(QUEUE_STATUS_QUERY, owner=owner, name=name)
+    if isinstance(data, (str, bytes)):
+        return data
+    merge_queue = (data.get("repository") or {}).get("mergeQueue") or {}
+    return [
+        {
+            "number": entry["pullRequest"]["number"],
+            "position": entry["position"],
+            "state": entry["state"],
+        }
+        for entry in (merge_queue.get("entries") or {}).get("nodes") or []
+    ]
+
+
+def _merge_repo(
+    repo: str, prs: List[dict], backend: str = "auto", enqueued: Optional[set] = None
+):
+    """
+    merge a repo's stable PRs using the selected backend
+
+    returns a list of (PR num, outcome) tuples where outcome is one of
+    `merged`, `enqueued` or `failed`
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *repo*: GitHub repo (owner/repo)
+
+    *prs*: stable PRs (as returned by `_stats`)
+
+    *backend*: `direct` (see `_schedule`), `queue` (see `_enqueue`) or
+               `auto` (queue if the repo has a merge queue)
+
+    *enqueued*: (repo, PR num) already in a merge queue, updated in place
+
+    ***
+    """
+    if backend == "queue" or (backend == "auto" and _merge_queue(repo)):
+        # let GitHub batch CI across the PRs, only track the queue
+        enqueued = set() if enqueued is None else enqueued
+        fresh = [pr for pr in prs if (repo, pr["number"]) not in enqueued]
+        results = []
+        for pr_num, queued in _enqueue(fresh):
+            if queued:
+                enqueued.add((repo, pr_num))
+            results.append((pr_num, "enqueued" if queued else "failed"))
+        return results
+    # merge PRs touching disjoint files first, serialize the rest
+    return [
+        (pr_num, "merged" if merged is True else "failed")
+        for wave in _schedule(prs)
+        for pr_num, merged in _merge_wave(repo, wave)
+    ]
+
+
+def _rate_limit():
+    """
+    get the remaining GitHub API rate limit
+
+    returns {resource: {limit, remaining, reset}} or stderr
+    """
+    cmd = ["gh", "api", "rate_limit"]
+    cmd_process, stdout, stderr = _execute(cmd, timeout=_timeout("api"))
+    if cmd_process.returncode != 0 or stderr:
+        return stderr
+    resources = json.loads(stdout.decode("utf-8")).get("resources", {})
+    return {
+        resource: {key: limits.get(key) for key in ("limit", "remaining", "reset")}
+        for resource, limits in resources.items()
+        if resource in ("core", "graphql", "search")
+    }
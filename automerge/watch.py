@@ -0,0 +1,255 @@
+"""
+live dashboard for `automerge info --watch`
+
+the dashboard keeps one row per repo & redraws it (using `rich.live`) as
+soon as the repo's PRs are fetched & classified instead of waiting for the
+whole scan. it's refreshed every *interval* seconds: the repo inventory is
+reused between refreshes (only re-listed every *relist* refreshes) & one
+batched lookup (see `_fingerprints`) tells which repos had a push or a PR
+opened, closed, updated or change merge state, only those have their PRs
+fetched again. the rows that changed since the previous refresh are
+highlighted
+
+***
+
+**classes**
+
+***
+
+*Dashboard*: per-repo rows of the live view & what changed in them
+
+***
+
+**functions**
+
+***
+
+*watch*: keep a live dashboard of the account's PRs
+
+***
+"""
+import time
+import threading
+from typing import Optional, List
+
+from automerge.utils import lazy_import, _repos, _stats, _fingerprints
+
+Table = lazy_import("rich.table", "Table")  # pylint: disable=invalid-name
+Live = lazy_import("rich.live", "Live")  # pylint: disable=invalid-name
+
+
+def _numbers(repo_stats: dict, status: str):
+    """PR numbers of a repo with a given status (stable / unstable)"""
+    return {pr["number"] for pr in repo_stats[f"{status}_prs"]}
+
+
+def _changes(old: Optional[dict], new: dict):
+    """
+    describe what changed in a repo between two refreshes ("" if nothing)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *old*: repo stats of the previous refresh (None if it's a new repo)
+
+    *new*: repo stats of this refresh
+
+    ***
+    """
+    if old is None:
+        return "new"
+    changes = []
+    for status in ("stable", "unstable"):
+        added = _numbers(new, status) - _numbers(old, status)
+        removed = _numbers(old, status) - _numbers(new, status)
+        if added:
+            changes.append(f"+{len(added)} {status}")
+        if removed:
+            changes.append(f"-{len(removed)} {status}")
+    if "error" in new and "error" not in old:
+        changes.append("error")
+    elif "error" in old and "error" not in new:
+        changes.append("recovered")
+    return ", ".join(changes)
+
+
+def _changed(inventory: List[str], fingerprints: dict, rows: dict):
+    """
+    get the repos whose PRs need fetching again: new repos, repos whose
+    fetch failed & repos whose fingerprint changed (see `_fingerprints`),
+    *fingerprints* is updated in place
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *inventory*: repos on the dashboard
+
+    *fingerprints*: fingerprint of every repo as of its last fetch
+
+    *rows*: repo stats of the previous refresh
+
+    ***
+    """
+    if not inventory:
+        return []
+    current = _fingerprints(inventory)
+    if isinstance(current, (str, bytes)):
+        # can't tell what changed, fetch everything
+        fingerprints.clear()
+        return list(inventory)
+    changed = [
+        repo
+        for repo in inventory
+        if repo not in rows
+        or "error" in rows[repo]
+        or current[repo] is None
+        or current[repo] != fingerprints.get(repo)
+    ]
+    fingerprints.clear()
+    fingerprints.update(current)
+    return changed
+
+
+class Dashboard:
+    """
+    per-repo rows of the live view & what changed in them since the
+    previous refresh (renders as a `rich` table)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *interval*: seconds between refreshes (shown in the caption)
+
+    ***
+    """
+
+    def __init__(self, interval: float = 60.0):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.changed = {}
+        self.pending = set()
+        self.refreshes = 0
+        self.error = None
+
+    def begin(self, repos: List[str], fetched: Optional[List[str]] = None):
+        """
+        start a refresh of *repos* (repos that are gone are dropped), only
+        the *fetched* ones (all by default) are waited for
+        """
+        with self.lock:
+            self.rows = {repo: self.rows[repo] for repo in repos if repo in self.rows}
+            self.changed = {}
+            self.pending = set(repos if fetched is None else fetched)
+            self.refreshes += 1
+
+    def update(self, repo: str, repo_stats: dict):
+        """update the row of a classified repo (a `_stats` `on_repo`)"""
+        with self.lock:
+            change = _changes(self.rows.get(repo), repo_stats)
+            if change and self.refreshes > 1:
+                self.changed[repo] = change
+            self.rows[repo] = repo_stats
+            self.pending.discard(repo)
+
+    def __rich__(self):
+        with self.lock:
+            repos = sorted(self.rows.keys() | self.pending)
+            table = Table(
+                title=f"automerge: refresh {self.refreshes}, "
+                f"{len(repos) - len(self.pending)}/{len(repos)} repo(s) fetched",
+                caption=self.error or f"refreshing every {self.interval:g}s",
+            )
+            table.add_column("repo")
+            table.add_column("stable", justify="right")
+            table.add_column("unstable", justify="right")
+            table.add_column("changed")
+            for repo in repos:
+                repo_stats = self.rows.get(repo)
+                if repo_stats is None:
+                    table.add_row(repo, "…", "…", "", style="dim")
+                    continue
+                style = "bold yellow" if repo in self.changed else None
+                if "error" in repo_stats:
+                    style = "red"
+                elif repo in self.pending:
+                    style = "dim"
+                table.add_row(
+                    repo,
+                    str(repo_stats["num_stable"]),
+                    str(repo_stats["num_unstable"]),
+                    self.changed.get(repo, ""),
+                    style=style,
+                )
+            return table
+
+
+def watch(
+    frepos: Optional[List[str]] = None,
+    author: str = "app/dependabot",
+    hedge: bool = False,
+    interval: float = 60.0,
+    relist: int = 10,
+    refreshes: Optional[int] = None,
+    console=None,
+):  # pylint: disable=too-many-arguments
+    """
+    keep a live dashboard of the account's PRs (until interrupted), returns
+    the dashboard
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *frepos*: list of repos to watch (all repos by default)
+
+    *author*: author of PRs
+
+    *hedge*: hedge slow PR fetches (see `Hedger`)
+
+    *interval*: seconds between refreshes
+
+    *relist*: re-list the account's repos every *relist* refreshes
+
+    *refreshes*: stop after this many refreshes
+
+    *console*: `rich` console to render to
+
+    ***
+    """
+    dashboard = Dashboard(interval)
+    inventory, fingerprints = None, {}
+    with Live(dashboard, console=console, refresh_per_second=4):
+        try:
+            while refreshes is None or dashboard.refreshes < refreshes:
+                if inventory is None or dashboard.refreshes % relist == 0:
+                    listed = _repos(frepos)
+                    if isinstance(listed, (str, bytes)):
+                        dashboard.error = f"error: {listed}"
+                    else:
+                        dashboard.error, inventory = None, listed
+                fetched = _changed(inventory or [], fingerprints, dashboard.rows)
+                dashboard.begin(inventory or [], fetched)
+                if fetched:
+                    _stats(
+                        author=author,
+                        hedge=hedge,
+                        inventory=fetched,
+                        on_repo=dashboard.update,
+                    )
+                if refreshes is None or dashboard.refreshes < refreshes:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+    return dashboard
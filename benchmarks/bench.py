@@ -0,0 +1,241 @@
+"""
+automerge benchmarks
+
+times the scan (`_repos`, `_stats`), render (`_display`, `col_print`) &
+merge paths against a simulated account (see `automerge.sim`) at several
+scales & fails when a metric regresses past its threshold in
+`baseline.json`
+
+every benchmark runs in a fresh process so peak RSS isn't inflated by the
+ones before it. `gh` calls are answered in-process (`automerge.sim.in_process`)
+so the numbers measure automerge rather than interpreter startup, they are
+still counted as subprocesses
+
+***
+
+**metrics**
+
+***
+
+*wall*: seconds spent in the benchmarked call
+
+*api_calls*: API calls made (as counted by the simulated rate limit)
+
+*subprocesses*: `gh` invocations
+
+*peak_rss_kb*: peak RSS of the benchmark process (KiB)
+
+***
+
+**usage**
+
+***
+
+`make bench` (or `python benchmarks/bench.py --scale 10 --scale 1000`)
+
+`make bench-baseline` records the current numbers as the new baseline
+
+***
+"""
+import os
+import sys
+import json
+import time
+import pathlib
+import resource
+import subprocess
+
+import click
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# pylint: disable=wrong-import-position
+from automerge.sim import MemorySimulator, generate, in_process
+from automerge.utils import (
+    _repos,
+    _stats,
+    _display,
+    _reponames,
+    _merge_repo,
+    col_print,
+)
+
+BASELINE = pathlib.Path(__file__).with_name("baseline.json")
+
+# relative slack & absolute slack (noise floor) per metric
+THRESHOLDS = {
+    "wall": [0.5, 0.05],
+    "api_calls": [0.0, 0],
+    "subprocesses": [0.0, 0],
+    "peak_rss_kb": [0.25, 8192],
+}
+
+
+def _account(scale):
+    """the simulated account of a scale (same seed, same account)"""
+    # enough rate limit for the setup & the benchmarked call of any scale
+    rate_limit = max(5000, scale * 10)
+    return MemorySimulator(
+        generate(repos=scale, prs_per_repo=3, rate_limit=rate_limit, seed=scale)
+    )
+
+
+def _snapshot(simulator):
+    """stats of every repo of the account"""
+    # load the (lazily imported) renderers outside the timed call
+    _quiet(lambda: col_print(["warm-up"]))
+    inventory = list(simulator.state()["repos"])
+    return _stats(author="app/dependabot", inventory=inventory)
+
+
+def _merge_cycle(stats):
+    """one merge cycle of the `merge` command"""
+    return [
+        result
+        for repo in _reponames(stats)
+        if stats[repo]["stable_prs"]
+        for result in _merge_repo(repo, stats[repo]["stable_prs"], "direct")
+    ]
+
+
+def _quiet(func):
+    """run *func* with stdout going to /dev/null (render benchmarks)"""
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            return func()
+        finally:
+            sys.stdout = stdout
+
+
+# name -> (setup(simulator) -> args, benchmarked call)
+BENCHMARKS = {
+    "repos": (lambda simulator: (), _repos),
+    "stats": (lambda simulator: (), lambda: _stats(author="app/dependabot")),
+    "display": (
+        lambda simulator: (_snapshot(simulator),),
+        lambda stats: _quiet(lambda: _display(stats, verbose=True)),
+    ),
+    "col_print": (
+        lambda simulator: (_reponames(_snapshot(simulator)),),
+        lambda names: _quiet(lambda: col_print(names)),
+    ),
+    "merge": (lambda simulator: (_snapshot(simulator),), _merge_cycle),
+}
+
+
+def measure(name, scale):
+    """
+    run one benchmark at one scale (in this process)
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *name*: benchmark name (see `BENCHMARKS`)
+
+    *scale*: number of repos in the simulated account
+
+    ***
+    """
+    setup, call = BENCHMARKS[name]
+    simulator = _account(scale)
+    with in_process(simulator):
+        args = setup(simulator)
+        before = simulator.counters()
+        start = time.perf_counter()
+        call(*args)
+        wall = time.perf_counter() - start
+        after = simulator.counters()
+    return {
+        "wall": round(wall, 4),
+        "api_calls": after["api_calls"] - before["api_calls"],
+        "subprocesses": after["subprocesses"] - before["subprocesses"],
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def regressions(results, baseline, thresholds):
+    """
+    compare results to a baseline
+
+    returns a list of (key, metric, baseline, result) past their threshold
+
+    ***
+
+    **parameters**
+
+    ***
+
+    *results*: mapping of `name@scale` -> metrics
+
+    *baseline*: mapping of `name@scale` -> metrics
+
+    *thresholds*: mapping of metric -> [relative, absolute] slack
+
+    ***
+    """
+    found = []
+    for key, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(key, {}).get(metric)
+            if base is None:
+                continue
+            relative, absolute = thresholds.get(metric, [0.0, 0])
+            if value > base * (1 + relative) and value - base > absolute:
+                found.append((key, metric, base, value))
+    return found
+
+
+@click.group(invoke_without_command=True)
+@click.option("--scale", "-s", "scales", type=int, multiple=True)
+@click.option("--only", "-o", multiple=True, help="benchmarks to run (default: all)")
+@click.option("--update", is_flag=True, help="record the results as the baseline.")
+@click.pass_context
+def cli(ctx, scales, only, update):
+    """run the benchmarks & check them against the baseline"""
+    if ctx.invoked_subcommand is not None:
+        return
+    baseline = json.loads(BASELINE.read_text("utf-8")) if BASELINE.exists() else {}
+    results = {}
+    for scale in scales or (10, 1000, 10000):
+        for name in only or BENCHMARKS:
+            measured = subprocess.run(
+                [sys.executable, __file__, "run", name, str(scale)],
+                capture_output=True,
+                check=True,
+            )
+            results[f"{name}@{scale}"] = json.loads(measured.stdout)
+            click.echo(f"{name}@{scale}: {json.dumps(results[f'{name}@{scale}'])}")
+    if update:
+        baseline = {
+            "thresholds": baseline.get("thresholds", THRESHOLDS),
+            "results": {**baseline.get("results", {}), **results},
+        }
+        BASELINE.write_text(json.dumps(baseline, indent=2) + "\n", "utf-8")
+        click.echo(f"baseline written to {BASELINE}")
+        return
+    found = regressions(
+        results,
+        baseline.get("results", {}),
+        baseline.get("thresholds", THRESHOLDS),
+    )
+    for key, metric, base, value in found:
+        click.echo(f"regression: {key} {metric} {base} -> {value}", err=True)
+    if found:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("name", type=click.Choice(list(BENCHMARKS)))
+@click.argument("scale", type=int)
+def run(name, scale):
+    """run one benchmark & print its metrics as JSON"""
+    click.echo(json.dumps(measure(name, scale)))
+
+
+if __name__ == "__main__":
+    cli()  # pylint: disable=no-value-for-parameter
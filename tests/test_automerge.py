@@ -20,12 +20,62 @@ module) CLI and requires you to authenticate using `automerge login`
 
 *test_merge*: test merge command
 
+*test_schedule*: test conflict-aware merge ordering
+
+*test_merge_retry*: test transient scan failures are retried next cycle
+
+*test_merge_queue*: test PRs are handed to merge queues in one mutation
+
+*test_execute_timeout*: test hung commands are killed & retryable
+
+*test_hedger*: test slow calls are hedged within budget
+
+*test_col_print*: test long lists are laid out in columns & truncated
+
+*test_merge_from*: test listed PRs are merged without discovering the account
+
+*test_profile*: test phases are timed & attributed to repos
+
+*test_daemon_info*: test info is answered from a warm daemon
+
+*test_digest*: test a cycle's events are batched in one message
+
+*test_version*: test the version is only resolved when asked for
+
+*test_startup*: test CLI startup doesn't import heavy dependencies
+
+*test_no_daemon*: test the daemon isn't imported when none is running
+
 ***
 """
+import io
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
 import pytest
 from click.testing import CliRunner
 
-from automerge import merge, info
+import automerge
+from automerge import merge, info, digest, version
+from automerge.daemon import Daemon, _Server, request
+from automerge.utils import (
+    _schedule,
+    _execute,
+    _retryable,
+    _timeout,
+    _stats,
+    _enqueue,
+    _merge_queue,
+    _merge_repo,
+    col_print,
+    Hedger,
+)
+from automerge.instrument import Profiler, phase
+from automerge.sim import MemorySimulator, generate, in_process
 
 MOCK_USER = "mergy"
 MOCK_REPO = "reppy"
@@ -224,7 +274,7 @@ MOCK_STATS = {
 @pytest.fixture
 def mock_stats(monkeypatch):
     """mock return of the _stats function"""
-    monkeypatch.setattr("automerge._stats", lambda x: MOCK_STATS)
+    monkeypatch.setattr("automerge._stats", lambda *args, **kwargs: MOCK_STATS)
 
 
 @pytest.fixture
@@ -245,3 +295,327 @@ def test_merge(mock_stats):  # pylint: disable=redefined-outer-name,unused-argum
     runner = CliRunner()
     result = runner.invoke(merge)
     assert "automerge: fetching GitHub data using gh" in result.stdout
+
+
+def test_schedule():
+    """test PRs sharing files are serialized smallest diff first"""
+    prs = [
+        {"number": 1, "files": ["poetry.lock"], "additions": 40, "deletions": 2},
+        {"number": 2, "files": ["poetry.lock"], "additions": 3, "deletions": 1},
+        {"number": 3, "files": [".github/workflows/test.yaml"], "additions": 1},
+        {"number": 4, "files": [], "additions": 1},
+    ]
+    waves = [[pr["number"] for pr in wave] for wave in _schedule(prs)]
+    assert waves == [[3, 2], [4], [1]]
+
+
+def test_merge_retry(monkeypatch):
+    """test a timed out scan is retried & failed repos are displayed"""
+    failed = {
+        "abmamo/mok": {
+            "stable_prs": [],
+            "unstable_prs": [],
+            "num_stable": 0,
+            "num_unstable": 0,
+            "error": "automerge: timed out\n",
+        },
+        "total_stable": 0,
+        "total_unstable": 0,
+        "stable_repos": [],
+        "unstable_repos": [],
+        "stable_prs": [],
+        "unstable_prs": [],
+        "neutral_repos": ["abmamo/mok"],
+    }
+    results = [b"automerge: timed out", failed]
+    sleeps = []
+    monkeypatch.setattr("automerge._stats", lambda *_, **__: results.pop(0))
+    monkeypatch.setattr("automerge.time.sleep", sleeps.append)
+    result = CliRunner().invoke(merge)
+    assert result.exit_code == 0, result.output
+    assert "error: automerge: timed out" in result.output
+    assert sleeps == [60] and not results
+    assert "FAILED REPO(s): 1" in result.output
+    assert "abmamo/mok: automerge: timed out" in result.output
+    # anything else won't fix itself, stop instead of retrying forever
+    results = [b"HTTP 404: Not Found"]
+    result = CliRunner().invoke(merge)
+    assert "HTTP 404" in result.output
+    assert sleeps == [60] and not results
+
+
+def test_merge_queue(monkeypatch):
+    """test PRs are enqueued in one mutation & partial failures are reported"""
+    queries = []
+
+    def graphql(query, **_):
+        queries.append(query)
+        if query.startswith("mutation"):
+            # partial failure: the mutation of PR 2 returned null
+            return {"pr1": {"mergeQueueEntry": {"position": 1}}, "pr2": None}
+        return {"repository": {"mergeQueue": {"url": "https://github.com/q"}}}
+
+    monkeypatch.setattr("automerge.utils._graphql", graphql)
+    monkeypatch.setattr("automerge.utils._MERGE_QUEUES", {})
+    prs = [
+        {"number": 1, "id": "PR_1"},
+        {"number": 2, "id": "PR_2"},
+        {"number": 3, "id": None},
+    ]
+    assert _enqueue(prs) == [(1, True), (2, False)]
+    assert _merge_queue("abmamo/mok") and _merge_queue("abmamo/mok")
+    queries.clear()
+    enqueued = set()
+    assert _merge_repo("abmamo/mok", prs, "auto", enqueued) == [
+        (1, "enqueued"),
+        (2, "failed"),
+    ]
+    assert enqueued == {("abmamo/mok", 1)}
+    assert len(queries) == 1
+    # PRs already in the queue aren't enqueued again
+    assert _merge_repo("abmamo/mok", prs[:1], "queue", enqueued) == []
+
+
+def test_execute_timeout(monkeypatch, capsys):
+    """test a hung command is killed with its process group"""
+    # malformed deadlines fall back to the default instead of crashing
+    monkeypatch.setenv("AUTOMERGE_TIMEOUT_PRS", "1m")
+    assert _timeout("prs") == 60.0
+    assert "AUTOMERGE_TIMEOUT_PRS" in capsys.readouterr().err
+    monkeypatch.setenv("AUTOMERGE_TIMEOUT_PRS", "0.5")
+    assert _timeout("prs") == 0.5
+    start = time.monotonic()
+    cmd_process, _, stderr = _execute(["sh", "-c", "sleep 30 & wait"], timeout=0.5)
+    assert time.monotonic() - start < 10
+    assert cmd_process.returncode != 0
+    assert _retryable(stderr)
+
+
+def test_hedger():
+    """test a call slower than the learned percentile is hedged"""
+    hedger = Hedger(percentile=0.5, budget=0.5, min_samples=3)
+    for _ in range(3):
+        assert hedger(lambda: "fast") == "fast"
+    calls = []
+
+    def straggler():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(2)
+            return "slow"
+        return "hedged"
+
+    start = time.monotonic()
+    assert hedger(straggler) == "hedged"
+    assert time.monotonic() - start < 1
+    assert hedger.hedges == 1
+
+
+def test_col_print(monkeypatch):
+    """test columns are padded to their widest item & past the limit counted"""
+    stream = io.StringIO()
+    col_print(["abmamo/mok", "abmamo/relok", "abmamo/teret"], stream=stream)
+    assert stream.getvalue().splitlines() == [
+        "------------  ------------",
+        "abmamo/mok    abmamo/relok",
+        "abmamo/teret",
+        "------------  ------------",
+    ]
+    stream = io.StringIO()
+    col_print([f"abmamo/repo{i}" for i in range(10000)], limit=10, stream=stream)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2 + 5 + 1
+    assert lines[-1].startswith("... 9990 more (10000 total")
+    # an invalid AUTOMERGE_DISPLAY_LIMIT falls back to the default
+    monkeypatch.setenv("AUTOMERGE_DISPLAY_LIMIT", "all")
+    stream = io.StringIO()
+    col_print([f"abmamo/repo{i}" for i in range(10000)], stream=stream)
+    assert stream.getvalue().splitlines()[-1].startswith("... 9800 more")
+
+
+def test_merge_from(monkeypatch, tmp_path):
+    """test a stream of PRs is checked in one lookup & only mergeable ones merged"""
+    monkeypatch.setenv("AUTOMERGE_SOCKET", str(tmp_path / "daemon.sock"))
+    simulator = MemorySimulator(generate(repos=2, unstable=0.5, pending=0.0, seed=1))
+    lines = [
+        "# PRs to merge",
+        "https://github.com/mergy/repo1/pull/1",
+        "mergy/repo1#2",
+        "https://github.com/mergy/repo1/pull/3/files",
+        "mergy/repo1#2",
+        "mergy/repo0#1",
+        "mergy/repo1#42",
+        "",
+        "repo1 2",
+    ]
+    with in_process(simulator), Profiler() as profiler:
+        result = CliRunner().invoke(
+            merge, ["--from", "-", "-o", "ndjson"], input="\n".join(lines)
+        )
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in result.output.splitlines()]
+    outcomes = {
+        (record["repo"], record["number"]): record["outcome"]
+        for record in records
+        if record["type"] == "merge"
+    }
+    assert outcomes == {
+        ("mergy/repo1", 1): "merged",
+        ("mergy/repo1", 2): "merged",
+        ("mergy/repo1", 3): "merged",
+        ("mergy/repo0", 1): "skipped",
+        ("mergy/repo1", 42): "skipped",
+    }
+    assert [record["type"] for record in records].count("error") == 1
+    rows = {row[0]: row for row in profiler.rows()}
+    assert rows["lookup"][1] == 1
+    assert "list" not in rows and "prs" not in rows
+    # a batch of invalid lines isn't mistaken for the end of the input
+    with in_process(simulator):
+        result = CliRunner().invoke(
+            merge,
+            ["--from", "-", "-o", "ndjson"],
+            input="\n".join(["repo1 4"] * 100 + ["mergy/repo0#2"]),
+        )
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [record["type"] for record in records].count("error") == 100
+    assert records[-1]["number"] == 2
+    # scan / plan / shard options would be silently ignored, refuse them
+    before = simulator.state()
+    for flags in (["--dry-run"], ["--plan"], ["-r", "mergy/repo1"]):
+        with in_process(simulator):
+            result = CliRunner().invoke(
+                merge, ["--from", "-", *flags], input="mergy/repo0#3"
+            )
+        assert result.exit_code == 2 and "can't be combined" in result.output
+    assert simulator.state()["repos"] == before["repos"]
+
+
+def test_profile():
+    """test phases are counted, timed & attributed to their repos"""
+    with Profiler() as profiler:
+        with phase("prs", "abmamo/mok"):
+            _execute(["echo", "hello"])
+        with phase("prs", "abmamo/relok"):
+            time.sleep(0.05)
+    # not observed anymore
+    _execute(["echo", "hello"])
+    rows = {row[0]: row for row in profiler.rows()}
+    assert rows["gh"][1] == 1 and rows["gh"][-1] == len(b"hello\n")
+    assert rows["prs"][1] == 2
+    assert profiler.slowest()[0][0] == "abmamo/relok"
+    assert "slowest repos" in profiler.report()
+
+
+def test_daemon_info(monkeypatch, tmp_path):
+    """test info is answered from the daemon's snapshot over its socket"""
+    monkeypatch.setenv("AUTOMERGE_SOCKET", str(tmp_path / "daemon.sock"))
+    resident = Daemon()
+    resident.snapshot = {
+        repo: MOCK_STATS[repo] for repo in ("abmamo/mok", "abmamo/relok")
+    }
+    server = _Server(str(tmp_path / "daemon.sock"), resident)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = request("info", repos=["abmamo/relok"], author="app/dependabot")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert list(response["stats"]["stable_repos"]) == ["abmamo/relok"]
+    assert response["stats"]["total_stable"] == 4
+    # another author's PRs aren't in the snapshot, info scans the account
+    resident.author = "renovate"
+    os.remove(tmp_path / "daemon.sock")
+    server = _Server(str(tmp_path / "daemon.sock"), resident)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scans = []
+    monkeypatch.setattr(
+        "automerge._stats", lambda *_, **kwargs: scans.append(kwargs) or MOCK_STATS
+    )
+    try:
+        result = CliRunner().invoke(info, ["-r", "abmamo/relok"])
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert result.exit_code == 0, result.output
+    assert [scan["author"] for scan in scans] == ["app/dependabot"]
+    # the daemon's `dependabot` matches gh's `app/dependabot` bot login
+    simulator = MemorySimulator(generate(repos=3, seed=2))
+    with in_process(simulator):
+        cold = _stats()
+        resident = Daemon()
+        resident.refresh()
+        warm = resident.handle("info")["stats"]
+    assert cold["total_stable"] > 0
+    assert warm["total_stable"] == cold["total_stable"]
+    assert warm["total_unstable"] == cold["total_unstable"]
+
+
+def test_digest():
+    """test events are grouped by kind & an empty cycle sends nothing"""
+    assert digest([]) is None
+    message = digest(
+        [
+            {"kind": "merged", "repo": "abmamo/relok", "number": 34, "url": None},
+            {"kind": "failed", "repo": "abmamo/relok", "number": 33, "url": None},
+            {"kind": "merged", "repo": "abmamo/teret", "number": 36, "url": None},
+        ]
+    )
+    assert message.splitlines() == [
+        "Merged 2 PR(s): abmamo/relok#34, abmamo/teret#36",
+        "Failed to merge 1 PR(s): abmamo/relok#33",
+    ]
+
+
+def test_version():
+    """test importing automerge doesn't compute the version (runs git)"""
+    cmd = "import automerge; print('__version__' in vars(automerge))"
+    imported = subprocess.run(
+        [sys.executable, "-c", cmd], capture_output=True, check=True, text=True
+    )
+    assert imported.stdout.strip() == "False"
+    result = CliRunner().invoke(version)
+    assert result.exit_code == 0
+    assert result.stdout.strip() == automerge.__version__
+
+
+@pytest.mark.parametrize("command", ["version", "login --help", "info --help"])
+def test_startup(command):
+    """test light commands run without importing rich / requests / tabulate"""
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "from automerge import cli\n"
+        "try:\n"
+        f"    cli({command.split()!r})\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "heavy = ('rich', 'requests', 'tabulate', 'automerge.daemon')\n"
+        "print([module for module in heavy if module in sys.modules])\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    started = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, check=True, text=True
+    )
+    *_, heavy, elapsed = started.stdout.strip().splitlines()
+    assert heavy == "[]"
+    # generous bound, catches an eagerly imported dependency tree
+    assert float(elapsed) < 2
+
+
+def test_no_daemon(tmp_path):
+    """test the daemon module is only imported if a daemon socket exists"""
+    script = (
+        "import sys\n"
+        "import automerge\n"
+        "print(automerge._daemon_request('info', repos=[]))\n"
+        "print('automerge.daemon' in sys.modules)\n"
+    )
+    started = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        text=True,
+        env={**os.environ, "AUTOMERGE_SOCKET": str(tmp_path / "daemon.sock")},
+    )
+    assert started.stdout.split() == ["None", "False"]
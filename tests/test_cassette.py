@@ -0,0 +1,112 @@
+"""
+tests for automerge cassettes
+
+***
+
+**tests**
+
+***
+
+*test_replay*: test recorded gh traffic is served back without gh
+
+*test_webhook*: test recorded HTTP traffic is served back offline
+
+*test_notifications*: test a run's notifications are recorded & replayed
+offline
+
+***
+"""
+import json
+import time
+import socket
+
+from click.testing import CliRunner
+
+from automerge import cli
+from automerge.cassette import record, replay
+from automerge.notify import WebhookNotifier
+from automerge.sim import MemorySimulator, Simulator, generate, in_process
+from automerge.sim.server import serve
+from automerge.utils import _stats, _merge_repo, _execute
+
+
+def test_replay(tmp_path):
+    """test a recorded scan & merge are replayed identically & in order"""
+    cassette = str(tmp_path / "cassette.jsonl.gz")
+    simulator = MemorySimulator(generate(repos=3, unstable=0.3, pending=0.0))
+    with in_process(simulator), record(cassette):
+        recorded = _stats(author="app/dependabot")
+        merged = _merge_repo(
+            "mergy/repo0", recorded["mergy/repo0"]["stable_prs"], backend="direct"
+        )
+        rescanned = _stats(author="app/dependabot")
+    # no simulator: every call is served from the cassette
+    with replay(cassette, speed=0) as player:
+        assert _stats(author="app/dependabot") == recorded
+        assert (
+            _merge_repo(
+                "mergy/repo0", recorded["mergy/repo0"]["stable_prs"], backend="direct"
+            )
+            == merged
+        )
+        assert _stats(author="app/dependabot") == rescanned
+        assert player.remaining() == 0
+        _, _, stderr = _execute(["gh", "repo", "list"])
+        assert stderr.startswith(b"automerge: not on the cassette")
+
+
+def test_webhook(tmp_path):
+    """test webhook responses & their durations are replayed"""
+    path = str(tmp_path / "state.json")
+    with open(path, "w", encoding="utf-8") as state_file:
+        json.dump(generate(repos=1), state_file)
+    server, url = serve(path)
+    cassette = str(tmp_path / "cassette.jsonl")
+    try:
+        with record(cassette):
+            status = WebhookNotifier(f"{url}/hooks/ops").send([{"kind": "merged"}])
+    finally:
+        server.shutdown()
+    assert len(Simulator(path).state()["webhooks"]) == 1
+    with replay(cassette, speed=1.0):
+        started = time.monotonic()
+        replayed = WebhookNotifier(f"{url}/hooks/ops").send([{"kind": "merged"}])
+    with open(cassette, encoding="utf-8") as recorded:
+        interaction = json.loads(recorded.read())
+    assert time.monotonic() - started >= interaction["seconds"]
+    assert replayed.status_code == status.status_code
+    assert replayed.text == status.text
+
+
+def test_notifications(monkeypatch, tmp_path):
+    """test notifications sent after a run are still on its cassette"""
+    monkeypatch.setenv("AUTOMERGE_SOCKET", str(tmp_path / "daemon.sock"))
+    monkeypatch.setattr("automerge.time.sleep", lambda seconds: None)
+    path = str(tmp_path / "state.json")
+    with open(path, "w", encoding="utf-8") as state_file:
+        json.dump(generate(repos=1), state_file)
+    server, url = serve(path)
+    monkeypatch.setenv("AUTOMERGE_WEBHOOK_URL", f"{url}/hooks/ops")
+    cassette = str(tmp_path / "cassette.jsonl")
+    simulator = MemorySimulator(generate(repos=2, unstable=0.0, pending=0.0))
+    args = ["merge", "-a", "app/dependabot"]
+    try:
+        with in_process(simulator):
+            result = CliRunner().invoke(cli, ["--record", cassette, *args])
+    finally:
+        server.shutdown()
+    assert result.exit_code == 0, result.output
+    assert len(Simulator(path).state()["webhooks"]) == 1
+    with open(cassette, encoding="utf-8") as recorded:
+        kinds = [json.loads(line)["kind"] for line in recorded]
+    assert kinds.count("http") == 1
+    # the webhook sink is gone, replaying must not try to reach it
+    connects = []
+    monkeypatch.setattr(
+        socket.socket, "connect", lambda sock, address: connects.append(address)
+    )
+    result = CliRunner().invoke(
+        cli, ["--replay", cassette, "--replay-speed", "0", *args]
+    )
+    assert result.exit_code == 0, result.output
+    assert not connects
@@ -0,0 +1,89 @@
+"""
+tests for the automerge lease store & repo sharding
+
+***
+
+**tests**
+
+***
+
+*test_lease*: test leases are exclusive & fenced
+
+*test_shards*: test workers split repos & rebalance
+
+*test_shard_renewal*: test leases outlive their ttl during long passes
+
+*test_leader*: test a single leader is elected & fenced
+
+***
+"""
+import time
+
+from automerge.daemon import Daemon
+from automerge.lease import SQLiteLeaseStore, FileLeaseStore, Shard, Leader
+
+REPOS = [f"abmamo/repo{num}" for num in range(100)]
+
+
+def test_lease(tmp_path):
+    """test a live lease can't be taken & a new holder gets a new token"""
+    store = SQLiteLeaseStore(str(tmp_path / "leases.db"))
+    assert store.acquire("repo/abmamo/mok", "one", 60) == 1
+    assert store.acquire("repo/abmamo/mok", "two", 60) is None
+    assert store.acquire("repo/abmamo/mok", "one", 60) == 1
+    store.release("repo/abmamo/mok", "one")
+    assert store.acquire("repo/abmamo/mok", "two", 60) == 2
+    assert store.holders("repo/") == {"repo/abmamo/mok": "two"}
+
+
+def test_shards(tmp_path):
+    """test every repo is owned by exactly one live worker"""
+    store = SQLiteLeaseStore(str(tmp_path / "leases.db"))
+    one, two = Shard(store, "one"), Shard(store, "two")
+    one.heartbeat()
+    two.heartbeat()
+    one.heartbeat()
+    owned = [[repo for repo in REPOS if shard.owns(repo)] for shard in (one, two)]
+    assert sorted(owned[0] + owned[1]) == sorted(REPOS)
+    assert owned[0] and owned[1]
+    assert one.lease(owned[0][0]) is not None
+    assert two.lease(owned[0][0]) is None
+    two.leave()
+    one.heartbeat()
+    assert all(one.owns(repo) for repo in REPOS)
+
+
+def test_shard_renewal(tmp_path):
+    """test a pass longer than the ttl keeps the worker & its repo leases"""
+    store = SQLiteLeaseStore(str(tmp_path / "leases.db"))
+    one, two = Shard(store, "one", ttl=0.6), Shard(store, "two", ttl=0.6)
+    one.heartbeat()
+    assert one.lease("abmamo/mok") is not None
+    # e.g. a slow scan or a merge that keeps retrying
+    time.sleep(1.5)
+    assert two.heartbeat() == ["one", "two"]
+    assert two.lease("abmamo/mok") is None
+    assert store.holders("repo/") == {"repo/abmamo/mok": "one"}
+    one.leave()
+    time.sleep(0.5)
+    assert store.holders() == {"worker/two": "two"}
+    two.leave()
+
+
+def test_leader(tmp_path):
+    """test only one instance leads & a deposed leader is fenced off"""
+    store = FileLeaseStore(str(tmp_path / "leader.json"))
+    active, standby = Leader(store, "active"), Leader(store, "standby")
+    assert active.elect()
+    assert not standby.elect()
+    assert active.valid()
+    token = active.token
+    active.resign()
+    assert standby.elect()
+    assert standby.token == token + 1
+    assert not active.valid()
+    # a standby refuses merges instead of silently merging nothing
+    assert Daemon(leader=active).handle("merge", repos=["abmamo/mok"]) == {
+        "error": "standby"
+    }
+    standby.resign()
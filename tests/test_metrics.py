@@ -0,0 +1,51 @@
+"""
+tests for the automerge Prometheus metrics
+
+***
+
+**tests**
+
+***
+
+*test_histogram*: test observations are bucketed cumulatively
+
+*test_endpoint*: test a cycle's metrics are served on /metrics
+
+***
+"""
+import urllib.request
+
+from automerge import metrics
+from automerge.utils import _execute
+from tests.test_automerge import MOCK_STATS
+
+
+def test_histogram():
+    """test histogram buckets are cumulative & labels are escaped"""
+    histogram = metrics.Histogram("latency", "test latency", [1, 5], ("repo",))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value, 'abmamo/"mok"')
+    rendered = histogram.render()
+    assert 'latency_bucket{repo="abmamo/\\"mok\\"",le="1"} 2' in rendered
+    assert 'latency_bucket{repo="abmamo/\\"mok\\"",le="5"} 3' in rendered
+    assert 'latency_bucket{repo="abmamo/\\"mok\\"",le="+Inf"} 4' in rendered
+    assert 'latency_sum{repo="abmamo/\\"mok\\""} 14.5' in rendered
+
+
+def test_endpoint():
+    """test cycle stats, merges & gh latencies are exported"""
+    server = metrics.serve(0)
+    try:
+        _execute(["echo", "hello"])
+        metrics.record_cycle(MOCK_STATS, ["merged", "merged", "failed"], 42.0)
+        metrics.record_rate_limit({"core": {"limit": 5000, "remaining": 4321}})
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=10) as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+    assert 'automerge_merges_total{outcome="merged"}' in body
+    assert 'automerge_prs{state="stable"}' in body
+    assert "automerge_gh_duration_seconds_count" in body
+    assert 'automerge_rate_limit_remaining{resource="core"} 4321' in body
+    assert "automerge_retry_queue_depth 0" in body
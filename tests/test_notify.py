@@ -0,0 +1,102 @@
+"""
+tests for automerge notifications
+
+***
+
+**tests**
+
+***
+
+*test_dispatcher*: test messages are retried & flushed
+
+*test_dispatcher_full*: test a full queue never blocks the caller
+
+*test_hub*: test events fan out to sinks & duplicates are coalesced
+
+*test_from_env*: test an invalid coalescing window falls back to the default
+
+***
+"""
+import json
+import time
+import threading
+
+from automerge.notify import Dispatcher, FileNotifier, Hub, Notifier, from_env
+
+
+class MockResponse:  # pylint: disable=too-few-public-methods
+    """minimal stand-in for requests.Response"""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_dispatcher():
+    """test a rate limited message is retried & delivered before flush returns"""
+    responses = [MockResponse(429, {"Retry-After": "0"}), MockResponse(200)]
+    sent, delivered = [], []
+
+    def send(message):
+        sent.append(message)
+        return responses.pop(0)
+
+    def on_response(response):
+        # a slow handler still runs before flush returns
+        time.sleep(0.2)
+        delivered.append(response)
+
+    dispatcher = Dispatcher(send, min_interval=0, on_response=on_response)
+    dispatcher.submit(("Automerge", "Merged 1 PR(s)"))
+    assert dispatcher.flush(timeout=5)
+    assert sent == [("Automerge", "Merged 1 PR(s)")] * 2
+    assert delivered[0].status_code == 200
+
+
+def test_dispatcher_full():
+    """test submitting to a full queue drops the oldest message instead"""
+    release = threading.Event()
+    dispatcher = Dispatcher(
+        lambda message: release.wait() and MockResponse(200),
+        maxsize=1,
+        min_interval=0,
+    )
+    start = time.monotonic()
+    for num in range(5):
+        dispatcher.submit(num)
+    assert time.monotonic() - start < 1
+    assert dispatcher.dropped >= 3
+    release.set()
+    assert dispatcher.flush(timeout=5)
+
+
+def test_hub(tmp_path):
+    """test every sink gets each event once within the coalescing window"""
+    batches = []
+
+    class ListNotifier(Notifier):  # pylint: disable=too-few-public-methods
+        """collect batches in memory"""
+
+        def send(self, events):
+            batches.append(events)
+
+    hub = Hub([ListNotifier(), FileNotifier(str(tmp_path / "events.jsonl"))], window=60)
+    unstable = {"kind": "unstable", "repo": "abmamo/mok", "number": 65}
+    merged = {"kind": "merged", "repo": "abmamo/relok", "number": 34}
+    hub.notify([unstable])
+    hub.notify([unstable, merged])
+    hub.notify([unstable])
+    assert all(queued.flush(timeout=5) for queued in hub.dispatchers)
+    assert batches == [[unstable], [merged]]
+    with open(tmp_path / "events.jsonl", encoding="utf-8") as events_file:
+        lines = [json.loads(line) for line in events_file]
+    assert [line["number"] for line in lines] == [65, 34]
+
+
+def test_from_env(monkeypatch, capsys):
+    """test a malformed AUTOMERGE_COALESCE_WINDOW warns instead of crashing"""
+    monkeypatch.setenv("AUTOMERGE_COALESCE_WINDOW", "1h")
+    assert from_env().coalesce.window == 3600
+    assert "AUTOMERGE_COALESCE_WINDOW" in capsys.readouterr().err
+    monkeypatch.setenv("AUTOMERGE_COALESCE_WINDOW", "60")
+    assert from_env().coalesce.window == 60
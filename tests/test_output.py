@@ -0,0 +1,81 @@
+"""
+tests for the automerge machine-readable output
+
+***
+
+**tests**
+
+***
+
+*test_info_ndjson*: test info streams one record per repo & PR
+
+*test_json_array*: test json output is a single array
+
+*test_diagnostics*: test diagnostics never land among the records
+
+***
+"""
+import io
+import json
+
+from click.testing import CliRunner
+
+from automerge import info
+from automerge.notify import SlackNotifier, flush
+from automerge.output import Writer
+from automerge.utils import _merge
+from automerge.sim import MemorySimulator, generate, in_process
+
+
+def test_info_ndjson(monkeypatch, tmp_path):
+    """test info streams repo & PR records instead of rendering tables"""
+    monkeypatch.setenv("AUTOMERGE_SOCKET", str(tmp_path / "daemon.sock"))
+    simulator = MemorySimulator(generate(repos=3, unstable=0.5, pending=0.0))
+    with in_process(simulator):
+        result = CliRunner().invoke(info, ["--output", "ndjson"])
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in result.output.splitlines()]
+    repos = [record for record in records if record["type"] == "repo"]
+    prs = [record for record in records if record["type"] == "pr"]
+    assert len(repos) == 3
+    assert sum(repo["stable"] + repo["unstable"] for repo in repos) == len(prs)
+    assert {pr["status"] for pr in prs} <= {"stable", "unstable"}
+
+
+def test_json_array():
+    """test json output is a valid array whether or not records were written"""
+    stream = io.StringIO()
+    Writer("json", stream).close()
+    assert json.loads(stream.getvalue()) == []
+    stream = io.StringIO()
+    writer = Writer("json", stream)
+    writer.write({"type": "error", "message": "rate limited"})
+    writer.write({"type": "error", "message": "bad credentials"})
+    writer.close()
+    writer.close()
+    assert [record["message"] for record in json.loads(stream.getvalue())] == [
+        "rate limited",
+        "bad credentials",
+    ]
+
+
+class MockResponse:  # pylint: disable=too-few-public-methods
+    """minimal stand-in for requests.Response"""
+
+    status_code, reason = 200, "OK"
+
+
+def test_diagnostics(monkeypatch, tmp_path, capsys):
+    """test notification responses & merge give-ups are printed to stderr"""
+    monkeypatch.setenv("AUTOMERGE_SOCKET", str(tmp_path / "daemon.sock"))
+    monkeypatch.setenv("SLACK_WEBHOOK_URL", "https://hooks.slack.com/services/x")
+    monkeypatch.setattr(SlackNotifier, "send", lambda self, events: MockResponse())
+    monkeypatch.setattr("automerge._stats", lambda *args, **kwargs: b"rate limited")
+    info.callback(repos=(), verbose=False, output="ndjson")
+    assert flush(timeout=5)
+    assert _merge("mergy/repo1", 1, retries=6) is None
+    captured = capsys.readouterr()
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert records == [{"type": "error", "message": "rate limited"}]
+    assert "Response: 200,OK" in captured.err
+    assert "Couldn't merge 1" in captured.err
@@ -0,0 +1,113 @@
+"""
+tests for automerge merge plans
+
+***
+
+**tests**
+
+***
+
+*test_plan*: test lanes follow the backend & waves of every repo
+
+*test_lookups*: test merge queue detections are part of the estimate
+
+*test_dry_run*: test a dry run estimates the merges without merging
+
+***
+"""
+import json
+
+from click.testing import CliRunner
+
+from automerge import merge
+from automerge.plan import build, estimate, report
+from automerge.sim import MemorySimulator, generate, in_process
+
+
+def _pr(number, files, additions=1):
+    """a stable PR touching *files*"""
+    return {
+        "number": number,
+        "id": f"PR_{number}",
+        "files": files,
+        "additions": additions,
+    }
+
+
+STATS = {
+    "abmamo/mok": {
+        "stable_prs": [
+            _pr(1, ["poetry.lock"]),
+            _pr(2, ["poetry.lock"], additions=5),
+            _pr(3, ["Dockerfile"]),
+        ]
+    },
+    "abmamo/relok": {"stable_prs": [_pr(4, ["package-lock.json"])]},
+    "abmamo/teret": {"stable_prs": []},
+}
+
+
+def test_plan():
+    """test conflicting PRs are serialized & the cost follows the lanes"""
+    lanes = build(STATS, backend="direct")
+    assert lanes == [
+        {
+            "repo": "abmamo/mok",
+            "backend": "direct",
+            "waves": [[1, 3], [2]],
+            "lookups": 0,
+        },
+        {"repo": "abmamo/relok", "backend": "direct", "waves": [[4]], "lookups": 0},
+    ]
+    cost = estimate(lanes, 0.5, {"graphql": {"remaining": 20}})
+    # a merge looks the PR up, merges it & deletes its branch
+    assert cost["merges"] == cost["subprocesses"] == 4
+    assert cost["api_calls"] == 12
+    assert cost["worst_api_calls"] == 72
+    # three rounds of merges, lanes one after the other
+    assert cost["seconds"] == 1.5
+    assert "exhaust the rate limit" in report(lanes, cost)
+    lanes = build(STATS, backend="queue")
+    assert estimate(lanes, 0.5)["api_calls"] == 2
+
+
+def test_lookups(monkeypatch):
+    """test the merge queue detection of `auto` is counted once per repo"""
+    queries = []
+
+    def graphql(_, **variables):
+        queries.append(variables["name"])
+        return {"repository": {"mergeQueue": {"url": "https://github.com/q"}}}
+
+    monkeypatch.setattr("automerge.utils._graphql", graphql)
+    cache = {"abmamo/relok": False}
+    monkeypatch.setattr("automerge.utils._MERGE_QUEUES", cache)
+    monkeypatch.setattr("automerge.plan._MERGE_QUEUES", cache)
+    lanes = build(STATS, backend="auto")
+    assert [(lane["backend"], lane["lookups"]) for lane in lanes] == [
+        ("queue", 1),
+        ("direct", 0),
+    ]
+    cost = estimate(lanes, 0.5)
+    assert queries == ["mok"] and cost["lookups"] == 1
+    # the detection, the enqueue mutation & one direct merge
+    assert cost["subprocesses"] == 3 and cost["api_calls"] == 1 + 1 + 3
+
+
+def test_dry_run(monkeypatch, tmp_path):
+    """test a dry run only reads: the plan is printed & nothing is merged"""
+    monkeypatch.setenv("AUTOMERGE_SOCKET", str(tmp_path / "daemon.sock"))
+    simulator = MemorySimulator(generate(repos=4, unstable=0.0, pending=0.0))
+    before = json.dumps(simulator.state()["repos"], sort_keys=True)
+    with in_process(simulator):
+        result = CliRunner().invoke(
+            merge, ["--dry-run", "--plan", "-a", "app/dependabot", "-o", "ndjson"]
+        )
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in result.output.splitlines()]
+    plans = [record for record in records if record["type"] == "plan"]
+    (cost,) = [record for record in records if record["type"] == "estimate"]
+    assert len(plans) == cost["repos"] == 4
+    assert cost["merges"] == 12 and cost["remaining"] is not None
+    assert not [record for record in records if record["type"] == "merge"]
+    assert json.dumps(simulator.state()["repos"], sort_keys=True) == before
@@ -0,0 +1,155 @@
+"""
+tests for automerge repo selectors
+
+***
+
+**tests**
+
+***
+
+*test_match*: test names, owners, globs, regexes, topics & negations
+
+*test_invalid*: test invalid selectors are rejected
+
+*test_pushdown*: test owner / topic / archived filters are listed server-side
+
+*test_repo_limit*: test accounts past the listing limit are fully listed or
+warned about
+
+*test_explicit*: test explicit repos are looked up once, never listed & typos
+reported
+
+***
+"""
+import copy
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from automerge import merge
+from automerge.instrument import Profiler
+from automerge.selector import Selector
+from automerge.sim import MemorySimulator, generate, in_process
+from automerge.utils import _repos, _stats
+
+
+def test_match():
+    """test every kind of term & that negations win"""
+    selector = Selector(
+        ["abmamo/mok, owner:mergy", "abmamo/*.sh re:^abmamo/(relok|teret)$"]
+        + ["topic:infra", "!abmamo/habits.sh !mergy/repo1"]
+    )
+    selected = [
+        "abmamo/mok",
+        "mergy/repo0",
+        "abmamo/ferry.sh",
+        "abmamo/relok",
+        "abmamo/teret",
+    ]
+    for repo in selected:
+        assert selector.match(repo), repo
+    for repo in ("abmamo/habits.sh", "mergy/repo1", "abmamo/thesis", "other/mok"):
+        assert not selector.match(repo), repo
+    assert selector.match("abmamo/thesis", topics=["infra"])
+    assert Selector(["abmamo/"]).match("abmamo/anything")
+    assert Selector(["!abmamo/mok"]).match("abmamo/relok")
+    assert not Selector(["is:archived"]).match("abmamo/mok", archived=False)
+    assert Selector(["abmamo/mok", "abmamo/relok"]).exact == {
+        "abmamo/mok",
+        "abmamo/relok",
+    }
+    assert Selector(["abmamo/*"]).exact is None
+    assert Selector(["re:relok"]).exact is None
+    # regexes keep their inline flags & their own group numbers
+    assert Selector(["re:(?i)^ABMAMO/MOK$"]).match("abmamo/mok")
+    backreference = Selector(["abmamo/*.sh", r"re:^(\w+)/\1$"])
+    assert backreference.match("abmamo/abmamo")
+    assert not backreference.match("abmamo/relok")
+
+
+@pytest.mark.parametrize("term", ["mok", "re:(unclosed"])
+def test_invalid(term):
+    """test bare names & broken regexes are rejected"""
+    with pytest.raises(ValueError):
+        Selector([term])
+
+
+def _account():
+    """300 repos of mergy & 5 of other (2 tagged infra, 1 archived)"""
+    state = generate(repos=300, unstable=0.0, pending=0.0)
+    for index in range(5):
+        repo = copy.deepcopy(state["repos"][f"mergy/repo{index}"])
+        state["repos"][f"other/repo{index}"] = repo
+    state["repos"]["other/repo0"]["topics"] = ["infra"]
+    state["repos"]["mergy/repo7"]["topics"] = ["infra"]
+    state["repos"]["other/repo1"]["archived"] = True
+    return MemorySimulator(state)
+
+
+def test_pushdown():
+    """test a narrow selector only lists (& fetches) what it selects"""
+    simulator = _account()
+    with in_process(simulator):
+        assert len(_repos(["owner:other"])) == 5
+        # one page for other's 5 repos (mergy's 300 would take 3)
+        assert simulator.counters()["api_calls"] == 1
+        assert _repos(["topic:infra"]) == ["mergy/repo7", "other/repo0"]
+        assert _repos(["other/*", "!is:archived"]) == [
+            "other/repo0",
+            "other/repo2",
+            "other/repo3",
+            "other/repo4",
+        ]
+        before = simulator.counters()["api_calls"]
+        stats = _stats(["other/repo3", "other/repo[34]"], author="app/dependabot")
+        assert sorted(stats["stable_repos"]) == ["other/repo3", "other/repo4"]
+        # one page listing other's repos & the PRs of 2 repos
+        assert simulator.counters()["api_calls"] - before == 3
+
+
+def test_repo_limit(monkeypatch, capsys):
+    """test listings aren't capped at 1000 repos & a hit cap is reported"""
+    simulator = MemorySimulator(generate(repos=1500, seed=3))
+    with in_process(simulator):
+        assert len(_repos()) == 1500
+        assert "AUTOMERGE_REPO_LIMIT" not in capsys.readouterr().err
+        monkeypatch.setenv("AUTOMERGE_REPO_LIMIT", "1000")
+        assert len(_repos()) == 1000
+    assert "first 1000 repos only" in capsys.readouterr().err
+
+
+def test_explicit(monkeypatch, tmp_path):
+    """test merging explicit repos costs one lookup, not an account listing"""
+    monkeypatch.setenv("AUTOMERGE_SOCKET", str(tmp_path / "daemon.sock"))
+    monkeypatch.setattr("automerge.time.sleep", lambda seconds: None)
+    simulator = _account()
+    with in_process(simulator):
+        # names are case-insensitive & come back as GitHub spells them
+        assert _repos(["other/repo2", "Mergy/Repo3"]) == ["mergy/repo3", "other/repo2"]
+        assert simulator.counters()["api_calls"] == 1
+        assert _stats(["Mergy/Repo3"], inventory=["mergy/repo3"])["stable_repos"]
+        # a typo is reported instead of quietly selecting nothing
+        assert _repos(["mergy/repo3", "mergy/missing"]) == (
+            "repo(s) not found: mergy/missing"
+        )
+        typo = CliRunner().invoke(merge, ["-r", "mergy/missing", "-o", "ndjson"])
+        assert json.loads(typo.output) == {
+            "type": "error",
+            "message": "repo(s) not found: mergy/missing",
+        }
+        with Profiler() as profiler:
+            result = CliRunner().invoke(
+                merge, ["-r", "mergy/repo3,other/repo2", "-a", "app/dependabot"]
+            )
+    assert result.exit_code == 0, result.output
+    rows = {row[0]: row for row in profiler.rows()}
+    assert "list" not in rows
+    # the lookup also told which repos have a merge queue
+    assert rows["lookup"][1] == 1 and rows["graphql"][1] == 1
+    # merged, or set to auto-merge once a conflicting merge's checks rerun
+    assert all(
+        pr["state"] == "MERGED" or pr.get("auto_merge")
+        for repo in ("mergy/repo3", "other/repo2")
+        for pr in simulator.state()["repos"][repo]["prs"]
+    )
@@ -0,0 +1,81 @@
+"""
+tests for the hermetic GitHub simulator
+
+***
+
+**tests**
+
+***
+
+*test_fake_gh*: test stats & merges run end to end against a fake gh
+
+*test_merge_queue*: test the queue backend against a fake gh
+
+*test_server*: test the HTTP stand-in records & rate limits webhooks
+
+***
+"""
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from automerge.sim import Simulator, fake_gh
+from automerge.sim.server import serve
+from automerge.utils import _stats, _merge_repo, _MERGE_QUEUES
+
+
+def test_fake_gh(tmp_path):
+    """test stats & direct merges only touch the simulated account"""
+    Simulator.create(tmp_path / "state.json", repos=5, unstable=0.0, pending=0.0)
+    with fake_gh(tmp_path / "state.json") as simulator:
+        stats = _stats(author="app/dependabot")
+        assert stats["total_stable"] == 15
+        prs = stats["mergy/repo0"]["stable_prs"]
+        results = _merge_repo("mergy/repo0", prs, backend="direct")
+        assert {outcome for _, outcome in results} == {"merged"}
+        counters = simulator.counters()
+    # 1 repo list + 5 PR lists + 3 merges
+    assert counters["subprocesses"] == 9
+    assert counters["api_calls"] == 9
+
+
+def test_merge_queue(tmp_path):
+    """test PRs are enqueued in a single call where a repo has a merge queue"""
+    Simulator.create(tmp_path / "state.json", repos=1, queues=1.0, unstable=0.0)
+    _MERGE_QUEUES.clear()
+    with fake_gh(tmp_path / "state.json") as simulator:
+        prs = _stats(author="app/dependabot")["mergy/repo0"]["stable_prs"]
+        results = _merge_repo("mergy/repo0", prs)
+        assert results and {outcome for _, outcome in results} == {"enqueued"}
+        assert len(simulator.state()["repos"]["mergy/repo0"]["queue"]) == len(prs)
+    _MERGE_QUEUES.clear()
+
+
+def test_server(tmp_path):
+    """test webhook posts are recorded & answered with a 429 when too fast"""
+    Simulator.create(tmp_path / "state.json", repos=1)
+    server, url = serve(str(tmp_path / "state.json"), webhook_interval=60)
+
+    def post(path, body):
+        return urllib.request.urlopen(  # pylint: disable=consider-using-with
+            urllib.request.Request(
+                url + path,
+                data=json.dumps(body).encode(),
+                headers={"content-type": "application/json"},
+            ),
+            timeout=10,
+        )
+
+    try:
+        assert post("/hooks/slack", {"text": "merged"}).status == 200
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post("/hooks/slack", {"text": "merged"})
+        assert error.value.code == 429
+        with urllib.request.urlopen(url + "/rate_limit", timeout=10) as response:
+            assert json.load(response)["resources"]["core"]["limit"] == 5000
+    finally:
+        server.shutdown()
+    webhooks = Simulator(str(tmp_path / "state.json")).state()["webhooks"]
+    assert webhooks == [{"hook": "slack", "payload": {"text": "merged"}}]
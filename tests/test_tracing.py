@@ -0,0 +1,59 @@
+"""
+tests for automerge trace spans
+
+***
+
+**tests**
+
+***
+
+*test_cycle_trace*: test a cycle is exported as one trace of nested spans
+
+***
+"""
+import json
+
+from automerge.instrument import phase
+from automerge.notify import Dispatcher
+from automerge.sim import MemorySimulator, generate, in_process
+from automerge.tracing import Tracer
+from automerge.utils import _stats, _merge_repo
+
+
+def test_cycle_trace(tmp_path):
+    """test scan, merge (threaded) & notification spans nest under the cycle"""
+    simulator = MemorySimulator(generate(repos=2, unstable=0.0, pending=0.0))
+    dispatcher = Dispatcher(lambda message: None, min_interval=0.0)
+    tracer = Tracer(str(tmp_path / "trace.jsonl")).start()
+    try:
+        with in_process(simulator), phase("cycle"):
+            stats = _stats(author="app/dependabot")
+            for repo in ("mergy/repo0", "mergy/repo1"):
+                _merge_repo(repo, stats[repo]["stable_prs"], backend="direct")
+            dispatcher.submit(("title", "merged"))
+            assert dispatcher.flush(10)
+    finally:
+        tracer.stop()
+    exports = [
+        json.loads(line) for line in (tmp_path / "trace.jsonl").read_text().splitlines()
+    ]
+    spans = [
+        span
+        for export in exports
+        for resource in export["resourceSpans"]
+        for scope in resource["scopeSpans"]
+        for span in scope["spans"]
+    ]
+    assert len({span["traceId"] for span in spans}) == 1
+    by_id = {span["spanId"]: span for span in spans}
+    roots = [span for span in spans if not span["parentSpanId"]]
+    assert [root["name"] for root in roots] == ["cycle"]
+
+    def parent(span):
+        return by_id[span["parentSpanId"]]["name"]
+
+    names = {span["name"] for span in spans}
+    assert {"stats", "list", "prs", "classify", "merge", "gh", "notify"} <= names
+    assert {parent(span) for span in spans if span["name"] == "merge"} == {"cycle"}
+    assert {parent(span) for span in spans if span["name"] == "prs"} == {"stats"}
+    assert {parent(span) for span in spans if span["name"] == "notify"} == {"cycle"}
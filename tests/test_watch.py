@@ -0,0 +1,78 @@
+"""
+tests for the automerge live dashboard
+
+***
+
+**tests**
+
+***
+
+*test_changes*: test what changed in a repo between refreshes is described
+
+*test_watch*: test refreshes reuse the inventory, only fetch repos that
+changed & highlight changed rows
+
+***
+"""
+import io
+
+from rich.console import Console
+
+from automerge.instrument import Profiler
+from automerge.sim import MemorySimulator, generate, in_process
+from automerge.watch import Dashboard, watch
+
+
+def _repo_stats(stable=(), unstable=(), error=None):
+    """repo stats with the given stable / unstable PR numbers"""
+    repo_stats = {
+        "stable_prs": [{"number": number} for number in stable],
+        "unstable_prs": [{"number": number} for number in unstable],
+        "num_stable": len(stable),
+        "num_unstable": len(unstable),
+    }
+    if error is not None:
+        repo_stats["error"] = error
+    return repo_stats
+
+
+def test_changes():
+    """test only rows that changed since the previous refresh are marked"""
+    dashboard = Dashboard()
+    dashboard.begin(["abmamo/mok", "abmamo/relok"])
+    dashboard.update("abmamo/mok", _repo_stats(stable=[1]))
+    dashboard.update("abmamo/relok", _repo_stats(unstable=[2]))
+    assert not dashboard.changed
+    dashboard.begin(["abmamo/mok", "abmamo/relok"])
+    dashboard.update("abmamo/mok", _repo_stats(stable=[1]))
+    dashboard.update("abmamo/relok", _repo_stats(stable=[2, 3], error="timed out"))
+    assert dashboard.changed == {"abmamo/relok": "+2 stable, -1 unstable, error"}
+    assert not dashboard.pending
+
+
+def test_watch():
+    """test pending PRs turning stable are picked up by later refreshes"""
+    simulator = MemorySimulator(generate(repos=3, unstable=0.0, pending=1.0))
+    output = io.StringIO()
+    with in_process(simulator), Profiler() as profiler:
+        dashboard = watch(
+            interval=0, refreshes=3, console=Console(file=output, width=120)
+        )
+    assert dashboard.refreshes == 3
+    assert len(dashboard.rows) == 3
+    assert sum(row["num_stable"] for row in dashboard.rows.values()) == 9
+    # the repos are only listed once, later refreshes look up what changed
+    # in one query & only fetch the PRs of repos whose checks finished
+    rows = {row[0]: row for row in profiler.rows()}
+    assert rows["list"][1] == 1 and rows["lookup"][1] == 3
+    assert 3 < rows["prs"][1] < 9
+    assert "refresh 3, 3/3 repo(s) fetched" in output.getvalue()
+    # nothing changes in a settled account, nothing is fetched again
+    simulator = MemorySimulator(generate(repos=3, unstable=0.5, pending=0.0))
+    with in_process(simulator), Profiler() as profiler:
+        dashboard = watch(
+            interval=0, refreshes=3, console=Console(file=io.StringIO(), width=120)
+        )
+    rows = {row[0]: row for row in profiler.rows()}
+    assert rows["prs"][1] == 3 and rows["lookup"][1] == 3
+    assert len(dashboard.rows) == 3 and not dashboard.pending